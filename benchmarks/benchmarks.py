@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017-2018, UChicago Argonne, LLC. All rights reserved.    #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+
+"""Benchmarks of the tomography and coverage kernels.
+
+The benchmarks follow the conventions of airspeed velocity (asv), so they can
+be run and tracked across commits with ``asv run`` from the root of the
+repository. They may also be run without asv with ``python -m
+benchmarks.run``, which reports the throughput in rays and voxels per second
+and the peak resident memory of each case.
+
+Each problem is a cube grid scanned by a rectangular probe. At each angle,
+the probe is rastered across the width of the grid, so the number of rays
+grows with the grid size, the number of angles, and the probe size.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import tike.tomo
+# The function shadows the module in the tike namespace
+from tike.coverage import coverage
+
+__author__ = "Daniel Ching"
+__copyright__ = "Copyright (c) 2018, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+# The sweeps of the parameters of the problems
+GRID_SIZES = [32, 128]
+ANGLE_COUNTS = [32, 128]
+PROBE_SHAPES = [(1, 1), (16, 4)]
+ANGULAR_BINS = [1, 8]
+ALGORITHMS = ['art', 'sirt']
+NITER = 2
+
+
+def tomo_problem(ngrid, nangle, probe_shape, seed=0):
+    """Return the arguments of :py:func:`tike.tomo.forward` for a problem.
+
+    The grid is (V, ngrid, ngrid) where V is the height of the probe.
+
+    Returns
+    -------
+    kwargs : dict
+        The obj, obj_min, probe, theta, h, v of the problem.
+    nray : int
+        The number of rays of the problem.
+    """
+    H, V = probe_shape
+    shape = (V, ngrid, ngrid)
+    np.random.seed(seed)
+    obj = np.random.rand(*shape).astype('float32')
+    obj_min = -np.array(shape) / 2.0
+    # Raster the probe across the grid at each angle
+    nstep = int(np.ceil(ngrid / H))
+    theta = np.repeat(np.linspace(0, np.pi, nangle, endpoint=False), nstep)
+    h = np.tile(obj_min[2] + np.arange(nstep) * H, nangle)
+    v = np.full(theta.shape, obj_min[0])
+    kwargs = dict(obj=obj, obj_min=obj_min, probe=np.ones(probe_shape),
+                  theta=theta, h=h, v=v)
+    return kwargs, theta.size * H * V
+
+
+def coverage_problem(ngrid, nangle, probe_shape, nbin):
+    """Return the arguments of :py:func:`tike.coverage.coverage` for a
+    problem with the same geometry as :py:func:`tomo_problem`.
+
+    Returns
+    -------
+    args : tuple
+        The arguments of :py:func:`tike.coverage.coverage`.
+    nray : int
+        The number of rays of the problem.
+    """
+    kwargs, nray = tomo_problem(ngrid, nangle, probe_shape)
+    shape = kwargs['obj'].shape
+    args = (np.zeros(shape + (nbin, )), kwargs['obj_min'], shape,
+            kwargs['probe'], probe_shape,
+            kwargs['theta'], kwargs['h'], kwargs['v'])
+    return args, nray
+
+
+class Forward(object):
+    """Compute the line integrals of a grid."""
+    params = (GRID_SIZES, ANGLE_COUNTS, PROBE_SHAPES)
+    param_names = ['ngrid', 'nangle', 'probe_shape']
+
+    def setup(self, ngrid, nangle, probe_shape):
+        self.kwargs, self.nray = tomo_problem(ngrid, nangle, probe_shape)
+
+    def time_forward(self, ngrid, nangle, probe_shape):
+        tike.tomo.forward(**self.kwargs)
+
+    def peakmem_forward(self, ngrid, nangle, probe_shape):
+        tike.tomo.forward(**self.kwargs)
+
+
+class Reconstruct(object):
+    """Reconstruct a grid from its line integrals."""
+    params = (GRID_SIZES, ANGLE_COUNTS, PROBE_SHAPES, ALGORITHMS)
+    param_names = ['ngrid', 'nangle', 'probe_shape', 'algorithm']
+
+    def setup(self, ngrid, nangle, probe_shape, algorithm):
+        self.kwargs, self.nray = tomo_problem(ngrid, nangle, probe_shape)
+        self.kwargs['line_integrals'] = tike.tomo.forward(**self.kwargs)
+        self.kwargs['obj'] = np.zeros_like(self.kwargs['obj'])
+
+    def time_reconstruct(self, ngrid, nangle, probe_shape, algorithm):
+        tike.tomo.reconstruct(algorithm=algorithm, niter=NITER,
+                              **self.kwargs)
+
+    def peakmem_reconstruct(self, ngrid, nangle, probe_shape, algorithm):
+        tike.tomo.reconstruct(algorithm=algorithm, niter=NITER,
+                              **self.kwargs)
+
+
+class Coverage(object):
+    """Compute an angular coverage map."""
+    params = (GRID_SIZES, ANGLE_COUNTS, PROBE_SHAPES, ANGULAR_BINS)
+    param_names = ['ngrid', 'nangle', 'probe_shape', 'nbin']
+
+    def setup(self, ngrid, nangle, probe_shape, nbin):
+        self.args, self.nray = coverage_problem(ngrid, nangle, probe_shape,
+                                                nbin)
+
+    def time_coverage(self, ngrid, nangle, probe_shape, nbin):
+        coverage(*self.args)
+
+    def peakmem_coverage(self, ngrid, nangle, probe_shape, nbin):
+        coverage(*self.args)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# #########################################################################
+# Copyright (c) 2017-2018, UChicago Argonne, LLC. All rights reserved.    #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+
+"""Run the benchmarks without asv and report their throughput and memory.
+
+Each case runs in a new process, so that the peak resident memory reported
+for a case is not inflated by the cases before it. The time of a case is the
+best of several repeats, and it includes tracing the rays, because the
+one-off functions trace them on every call.
+
+Example
+-------
+Sweep every case and also save the results as JSON::
+
+    python -m benchmarks.run --json results.json
+
+Only the smallest problems of the forward projection::
+
+    python -m benchmarks.run --quick --kernel forward
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import timeit
+
+from . import benchmarks
+
+__author__ = "Daniel Ching"
+__copyright__ = "Copyright (c) 2018, UChicago Argonne, LLC."
+__docformat__ = 'restructuredtext en'
+
+KERNELS = {
+    'forward': benchmarks.Forward,
+    'reconstruct': benchmarks.Reconstruct,
+    'coverage': benchmarks.Coverage,
+}
+
+
+def _peak_rss():
+    """Return the peak resident memory of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _run_case(kernel, params, repeat):
+    """Time one case of a kernel in this process.
+
+    Returns
+    -------
+    result : dict
+        The seconds of the best repeat, the rays and voxels per second, and
+        the peak resident memory in bytes.
+    """
+    logging.getLogger('tike').setLevel(logging.WARNING)
+    case = KERNELS[kernel]()
+    case.setup(*params)
+    method = getattr(case, 'time_' + kernel)
+    seconds = min(timeit.repeat(lambda: method(*params), number=1,
+                                repeat=repeat))
+    if kernel == 'coverage':
+        nvoxel = case.args[0][..., 0].size
+    else:
+        nvoxel = case.kwargs['obj'].size
+    # Reconstructions visit every ray and voxel once per iteration
+    npass = benchmarks.NITER if kernel == 'reconstruct' else 1
+    return dict(kernel=kernel,
+                params=dict(zip(case.param_names, params)),
+                seconds=seconds,
+                rays_per_second=npass * case.nray / seconds,
+                voxels_per_second=npass * nvoxel / seconds,
+                peak_rss=_peak_rss())
+
+
+def _cases(kernels, quick=False):
+    """Yield the (kernel, params) of every case of the kernels."""
+    for kernel in kernels:
+        params = KERNELS[kernel].params
+        if quick:
+            params = [values[0:1] for values in params[0:3]] + list(params[3:])
+        for case in itertools.product(*params):
+            yield kernel, case
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--kernel', action='append', choices=sorted(KERNELS),
+                        help="Only run this kernel; may be repeated.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Report the best of this many runs of a case.")
+    parser.add_argument('--quick', action='store_true',
+                        help="Only run the smallest problem sizes.")
+    parser.add_argument('--json', help="Also save the results to this file.")
+    args = parser.parse_args(argv)
+    kernels = args.kernel or ['forward', 'reconstruct', 'coverage']
+    print("{:<12} {:<56} {:>9} {:>11} {:>11} {:>9}".format(
+          'kernel', 'params', 'seconds', 'rays/s', 'voxels/s', 'peak MB'))
+    results = list()
+    # A new process for each case, so the peak memory is its own
+    context = multiprocessing.get_context('spawn')
+    for kernel, params in _cases(kernels, args.quick):
+        pool = context.Pool(1, maxtasksperchild=1)
+        try:
+            result = pool.apply(_run_case, (kernel, params, args.repeat))
+        finally:
+            pool.close()
+            pool.join()
+        results.append(result)
+        print("{:<12} {:<56} {:>9.4f} {:>11.3g} {:>11.3g} {:>9.1f}".format(
+              kernel,
+              ", ".join("{}={}".format(k, v)
+                        for k, v in result['params'].items()),
+              result['seconds'], result['rays_per_second'],
+              result['voxels_per_second'], result['peak_rss'] / 2**20))
+        sys.stdout.flush()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
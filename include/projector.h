@@ -0,0 +1,423 @@
+#ifndef _projector_h
+#define _projector_h
+
+#include <stdint.h>
+
+// Flags of the compress argument of projector_new
+#define PROJECTOR_COMPRESS 1
+#define PROJECTOR_HALF_LENGTHS 2
+
+/** @brief The wall times and counters of the work done by a projector.
+
+The times are in seconds. Forward and back projections by streaming or
+compressed projectors include tracing or decompressing their blocks, so
+trace_seconds may overlap them.
+
+@param trace_seconds Tracing lines through the grid.
+@param sort_seconds Sorting the intersections by pixel or compressing them.
+@param forward_seconds Forward projections.
+@param back_seconds Back projections and coverage maps.
+@param update_seconds Solvers outside of forward and back projections.
+@param lines_traced The number of lines traced.
+@param intersections The number of intersections produced by tracing.
+@param bytes_allocated The bytes allocated for intersections, norms, and
+       work buffers.
+@param iterations The number of solver iterations completed.
+*/
+typedef struct projector_stats
+{
+    double trace_seconds;
+    double sort_seconds;
+    double forward_seconds;
+    double back_seconds;
+    double update_seconds;
+    int64_t lines_traced;
+    int64_t intersections;
+    int64_t bytes_allocated;
+    int64_t iterations;
+} projector_stats;
+
+/** @brief A cached system matrix for a fixed scan geometry.
+
+The intersections of the rays described by theta, h, and v with the grid are
+computed once when the projector is created and reused by every projection
+until the projector is freed.
+
+The coordinates of the grid are (z, x, y). The lines are all perpendicular
+to the z direction. Theta is the angle from the x-axis using the right hand
+rule. v is parallel to z, and h is parallel to y when theta is zero.
+
+The rays are not stored. The probe is a grid of ncolumn by nrow rays, and at
+each of the npos positions, the ray through probe column i and row j is at
+(theta, h + dh[i], v + dv[j]). Its line integral is element
+(position * ncolumn + i) * nrow + j of the data. Probe pixels with zero
+weight in the mask are skipped.
+
+Because the rays are perpendicular to z, rays which share (theta, h) cross
+the same (x, y) pixels with the same lengths in every z slice. The
+positions are grouped into position lines of the same (theta, h), and the
+intersections are stored once for each line; the pair of a position line and
+a probe column. A second copy of the intersections sorted by pixel is kept
+for back projection.
+
+Projections and reconstructions may have several channels, such as the
+delta and beta of the refractive index or a batch of volumes. The channels
+are the fastest varying dimension of obj and data, and all of the channels
+are accumulated in a single pass over the intersections.
+
+If compress is nonzero, the intersections are cached in a compressed format
+instead: the pixels of each line are 16-bit differences from the previous
+pixel, and the lengths may be half precision floats. Compressed lines are
+decompressed a block at a time when they are used, and there is no pixel
+sorted copy, so back projections scatter instead of gather.
+
+If block_size is positive, the intersections are not cached. Instead, every
+projection traces block_size lines at a time, applies them, and discards them,
+so memory is bounded by the block size instead of the number of
+intersections.
+
+Counts of rays, lines, and intersections and the offsets into the
+intersections are 64-bit, so the number of intersections is limited only by
+memory. Pixel indices in the (x, y) plane are int.
+
+@param zmin, xmin, ymin The minimum coordinates of the grid.
+@param zsize, xsize, ysize The size of the grid.
+@param nz, nx, ny The number of grid spaces along the grid.
+@param nposline The number of unique (theta, h) positions.
+@param theta, h The coordinates of each position line.
+@param npos The number of positions of the probe.
+@param v The vertical coordinate of each position.
+@param pos_start[k] The start of the block of pos_index for the kth position
+       line.
+@param pos_index The positions sorted by position line.
+@param ncolumn, nrow The shape of the probe.
+@param dh, dv The offsets of the probe columns and rows.
+@param mask Whether each probe pixel has nonzero weight or NULL if all do.
+@param nactive The number of probe columns with a nonzero weight.
+@param column The indices of the probe columns with a nonzero weight.
+@param nline The number of lines; nposline * nactive. Line l is column
+       column[l % nactive] at position line l / nactive.
+@param line_start[l] The start of the block of pixels and lengths for the
+       lth line; line_start[nline] is the number of intersections.
+@param pixels The linear index in the (x, y) plane of pixels that intersect
+       lines.
+@param lengths The intersections lengths at each pixel.
+@param compress The PROJECTOR_COMPRESS and PROJECTOR_HALF_LENGTHS flags of
+       the storage of the intersections or 0 if they are not compressed.
+@param word_start[l] The start of the block of words for the lth line when
+       compressed.
+@param words The compressed pixels of the lines.
+@param half_lengths The lengths as half precision floats when
+       PROJECTOR_HALF_LENGTHS is set; lengths is not used.
+@param pixel_start[j] The start of the block of pixel_lines and pixel_lengths
+       for the jth pixel of the (x, y) plane; the same intersections as
+       pixels and lengths sorted by pixel instead of by line. Only when the
+       intersections are cached uncompressed.
+@param pixel_lines The lines that cross each pixel in increasing order.
+@param pixel_lengths The intersection lengths of pixel_lines.
+@param nray The number of rays; npos * ncolumn * nrow.
+@param block_size The number of lines to trace at a time or 0 to cache all
+       of the intersections.
+@param ray_norms, ray_sums, pixel_counts The row sums of the squared system
+       matrix, the row sums, and the column counts. These depend only on the
+       geometry, so they are computed once when first needed.
+@param norm The squared operator norm of the system matrix or 0 if it has not
+       been estimated yet.
+@param stats The times and counters of the work done by the projector. They
+       are behind a pointer, so kernels which take a const projector can
+       count their work.
+@param work_channels The number of channels of the work buffers.
+@param ray_work, grid_work Work buffers for the solvers; one value per ray
+       or per pixel for each channel. Allocated when first needed.
+@param slice_work, slice_size The sums and counts of the data of each line
+       in each slice for the back projections, and their sizes. Grown when a
+       back projection needs more, so they are reused by every iteration.
+*/
+typedef struct projector
+{
+    float zmin, xmin, ymin;
+    float zsize, xsize, ysize;
+    int nz, nx, ny;
+    int64_t nposline;
+    float *theta;
+    float *h;
+    int64_t npos;
+    float *v;
+    int64_t *pos_start;
+    int64_t *pos_index;
+    int ncolumn, nrow;
+    float *dh;
+    float *dv;
+    unsigned char *mask;
+    int nactive;
+    int *column;
+    int64_t nline;
+    int64_t *line_start;
+    int *pixels;
+    float *lengths;
+    int compress;
+    int64_t *word_start;
+    uint16_t *words;
+    uint16_t *half_lengths;
+    int64_t *pixel_start;
+    int64_t *pixel_lines;
+    float *pixel_lengths;
+    int64_t nray;
+    int64_t block_size;
+    float *ray_norms;
+    float *ray_sums;
+    int *pixel_counts;
+    double norm;
+    projector_stats *stats;
+    int work_channels;
+    float *ray_work[2];
+    float *grid_work[2];
+    float *slice_work[2];
+    int64_t slice_size[2];
+} projector;
+
+/* @brief Allocate a projector and compute the intersections of the rays
+          with the grid.
+
+@param min The minimum coordinates of the grid.
+@param size The size of the grid.
+@param n The number of grid spaces along the grid.
+@param theta, h The coordinates of each unique position line.
+@param nposline The size of theta, h.
+@param position_line The index of the position line of each position. If
+       NULL, then each position is its own position line and nposline must
+       equal npos.
+@param v The vertical coordinate of each position.
+@param npos The size of position_line, v.
+@param dh, dv The offsets of the columns and rows of the probe.
+@param ncolumn, nrow The size of dh, dv.
+@param mask The (ncolumn, nrow) probe pixels to use. Rays through zero
+       pixels are skipped. May be NULL to use all of the probe.
+@param compress 0 to cache the intersections uncompressed or
+       PROJECTOR_COMPRESS to cache them compressed, optionally with
+       PROJECTOR_HALF_LENGTHS to also store the lengths at half precision.
+       Ignored when block_size is positive.
+@param block_size The number of lines to trace at a time or 0 to trace and
+       cache all of the lines now.
+@return A projector which must be released with projector_free or NULL if
+        the (x, y) plane of the grid has more than INT_MAX pixels or the
+        intersections could not be allocated.
+*/
+projector *
+projector_new(
+    const float zmin, const float xmin, const float ymin,
+    const float zsize, const float xsize, const float ysize,
+    const int nz, const int nx, const int ny,
+    const float * const theta, const float * const h, const int64_t nposline,
+    const int64_t * const position_line,
+    const float * const v, const int64_t npos,
+    const float * const dh, const int ncolumn,
+    const float * const dv, const int nrow,
+    const unsigned char * const mask,
+    const int compress,
+    const int64_t block_size);
+
+/* @brief Release the memory held by a projector.
+*/
+void
+projector_free(
+    projector *p);
+
+/* @brief Add the line integrals of obj along each ray to data.
+
+@param obj The weights of the grid being integrated over.
+@param data The line integrals; one for each ray.
+@param nchannel The number of channels of obj and data.
+@return 0 on success or -1 if memory could not be allocated.
+*/
+int
+projector_forward(
+    const projector * const p,
+    const float * const obj,
+    float * const data,
+    const int nchannel);
+
+/* @brief Add the back projection of data along each ray to obj.
+
+Each pixel gathers from the rays that cross it, so the pixels are computed in
+parallel without atomics.
+
+@param data The weight of each ray.
+@param obj The grid to project over.
+@param nchannel The number of channels of obj and data.
+@return 0 on success or -1 if memory could not be allocated.
+*/
+int
+projector_back(
+    projector * const p,
+    const float * const data,
+    float * const obj,
+    const int nchannel);
+
+/* @brief Algebraic Reconstruction Technique
+
+A row-action (Kaczmarz) method: each ray is projected and the model is
+immediately corrected along that ray before the next ray is projected.
+
+The lines are processed in groups called ranges. The ranges are processed in
+the given order, and the lines of each range in increasing order.
+
+@param data The measured line integral of each ray.
+@param init The initial guess of the reconstruction
+@param nchannel The number of channels of data and init.
+@param niter The number of passes over all of the rays
+@param relax The relaxation parameter; 1 for classic ART.
+@param nrange The number of ranges of lines.
+@param range_start[k] The first line of the kth range; range_start[nrange] is
+       one past the last line.
+@param order The indices of the ranges in the order they are processed.
+@return 0 on success or -1 if memory could not be allocated.
+*/
+int
+projector_art(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float relax,
+    const int nrange, const int64_t * const range_start,
+    const int * const order);
+
+/* @brief Ordered-Subsets Simultaneous Algebraic Reconstruction Technique
+
+The ranges of lines are grouped into subsets. For each subset, the update
+from all of its rays is computed simultaneously and applied to the model
+before the next subset is projected.
+
+@param data The measured line integral of each ray.
+@param init The initial guess of the reconstruction
+@param nchannel The number of channels of data and init.
+@param niter The number of passes over all of the subsets
+@param relax The relaxation parameter.
+@param nrange, range_start, order See projector_art.
+@param nsubset The number of subsets.
+@param subset_start[s] The first index in order of the sth subset;
+       subset_start[nsubset] is the number of ranges used.
+@return 0 on success or -1 if memory could not be allocated.
+*/
+int
+projector_sart(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float relax,
+    const int nrange, const int64_t * const range_start,
+    const int * const order,
+    const int nsubset, const int * const subset_start);
+
+/* @brief Simultaneous Iterative Reconstruction Technique
+
+The relative residual, ||data - A init|| / ||data||, is computed at the
+start of each iteration, and the iterations stop early when it is not more
+than tol.
+
+@param data The measured line integral of each ray.
+@param init The initial guess of the reconstruction
+@param nchannel The number of channels of data and init.
+@param niter The maximum number of iterations of SIRT to complete
+@param tol Stop when the relative residual is not more than tol.
+@return residual The relative residual of the returned init. When all niter
+        iterations run, it costs one more forward projection. May be NULL.
+@return The number of iterations completed or -1 if memory could not be
+        allocated.
+*/
+int
+projector_sirt(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float tol,
+    float * const residual);
+
+/* @brief Conjugate Gradient Least Squares
+
+Minimize ||data - A init|| with the conjugate gradient method applied to the
+normal equations, A^T A init = A^T data, without forming A^T A. Each channel
+is solved with its own step sizes.
+
+@param data The measured line integral of each ray.
+@param init The initial guess of the reconstruction
+@param nchannel The number of channels of data and init.
+@param niter The maximum number of iterations of CGLS to complete
+@param tol Stop when the relative residual is not more than tol.
+@param resume If nonzero, continue the iterations of the last call instead
+       of restarting from init. The residual and search direction are kept
+       in the work buffers, so init and data must be as the last call left
+       them, and no other solver may have run on the projector since then.
+@return residual The relative residual of the returned init. May be NULL.
+@return The number of iterations completed or -1 if memory could not be
+        allocated.
+*/
+int
+projector_cgls(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float tol,
+    const int resume,
+    float * const residual);
+
+/* @brief Gradient descent
+
+Minimize ||data - A init||^2 / 2 by steps along the negative gradient. The
+step size is the inverse of the squared operator norm of A, which is
+estimated with a few iterations of the power method the first time it is
+needed and then kept by the projector.
+
+@param data The measured line integral of each ray.
+@param init The initial guess of the reconstruction
+@param nchannel The number of channels of data and init.
+@param niter The maximum number of iterations to complete
+@param tol Stop when the relative residual is not more than tol.
+@return residual The relative residual of the returned init. When all niter
+        iterations run, it costs one more forward projection. May be NULL.
+@return The number of iterations completed or -1 if memory could not be
+        allocated.
+*/
+int
+projector_grad(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float tol,
+    float * const residual);
+
+/* @brief Add the intersections of the rays with the grid to a coverage map
+          binned by the angle of the rays.
+
+@param weights The weight of each position; the intersection lengths of its
+       rays are multiplied by it.
+@param nbin The number of angular bins from 0 to PI.
+@param coverage_map The (nz, nx, ny, nbin) map to add to.
+@return 0 on success or -1 if memory could not be allocated.
+*/
+int
+projector_coverage(
+    const projector * const p,
+    const float * const weights,
+    const int nbin,
+    float * const coverage_map);
+
+/* @brief Copy the times and counters of the work done since the projector
+          was created.
+*/
+void
+projector_get_stats(
+    const projector * const p,
+    projector_stats * const stats);
+
+#endif
@@ -1,31 +1,37 @@
 #ifndef _siddon_h
 #define _siddon_h
 
-/* @brief Calculates the indices of the pixels and rays which intersect along
-          along with their lengths of intersection.
+#include <stdint.h>
 
-@param ozmin The minimum coordinate of grid in the z dimension.
-@param zsize The size of the grid in the z dimension.
-@param oz The number of pixels along the grid in the z dimension.
-@param theta[i] The angle of the ith ray.
-@param h[i] The horizontal position of the ith ray.
-@param v[i] The vertical position of the ith ray.
-@param dsize The size of theta, h, v. aka the number of rays.
+/* @brief Calculates the indices of the pixels in the (x, y) plane which
+          intersect each line along with their lengths of intersection.
+
+All of the rays in the 3D grid are perpendicular to z, so rays which share a
+(theta, h) intersect the same (x, y) pixels with the same lengths in every
+z slice. Tracing each unique line once and reusing it for every slice saves
+tracing time and memory.
+
+@param theta[i] The angle of the ith line.
+@param h[i] The horizontal position of the ith line.
+@param nline The size of theta, h. aka the number of lines.
 @param gridx The locations of grid lines along x dimension.
-@return pixels The linear index in the grid of pixels that intersect rays.
-@return rays The linear index of the rays which intersect the pixels.
+@return start[i] The start of the block of pixels and lengths for the ith
+        line; start[nline] is the total number of intersections.
+@return pixels The linear index in the (x, y) plane of pixels that intersect
+        the lines.
 @return lengths The intersections lengths at each pixel.
-@return psize The size of pixels and lengths.
+@return 0 on success or -1 if the plane of the grid is too large to index
+        with int or the intersections could not be allocated.
 */
-void
-get_pixel_indexes_and_lengths(
-    const float ozmin, const float oxmin, const float oymin,
-    const float zsize, const float xsize, const float ysize,
-    const int oz, const int ox, const int oy,
-    const float * const theta, const float * const h, const float * const v,
-    const int dsize,
+int
+get_line_pixels_and_lengths(
+    const float oxmin, const float oymin,
+    const float xsize, const float ysize,
+    const int ox, const int oy,
+    const float * const theta, const float * const h,
+    const int64_t nline,
     const float *gridx, const float *gridy,
-    int **pixels, int **rays, float **lengths, int *psize);
+    int64_t **start, int **pixels, float **lengths);
 
 /* @brief Returns 1 for first and third quadrants, 0 otherwise.
 */
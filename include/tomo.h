@@ -1,6 +1,10 @@
 #ifndef _tomo_h
 #define _tomo_h
 
+#include <stdint.h>
+
+#include "projector.h"
+
 /** @brief Computes line integrals across a 3D object.
 
 Computes the sum of the lengths * grid_weights of all intersections with
@@ -16,8 +20,10 @@ rule. v is parallel to z, and h is parallel to y when theta is zero.
 @param theta, h, v The coordinates of the line for each integral.
 @param dsize The size of theta, h, v.
 @param data The line integrals.
+@return 0 on success or -1 if the grid is too large or memory could not
+        be allocated.
 */
-void
+int
 forward_project(
     const float *obj_weights,
     const float zmin, const float xmin, const float ymin,
@@ -25,43 +31,61 @@ forward_project(
     const float *theta,
     const float *h,
     const float *v,
-    const int dsize,
+    const int64_t dsize,
     float *data);
 
 /* @brief Back project lines over a 4D grid where the 4th dimension is an
           an angular bin.
 
 coverage_map is an array of size (nz, nx, ny, nt) where each element of the
-array contains the sum of the lengths*line_weights of all intersections with
-the lines described by theta, h, and v. The sums are binned by angle of the
+array contains the sum of the lengths*weights of all intersections with
+the lines of the probe at each position. The sums are binned by angle of the
 line into `nt` bins from 0 to PI.
 
+The lines are not expanded in memory. The probe is a grid of ncolumn by nrow
+lines, and the line through column i and row j at a position is at
+(theta, h + dh[i], v + dv[j]). Probe pixels which are zero in mask are
+skipped.
+
 The coordinates of the grid are (z, x, y). The lines are all perpendicular
 to the z direction. Theta is the angle from the x-axis using the right hand
 rule. v is parallel to z, and h is parallel to y when theta is zero. The
 rotation axis is [0, 0, 1].
 
 @param min The minimum coordinates of the grid.
+@param size The size of the grid.
 @param n The number of grid spaces along the grid.
-@param theta, h, v The coordinates of the lines.
-@param line_weights The weight of each line in the integral.
-@param dsize The length of theta, h, v, line_weights.
+@param theta, h, v The coordinates of the probe at each position.
+@param weights The weight of each position in the integral.
+@param npos The length of theta, h, v, weights.
+@param dh, dv The offsets of the columns and rows of the probe.
+@param ncolumn, nrow The size of dh, dv.
+@param mask The (ncolumn, nrow) pixels of the probe to use or NULL for all.
 @param coverage_map The grid to project over.
+@param stats The times and counters of the work done or NULL.
+@return 0 on success or -1 if the grid is too large or memory could not
+        be allocated.
 */
-void
+int
 coverage(
     const float zmin, const float xmin, const float ymin,
     const float zsize, const float xsize, const float ysize,
     const int nz, const int nx, const int ny, const int nt,
-    const float *theta,
-    const float *h,
-    const float *v,
-    const float *line_weights,
-    const int dsize,
-    float *coverage_map);
+    const float * const theta,
+    const float * const h,
+    const float * const v,
+    const float * const weights,
+    const int64_t npos,
+    const float * const dh, const int ncolumn,
+    const float * const dv, const int nrow,
+    const unsigned char * const mask,
+    float *coverage_map,
+    projector_stats *stats);
 
 /* @brief Algebraic Reconstruction Technique
 
+A row-action method which updates init after projecting each line in order.
+
 @param min The minimum coordinates of the grid.
 @param size The width of the grid.
 @param n The number of grid spaces along the grid.
@@ -70,8 +94,10 @@ coverage(
 @param ndata The length of data, theta, h, and v
 @param init The initial guess of the reconstruction
 @param niter The number of iterations of ART to complete
+@return 0 on success or -1 if the grid is too large or memory could not
+        be allocated.
 */
-void
+int
 art(
     const float zmin, const float xmin, const float ymin,
     const int nz, const int nx, const int ny,
@@ -79,7 +105,31 @@ art(
     const float * const theta,
     const float * const h,
     const float * const v,
-    const int ndata,
+    const int64_t ndata,
+    float * const init,
+    const int niter);
+
+/* @brief Simultaneous Iterative Reconstruction Technique
+
+@param min The minimum coordinates of the grid.
+@param n The number of grid spaces along the grid.
+@param data The measured line integral of each line.
+@param theta, h, v The coordinates of the lines.
+@param ndata The length of data, theta, h, and v
+@param init The initial guess of the reconstruction
+@param niter The number of iterations of SIRT to complete
+@return 0 on success or -1 if the grid is too large or memory could not
+        be allocated.
+*/
+int
+sirt(
+    const float zmin, const float xmin, const float ymin,
+    const int nz, const int nx, const int ny,
+    const float * const data,
+    const float * const theta,
+    const float * const h,
+    const float * const v,
+    const int64_t ndata,
     float * const init,
     const int niter);
 
@@ -15,6 +15,14 @@ make_grid(
     const int nx,
     float * const gridx);
 
+/* @brief Return the index of the angular bin of theta
+
+Given nbins [0, PI), return i if theta goes in the i-th bin.
+*/
+int
+angle_bin(
+    const float theta, const int nbins);
+
 /* @brief Adds a magnitude to the appropriate angular bin
 
 Given nbins [0, PI), if theta is goes in the i-th bin, then magnitude is
@@ -4,7 +4,7 @@ from setuptools import setup, find_packages
 
 setup(
     name='tike',
-    packages=find_packages(exclude=['tests*']),
+    packages=find_packages(exclude=['tests*', 'benchmarks*']),
     use_scm_version=True,
     setup_requires=['setuptools_scm'],
     include_package_data=True,
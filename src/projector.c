@@ -0,0 +1,1877 @@
+#include <stdlib.h>
+#include <assert.h>
+#include <limits.h>
+#include <stdint.h>
+#include <math.h>
+#include <string.h>
+#include <time.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#include "projector.h"
+#include "siddon.h"
+#include "utils.h"
+
+// The number of power iterations used to estimate the operator norm
+#define POWER_ITERATIONS 10
+
+// The number of lines compressed or decompressed at a time
+#define COMPRESS_BLOCK_LINES 4096
+
+// The word which marks a pixel index that does not fit in a 16-bit delta
+#define PIXEL_ESCAPE 0x8000
+
+/* @brief Return the wall time in seconds from an arbitrary start.
+*/
+static double
+wall_time(void)
+{
+#ifdef _OPENMP
+    return omp_get_wtime();
+#else
+    struct timespec t;
+    timespec_get(&t, TIME_UTC);
+    return t.tv_sec + 1e-9 * t.tv_nsec;
+#endif
+}
+
+/* @brief Trace the lines [first, last) in the plane of the projector grid.
+
+@return 0 on success or -1 if the intersections could not be allocated.
+*/
+static int
+trace_lines(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    int64_t **start, int **pixels, float **lengths)
+{
+    const double begin = wall_time();
+    // Initialize the grid on object space.
+    float *gridx = malloc(sizeof *gridx * (p->nx+1));
+    float *gridy = malloc(sizeof *gridy * (p->ny+1));
+    // Expand the lines from the position lines and the probe columns
+    float *theta = malloc(sizeof *theta * (last - first));
+    float *h = malloc(sizeof *h * (last - first));
+    int status = -1;
+    if (gridx != NULL && gridy != NULL && theta != NULL && h != NULL)
+    {
+        make_grid(p->xmin, p->xsize, p->nx, gridx);
+        make_grid(p->ymin, p->ysize, p->ny, gridy);
+        for (int64_t l=first; l < last; l++)
+        {
+            const int64_t pl = l / p->nactive;
+            theta[l - first] = p->theta[pl];
+            h[l - first] = p->h[pl] + p->dh[p->column[l % p->nactive]];
+        }
+        status = get_line_pixels_and_lengths(
+            p->xmin, p->ymin,
+            p->xsize, p->ysize,
+            p->nx, p->ny,
+            theta, h,
+            last - first,
+            gridx, gridy,
+            start, pixels, lengths
+        );
+    }
+    free(gridx);
+    free(gridy);
+    free(theta);
+    free(h);
+    if (status == 0)
+    {
+        const int64_t nnz = (*start)[last - first];
+        p->stats->lines_traced += last - first;
+        p->stats->intersections += nnz;
+        p->stats->bytes_allocated += sizeof **start * (last - first + 1)
+            + (sizeof **pixels + sizeof **lengths) * nnz;
+    }
+    p->stats->trace_seconds += wall_time() - begin;
+    return status;
+}
+
+/* @brief Return the slice of the ray at position m through probe column i
+          and row j or -1 if the probe pixel is skipped or the ray misses
+          the grid.
+*/
+static int
+ray_slice(
+    const projector * const p,
+    const int64_t m, const int i, const int j)
+{
+    if (p->mask != NULL && !p->mask[i * p->nrow + j]) return -1;
+    const int zi = floor((p->v[m] + p->dv[j] - p->zmin)
+                         / (p->zsize / p->nz));
+    return ((0 <= zi) && (zi < p->nz)) ? zi : -1;
+}
+
+/* @brief Return the index in the data of the ray at position m through probe
+          column i and row j.
+*/
+static int64_t
+ray_index(
+    const projector * const p,
+    const int64_t m, const int i, const int j)
+{
+    return (m * p->ncolumn + i) * p->nrow + j;
+}
+
+/* @brief Build the pixel-major (compressed sparse column) copy of the cached
+          intersections.
+
+The lines which cross each pixel are in increasing order because the
+intersections are sorted by pixel with a stable counting sort.
+
+@return 0 on success or -1 if the copy could not be allocated.
+*/
+static int
+transpose_lines(
+    projector * const p)
+{
+    const double begin = wall_time();
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    const int64_t nnz = p->line_start[p->nline];
+    p->pixel_start = calloc(nxy+1, sizeof *p->pixel_start);
+    p->pixel_lines = malloc(sizeof *p->pixel_lines * nnz);
+    p->pixel_lengths = malloc(sizeof *p->pixel_lengths * nnz);
+    int64_t *count = calloc(nxy, sizeof *count);
+    if (p->pixel_start == NULL || count == NULL
+        || (nnz > 0 && (p->pixel_lines == NULL || p->pixel_lengths == NULL)))
+    {
+        free(count);
+        return -1;
+    }
+    for (int64_t n=0; n < nnz; n++)
+    {
+        p->pixel_start[p->pixels[n]+1]++;
+    }
+    for (int64_t j=0; j < nxy; j++)
+    {
+        p->pixel_start[j+1] += p->pixel_start[j];
+    }
+    for (int64_t l=0; l < p->nline; l++)
+    {
+        for (int64_t n=p->line_start[l]; n < p->line_start[l+1]; n++)
+        {
+            const int64_t j = p->pixels[n];
+            const int64_t m = p->pixel_start[j] + count[j]++;
+            p->pixel_lines[m] = l;
+            p->pixel_lengths[m] = p->lengths[n];
+        }
+    }
+    free(count);
+    p->stats->bytes_allocated += sizeof *p->pixel_start * (nxy+1)
+        + (sizeof *p->pixel_lines + sizeof *p->pixel_lengths) * nnz;
+    p->stats->sort_seconds += wall_time() - begin;
+    return 0;
+}
+
+/* @brief Convert a float to the bits of the nearest IEEE half precision
+          float.
+*/
+static uint16_t
+float_to_half(
+    const float value)
+{
+    uint32_t x;
+    memcpy(&x, &value, sizeof x);
+    const uint16_t sign = (x >> 16) & 0x8000;
+    x &= 0x7FFFFFFF;
+    // Overflow to infinity; keep NaN
+    if (x >= 0x47800000) return sign | ((x > 0x7F800000) ? 0x7E00 : 0x7C00);
+    // Underflow to zero
+    if (x < 0x33000000) return sign;
+    uint32_t half, rest, halfway;
+    if (x < 0x38800000)
+    {
+        // A subnormal half
+        const int shift = 126 - (int)(x >> 23);
+        const uint32_t mantissa = (x & 0x007FFFFF) | 0x00800000;
+        half = mantissa >> shift;
+        rest = mantissa & ((1u << shift) - 1);
+        halfway = 1u << (shift - 1);
+    }
+    else
+    {
+        // Rebias the exponent from 127 to 15
+        half = (x - 0x38000000) >> 13;
+        rest = x & 0x1FFF;
+        halfway = 0x1000;
+    }
+    // Round half to even; a carry correctly increments the exponent
+    if (rest > halfway || (rest == halfway && (half & 1))) half++;
+    return sign | (uint16_t)half;
+}
+
+/* @brief Convert the bits of an IEEE half precision float to a float.
+*/
+static float
+half_to_float(
+    const uint16_t half)
+{
+    const uint32_t sign = (uint32_t)(half & 0x8000) << 16;
+    const uint32_t exponent = (half >> 10) & 0x1F;
+    const uint32_t mantissa = half & 0x3FF;
+    uint32_t x;
+    if (exponent == 0x1F)
+    {
+        x = sign | 0x7F800000 | (mantissa << 13);
+    }
+    else if (exponent > 0)
+    {
+        x = sign | ((exponent + 112) << 23) | (mantissa << 13);
+    }
+    else
+    {
+        const float value = ldexpf((float)mantissa, -24);
+        return sign ? -value : value;
+    }
+    float value;
+    memcpy(&value, &x, sizeof value);
+    return value;
+}
+
+/* @brief Grow buffer to hold at least size items of item bytes.
+
+@return 0 on success or -1 if the buffer could not be grown.
+*/
+static int
+grow(
+    void **buffer, int64_t * const capacity,
+    const int64_t size, const size_t item)
+{
+    if (size <= *capacity) return 0;
+    int64_t larger = (*capacity > 0) ? *capacity : 1024;
+    while (larger < size) larger *= 2;
+    void *grown = realloc(*buffer, item * larger);
+    if (grown == NULL) return -1;
+    *buffer = grown;
+    *capacity = larger;
+    return 0;
+}
+
+/* @brief Trace all of the lines and store the intersections compressed.
+
+The pixels of each line are stored as 16-bit differences from the previous
+pixel of the line; the first pixel is a difference from 0. Consecutive pixels
+of a line are neighbors, so most differences are 1 or ny. A difference which
+does not fit is stored as PIXEL_ESCAPE followed by the low and high 16 bits
+of the pixel. If PROJECTOR_HALF_LENGTHS is set, the lengths are stored as
+half precision floats.
+
+The lines are traced in blocks, so the uncompressed intersections of only one
+block are held at a time.
+
+@return 0 on success or -1 if the intersections could not be allocated.
+*/
+static int
+compress_lines(
+    projector * const p)
+{
+    const int half = (p->compress & PROJECTOR_HALF_LENGTHS) != 0;
+    p->line_start = malloc(sizeof *p->line_start * (p->nline+1));
+    p->word_start = malloc(sizeof *p->word_start * (p->nline+1));
+    if (p->line_start == NULL || p->word_start == NULL) return -1;
+    p->line_start[0] = 0;
+    p->word_start[0] = 0;
+    int64_t word_capacity = 0, length_capacity = 0;
+    for (int64_t first=0; first < p->nline; first += COMPRESS_BLOCK_LINES)
+    {
+        const int64_t last = (first + COMPRESS_BLOCK_LINES < p->nline)
+                             ? first + COMPRESS_BLOCK_LINES : p->nline;
+        int64_t *start;
+        int *pixels;
+        float *lengths;
+        if (trace_lines(p, first, last, &start, &pixels, &lengths) != 0)
+        {
+            return -1;
+        }
+        const int64_t offset = p->line_start[first];
+        const int64_t nnz = start[last-first];
+        // Each intersection takes at most three words
+        int status = grow((void **)&p->words, &word_capacity,
+                          p->word_start[first] + 3 * nnz, sizeof *p->words);
+        if (half)
+        {
+            status |= grow((void **)&p->half_lengths, &length_capacity,
+                           offset + nnz, sizeof *p->half_lengths);
+        }
+        else
+        {
+            status |= grow((void **)&p->lengths, &length_capacity,
+                           offset + nnz, sizeof *p->lengths);
+        }
+        if (status != 0)
+        {
+            free(start);
+            free(pixels);
+            free(lengths);
+            return -1;
+        }
+        const double begin = wall_time();
+        int64_t w = p->word_start[first];
+        for (int64_t l=first; l < last; l++)
+        {
+            int previous = 0;
+            for (int64_t n=start[l-first]; n < start[l-first+1]; n++)
+            {
+                const int64_t delta = (int64_t)pixels[n] - previous;
+                if (-0x8000 < delta && delta < 0x8000)
+                {
+                    p->words[w++] = (uint16_t)(delta & 0xFFFF);
+                }
+                else
+                {
+                    p->words[w++] = PIXEL_ESCAPE;
+                    p->words[w++] = (uint16_t)(pixels[n] & 0xFFFF);
+                    p->words[w++] = (uint16_t)(pixels[n] >> 16);
+                }
+                previous = pixels[n];
+                if (half)
+                {
+                    p->half_lengths[offset + n] = float_to_half(lengths[n]);
+                }
+                else
+                {
+                    p->lengths[offset + n] = lengths[n];
+                }
+            }
+            p->line_start[l+1] = offset + start[l-first+1];
+            p->word_start[l+1] = w;
+        }
+        free(start);
+        free(pixels);
+        free(lengths);
+        p->stats->sort_seconds += wall_time() - begin;
+    }
+    // Release the unused capacity
+    const int64_t nword = p->word_start[p->nline];
+    if (nword > 0)
+    {
+        uint16_t *words = realloc(p->words, sizeof *p->words * nword);
+        if (words != NULL) p->words = words;
+    }
+    p->stats->bytes_allocated += (sizeof *p->line_start
+                                  + sizeof *p->word_start) * (p->nline+1)
+        + sizeof *p->words * nword
+        + ((half) ? sizeof *p->half_lengths : sizeof *p->lengths)
+          * p->line_start[p->nline];
+    return 0;
+}
+
+/* @brief Decompress the intersections of the lines [first, last).
+
+@return 0 on success or -1 if the block could not be allocated.
+*/
+static int
+decompress_lines(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    int64_t **start, int **pixels, float **lengths)
+{
+    const int64_t offset = p->line_start[first];
+    const int64_t nnz = p->line_start[last] - offset;
+    *start = malloc(sizeof **start * (last - first + 1));
+    *pixels = malloc(sizeof **pixels * (nnz + 1));
+    if (p->half_lengths != NULL)
+    {
+        *lengths = malloc(sizeof **lengths * (nnz + 1));
+    }
+    else
+    {
+        // The lengths are used in place
+        *lengths = &p->lengths[offset];
+    }
+    if (*start == NULL || *pixels == NULL || (nnz > 0 && *lengths == NULL))
+    {
+        free(*start);
+        free(*pixels);
+        if (p->half_lengths != NULL) free(*lengths);
+        return -1;
+    }
+    #pragma omp parallel for schedule(dynamic, 64)
+    for (int64_t l=first; l < last; l++)
+    {
+        (*start)[l-first] = p->line_start[l] - offset;
+        int pixel = 0;
+        int64_t w = p->word_start[l];
+        for (int64_t n=p->line_start[l]; n < p->line_start[l+1]; n++)
+        {
+            const uint16_t word = p->words[w++];
+            if (word == PIXEL_ESCAPE)
+            {
+                pixel = (int)((uint32_t)p->words[w]
+                              | ((uint32_t)p->words[w+1] << 16));
+                w += 2;
+            }
+            else
+            {
+                pixel += (word < 0x8000) ? (int)word : (int)word - 0x10000;
+            }
+            (*pixels)[n - offset] = pixel;
+            if (p->half_lengths != NULL)
+            {
+                (*lengths)[n - offset] = half_to_float(p->half_lengths[n]);
+            }
+        }
+    }
+    (*start)[last-first] = nnz;
+    p->stats->bytes_allocated += sizeof **start * (last - first + 1)
+        + sizeof **pixels * nnz
+        + ((p->half_lengths != NULL) ? sizeof **lengths * nnz : 0);
+    return 0;
+}
+
+/* @brief Return the number of lines in each block of the projector.
+*/
+static int64_t
+block_lines(
+    const projector * const p)
+{
+    if (p->block_size > 0) return p->block_size;
+    return (p->compress != 0) ? COMPRESS_BLOCK_LINES : p->nline;
+}
+
+/* @brief Get the intersections of the lines [first, last).
+
+The pixels and lengths of line l are in the range [start[l - first],
+start[l - first + 1]). When the projector is streaming, the block is traced
+now, and when it is compressed, the block is decompressed now. In both cases
+the block must be released with block_end.
+
+@return 0 on success or -1 if the block could not be allocated. Nothing
+        needs to be released on failure.
+*/
+static int
+block_begin(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    int64_t **start, int **pixels, float **lengths)
+{
+    if (p->block_size > 0)
+    {
+        return trace_lines(p, first, last, start, pixels, lengths);
+    }
+    else if (p->compress != 0)
+    {
+        return decompress_lines(p, first, last, start, pixels, lengths);
+    }
+    *start = &p->line_start[first];
+    *pixels = p->pixels;
+    *lengths = p->lengths;
+    return 0;
+}
+
+static void
+block_end(
+    const projector * const p,
+    int64_t *start, int *pixels, float *lengths)
+{
+    if (p->block_size > 0)
+    {
+        free(start);
+        free(pixels);
+        free(lengths);
+    }
+    else if (p->compress != 0)
+    {
+        free(start);
+        free(pixels);
+        if (p->half_lengths != NULL) free(lengths);
+    }
+}
+
+/* @brief Return a buffer of the workspace, allocating it filled with zeros
+          the first time it is requested, or NULL if it could not be
+          allocated.
+*/
+static float *
+workspace(
+    const projector * const p,
+    float **buffer, const size_t size)
+{
+    if (*buffer == NULL)
+    {
+        *buffer = calloc(size, sizeof **buffer);
+        if (*buffer == NULL) return NULL;
+        p->stats->bytes_allocated += sizeof **buffer * size;
+    }
+    return *buffer;
+}
+
+/* @brief Return slice_work[i] with at least size zeros, growing it if it is
+          smaller, or NULL if it could not be allocated.
+*/
+static float *
+slice_workspace(
+    projector * const p, const int i, const int64_t size)
+{
+    if (p->slice_size[i] < size)
+    {
+        free(p->slice_work[i]);
+        p->slice_work[i] = malloc(sizeof *p->slice_work[i] * size);
+        p->slice_size[i] = (p->slice_work[i] != NULL) ? size : 0;
+        if (p->slice_work[i] == NULL) return NULL;
+        p->stats->bytes_allocated += sizeof *p->slice_work[i] * size;
+    }
+    memset(p->slice_work[i], 0, sizeof *p->slice_work[i] * size);
+    return p->slice_work[i];
+}
+
+/* @brief Free the work buffers if they were sized for a different number of
+          channels.
+*/
+static void
+reserve_workspace(
+    projector * const p, const int nchannel)
+{
+    if (p->work_channels == nchannel) return;
+    for (int i=0; i < 2; i++)
+    {
+        free(p->ray_work[i]);
+        free(p->grid_work[i]);
+        p->ray_work[i] = NULL;
+        p->grid_work[i] = NULL;
+    }
+    p->work_channels = nchannel;
+}
+
+/* @brief Return the dot product of a and b in double precision.
+*/
+static double
+dot(
+    const float * const a, const float * const b, const int64_t size)
+{
+    double sum = 0;
+    #pragma omp parallel for reduction(+:sum)
+    for (int64_t i=0; i < size; i++)
+    {
+        sum += (double)a[i] * b[i];
+    }
+    return sum;
+}
+
+/* @brief Compute the dot product of each channel of a and b.
+
+@param size The number of elements in each channel.
+@param sums The nchannel dot products.
+*/
+static void
+dot_channels(
+    const float * const a, const float * const b,
+    const int64_t size, const int nchannel,
+    double * const sums)
+{
+    for (int c=0; c < nchannel; c++)
+    {
+        double sum = 0;
+        #pragma omp parallel for reduction(+:sum)
+        for (int64_t i=0; i < size; i++)
+        {
+            sum += (double)a[i * nchannel + c] * b[i * nchannel + c];
+        }
+        sums[c] = sum;
+    }
+}
+
+static float *ray_norms(const projector * const p, const int squared);
+static int *pixel_counts(const projector * const p);
+
+/* @brief Return the squared norm of each ray; computed on first use. NULL
+          if it could not be allocated.
+*/
+static const float *
+get_ray_norms(
+    projector * const p)
+{
+    if (p->ray_norms == NULL) p->ray_norms = ray_norms(p, 1);
+    return p->ray_norms;
+}
+
+/* @brief Return the sum of the lengths of each ray; computed on first use.
+          NULL if it could not be allocated.
+*/
+static const float *
+get_ray_sums(
+    projector * const p)
+{
+    if (p->ray_sums == NULL) p->ray_sums = ray_norms(p, 0);
+    return p->ray_sums;
+}
+
+/* @brief Return the number of intersections with each pixel; computed on
+          first use. NULL if it could not be allocated.
+*/
+static const int *
+get_pixel_counts(
+    projector * const p)
+{
+    if (p->pixel_counts == NULL) p->pixel_counts = pixel_counts(p);
+    return p->pixel_counts;
+}
+
+/* @brief Return the wall time minus the time spent projecting; the
+          difference of two of these is the time spent in between.
+*/
+static double
+update_time(
+    const projector * const p)
+{
+    return wall_time() - p->stats->forward_seconds - p->stats->back_seconds;
+}
+
+/* @brief Add the time since begin and the iterations of a solver to the
+          stats.
+*/
+static void
+solver_end(
+    projector * const p, const double begin, const int niter)
+{
+    p->stats->update_seconds += update_time(p) - begin;
+    p->stats->iterations += niter;
+}
+
+projector *
+projector_new(
+    const float zmin, const float xmin, const float ymin,
+    const float zsize, const float xsize, const float ysize,
+    const int nz, const int nx, const int ny,
+    const float * const theta, const float * const h, const int64_t nposline,
+    const int64_t * const position_line,
+    const float * const v, const int64_t npos,
+    const float * const dh, const int ncolumn,
+    const float * const dv, const int nrow,
+    const unsigned char * const mask,
+    const int compress,
+    const int64_t block_size)
+{
+    assert(nz > 0 && nx > 0 && ny > 0);
+    assert(zsize > 0 && xsize > 0 && ysize > 0);
+    assert(nposline >= 0 && npos >= 0 && "Data size must be a natural number");
+    assert(position_line != NULL || nposline == npos);
+    assert(ncolumn > 0 && nrow > 0);
+    assert(block_size >= 0);
+    // Pixels are indexed with int in the (x, y) plane
+    if ((int64_t)nx * ny > INT_MAX) return NULL;
+    projector *p = calloc(1, sizeof *p);
+    if (p == NULL) return NULL;
+    p->stats = calloc(1, sizeof *p->stats);
+    if (p->stats == NULL)
+    {
+        free(p);
+        return NULL;
+    }
+    p->zmin = zmin;
+    p->xmin = xmin;
+    p->ymin = ymin;
+    p->zsize = zsize;
+    p->xsize = xsize;
+    p->ysize = ysize;
+    p->nz = nz;
+    p->nx = nx;
+    p->ny = ny;
+    p->nposline = nposline;
+    p->npos = npos;
+    p->ncolumn = ncolumn;
+    p->nrow = nrow;
+    p->nray = npos * ncolumn * nrow;
+    p->block_size = block_size;
+    p->compress = (block_size == 0) ? compress : 0;
+    p->theta = malloc(sizeof *p->theta * (nposline+1));
+    p->h = malloc(sizeof *p->h * (nposline+1));
+    p->v = malloc(sizeof *p->v * (npos+1));
+    p->pos_start = calloc(nposline+1, sizeof *p->pos_start);
+    p->pos_index = malloc(sizeof *p->pos_index * (npos+1));
+    p->dh = malloc(sizeof *p->dh * ncolumn);
+    p->dv = malloc(sizeof *p->dv * nrow);
+    p->column = malloc(sizeof *p->column * ncolumn);
+    int64_t *count = calloc(nposline+1, sizeof *count);
+    if (p->theta == NULL || p->h == NULL || p->v == NULL
+        || p->pos_start == NULL || p->pos_index == NULL || p->dh == NULL
+        || p->dv == NULL || p->column == NULL || count == NULL)
+    {
+        free(count);
+        projector_free(p);
+        return NULL;
+    }
+    memcpy(p->theta, theta, sizeof *p->theta * nposline);
+    memcpy(p->h, h, sizeof *p->h * nposline);
+    memcpy(p->v, v, sizeof *p->v * npos);
+    memcpy(p->dh, dh, sizeof *p->dh * ncolumn);
+    memcpy(p->dv, dv, sizeof *p->dv * nrow);
+    // Only trace the probe columns which have a nonzero pixel
+    for (int i=0; i < ncolumn; i++)
+    {
+        int active = (mask == NULL);
+        for (int j=0; j < nrow && !active; j++)
+        {
+            active = mask[i * nrow + j] != 0;
+        }
+        if (active) p->column[p->nactive++] = i;
+    }
+    if (mask != NULL)
+    {
+        p->mask = malloc(sizeof *p->mask * ncolumn * nrow);
+        if (p->mask == NULL)
+        {
+            free(count);
+            projector_free(p);
+            return NULL;
+        }
+        memcpy(p->mask, mask, sizeof *p->mask * ncolumn * nrow);
+    }
+    p->nline = nposline * p->nactive;
+    // Sort the positions by position line with a counting sort.
+    for (int64_t m=0; m < npos; m++)
+    {
+        const int64_t k = (position_line == NULL) ? m : position_line[m];
+        assert(0 <= k && k < nposline);
+        p->pos_start[k+1]++;
+    }
+    for (int64_t k=0; k < nposline; k++)
+    {
+        p->pos_start[k+1] += p->pos_start[k];
+    }
+    for (int64_t m=0; m < npos; m++)
+    {
+        const int64_t k = (position_line == NULL) ? m : position_line[m];
+        p->pos_index[p->pos_start[k] + count[k]++] = m;
+    }
+    free(count);
+    if (p->compress != 0)
+    {
+        if (compress_lines(p) != 0)
+        {
+            projector_free(p);
+            return NULL;
+        }
+    }
+    else if (block_size == 0
+             && (trace_lines(p, 0, p->nline, &p->line_start, &p->pixels,
+                             &p->lengths) != 0
+                 || transpose_lines(p) != 0))
+    {
+        projector_free(p);
+        return NULL;
+    }
+    return p;
+}
+
+void
+projector_free(
+    projector *p)
+{
+    if (p == NULL) return;
+    free(p->theta);
+    free(p->h);
+    free(p->v);
+    free(p->pos_start);
+    free(p->pos_index);
+    free(p->dh);
+    free(p->dv);
+    free(p->mask);
+    free(p->column);
+    free(p->line_start);
+    free(p->pixels);
+    free(p->lengths);
+    free(p->word_start);
+    free(p->words);
+    free(p->half_lengths);
+    free(p->pixel_start);
+    free(p->pixel_lines);
+    free(p->pixel_lengths);
+    free(p->ray_norms);
+    free(p->ray_sums);
+    free(p->pixel_counts);
+    for (int i=0; i < 2; i++)
+    {
+        free(p->ray_work[i]);
+        free(p->grid_work[i]);
+        free(p->slice_work[i]);
+    }
+    free(p->stats);
+    free(p);
+}
+
+/* @brief Add the line integrals of obj along the rays of lines
+          [first, last) to data.
+
+@return 0 on success or -1 if a block could not be allocated.
+*/
+static int
+forward_range(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    const float * const obj,
+    float * const data,
+    const int nchannel)
+{
+    const double begin = wall_time();
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    const int64_t nblock = block_lines(p);
+    for (int64_t b0=first; b0 < last; b0 += nblock)
+    {
+        const int64_t b1 = (b0 + nblock < last) ? b0 + nblock : last;
+        int64_t *start;
+        int *pixels;
+        float *lengths;
+        if (block_begin(p, b0, b1, &start, &pixels, &lengths) != 0)
+        {
+            p->stats->forward_seconds += wall_time() - begin;
+            return -1;
+        }
+        // Each ray belongs to one line, so lines are projected in parallel.
+        #pragma omp parallel for schedule(dynamic, 64)
+        for (int64_t l=b0; l < b1; l++)
+        {
+            const int64_t pl = l / p->nactive;
+            const int col = p->column[l % p->nactive];
+            for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+            {
+                const int64_t m = p->pos_index[r];
+                for (int j=0; j < p->nrow; j++)
+                {
+                    const int z = ray_slice(p, m, col, j);
+                    if (z < 0) continue;
+                    const int64_t ray = ray_index(p, m, col, j);
+                    const float *plane = &obj[z * nxy * nchannel];
+                    float *sum = &data[ray * nchannel];
+                    // All of the channels are accumulated in one pass
+                    for (int64_t n=start[l-b0]; n < start[l-b0+1]; n++)
+                    {
+                        const float *pixel
+                            = &plane[(int64_t)pixels[n] * nchannel];
+                        for (int c=0; c < nchannel; c++)
+                        {
+                            sum[c] += pixel[c] * lengths[n];
+                        }
+                    }
+                }
+            }
+        }
+        block_end(p, start, pixels, lengths);
+    }
+    p->stats->forward_seconds += wall_time() - begin;
+    return 0;
+}
+
+/* @brief Sum the data of the rays of lines [first, last) by line and slice.
+
+Rays which share a line and a slice cross the same pixels with the same
+lengths, so they can be back projected together. sums[(z * (last - first) +
+l - first) * nchannel + c] is the sum of channel c of data over the rays of
+line l in slice z. If counts is not NULL, it is the number of these rays.
+*/
+static void
+slice_sums(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    const float * const data,
+    float * const sums,
+    float * const counts,
+    const int nchannel)
+{
+    const int64_t nl = last - first;
+    #pragma omp parallel for schedule(dynamic, 64)
+    for (int64_t l=first; l < last; l++)
+    {
+        const int64_t pl = l / p->nactive;
+        const int col = p->column[l % p->nactive];
+        for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+        {
+            const int64_t m = p->pos_index[r];
+            for (int j=0; j < p->nrow; j++)
+            {
+                const int z = ray_slice(p, m, col, j);
+                if (z < 0) continue;
+                const int64_t ray = ray_index(p, m, col, j);
+                const int64_t slot = z * nl + l - first;
+                for (int c=0; c < nchannel; c++)
+                {
+                    sums[slot * nchannel + c] += data[ray * nchannel + c];
+                }
+                if (counts != NULL) counts[slot] += 1;
+            }
+        }
+    }
+}
+
+/* @brief Add the back projection of data along the rays of lines
+          [first, last) to obj.
+
+If weights is not NULL, the lengths of the intersections are also added to
+weights; the column sums of the system matrix. weights has one channel.
+
+The data are first summed by line and slice. When all of the cached lines
+are projected, each pixel then gathers from the lines that cross it using the
+pixel-major index, so every pixel is written by one thread. Otherwise, the
+lines are scattered over the grid with one thread per slice; slices do not
+share pixels.
+
+@return 0 on success or -1 if a block could not be allocated.
+*/
+static int
+back_range(
+    projector * const p,
+    const int64_t first, const int64_t last,
+    const float * const data,
+    float * const obj,
+    float * const weights,
+    const int nchannel)
+{
+    const double begin = wall_time();
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    const int64_t nblock = block_lines(p);
+    for (int64_t b0=first; b0 < last; b0 += nblock)
+    {
+        const int64_t b1 = (b0 + nblock < last) ? b0 + nblock : last;
+        const int64_t nl = b1 - b0;
+        float *sums = slice_workspace(p, 0, p->nz * nl * nchannel);
+        float *counts = NULL;
+        if (weights != NULL)
+        {
+            counts = slice_workspace(p, 1, p->nz * nl);
+        }
+        if (sums == NULL || (weights != NULL && counts == NULL))
+        {
+            p->stats->back_seconds += wall_time() - begin;
+            return -1;
+        }
+        slice_sums(p, b0, b1, data, sums, counts, nchannel);
+        if (p->pixel_start != NULL && b0 == 0 && b1 == p->nline)
+        {
+            #pragma omp parallel for collapse(2) schedule(static)
+            for (int64_t z=0; z < p->nz; z++)
+            {
+                for (int64_t j=0; j < nxy; j++)
+                {
+                    const float *line_sums = &sums[z * nl * nchannel];
+                    float *pixel = &obj[(z * nxy + j) * nchannel];
+                    for (int64_t n=p->pixel_start[j];
+                         n < p->pixel_start[j+1]; n++)
+                    {
+                        const float *sum = &line_sums[p->pixel_lines[n]
+                                                      * nchannel];
+                        for (int c=0; c < nchannel; c++)
+                        {
+                            pixel[c] += sum[c] * p->pixel_lengths[n];
+                        }
+                    }
+                    if (counts == NULL) continue;
+                    const float *line_counts = &counts[z * nl];
+                    float weight = 0;
+                    for (int64_t n=p->pixel_start[j];
+                         n < p->pixel_start[j+1]; n++)
+                    {
+                        weight += line_counts[p->pixel_lines[n]]
+                                  * p->pixel_lengths[n];
+                    }
+                    weights[z * nxy + j] += weight;
+                }
+            }
+        }
+        else
+        {
+            int64_t *start;
+            int *pixels;
+            float *lengths;
+            if (block_begin(p, b0, b1, &start, &pixels, &lengths) != 0)
+            {
+                p->stats->back_seconds += wall_time() - begin;
+                return -1;
+            }
+            #pragma omp parallel for schedule(dynamic, 1)
+            for (int64_t z=0; z < p->nz; z++)
+            {
+                float *plane = &obj[z * nxy * nchannel];
+                for (int64_t l=0; l < nl; l++)
+                {
+                    const float *sum = &sums[(z * nl + l) * nchannel];
+                    for (int64_t n=start[l]; n < start[l+1]; n++)
+                    {
+                        float *pixel = &plane[(int64_t)pixels[n] * nchannel];
+                        for (int c=0; c < nchannel; c++)
+                        {
+                            pixel[c] += sum[c] * lengths[n];
+                        }
+                    }
+                }
+                if (counts == NULL) continue;
+                float *weight = &weights[z * nxy];
+                for (int64_t l=0; l < nl; l++)
+                {
+                    const float count = counts[z * nl + l];
+                    if (count == 0) continue;
+                    for (int64_t n=start[l]; n < start[l+1]; n++)
+                    {
+                        weight[pixels[n]] += count * lengths[n];
+                    }
+                }
+            }
+            block_end(p, start, pixels, lengths);
+        }
+    }
+    p->stats->back_seconds += wall_time() - begin;
+    return 0;
+}
+
+/* @brief Add update / weights to obj for every pixel touched by the rays of
+          lines [first, last) and then reset update and weights to zero.
+
+Only the touched pixels are visited, so the cost is proportional to the
+number of intersections instead of the size of the grid.
+
+@return 0 on success or -1 if a block could not be allocated.
+*/
+static int
+apply_range(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    float * const update,
+    float * const weights,
+    const float relax,
+    float * const obj,
+    const int nchannel)
+{
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    const int64_t nblock = block_lines(p);
+    for (int64_t b0=first; b0 < last; b0 += nblock)
+    {
+        const int64_t b1 = (b0 + nblock < last) ? b0 + nblock : last;
+        int64_t *start;
+        int *pixels;
+        float *lengths;
+        if (block_begin(p, b0, b1, &start, &pixels, &lengths) != 0)
+        {
+            return -1;
+        }
+        for (int64_t l=b0; l < b1; l++)
+        {
+            const int64_t pl = l / p->nactive;
+            const int col = p->column[l % p->nactive];
+            for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+            {
+                const int64_t m = p->pos_index[r];
+                for (int j=0; j < p->nrow; j++)
+                {
+                    const int z = ray_slice(p, m, col, j);
+                    if (z < 0) continue;
+                    const int64_t offset = z * nxy;
+                    for (int64_t n=start[l-b0]; n < start[l-b0+1]; n++)
+                    {
+                        const int64_t q = offset + pixels[n];
+                        for (int c=0; c < nchannel; c++)
+                        {
+                            if (weights[q] > 0)
+                            {
+                                obj[q * nchannel + c] += relax
+                                    * update[q * nchannel + c] / weights[q];
+                            }
+                            update[q * nchannel + c] = 0;
+                        }
+                        weights[q] = 0;
+                    }
+                }
+            }
+        }
+        block_end(p, start, pixels, lengths);
+    }
+    return 0;
+}
+
+int
+projector_forward(
+    const projector * const p,
+    const float * const obj,
+    float * const data,
+    const int nchannel)
+{
+    assert(p != NULL && obj != NULL && data != NULL && nchannel > 0);
+    return forward_range(p, 0, p->nline, obj, data, nchannel);
+}
+
+int
+projector_back(
+    projector * const p,
+    const float * const data,
+    float * const obj,
+    const int nchannel)
+{
+    assert(p != NULL && obj != NULL && data != NULL && nchannel > 0);
+    return back_range(p, 0, p->nline, data, obj, NULL, nchannel);
+}
+
+/* @brief Compute the norm of each ray; the row sums of the system matrix.
+
+@param squared Whether to sum the squared lengths or the lengths.
+@return The norms or NULL if they could not be allocated.
+*/
+static float *
+ray_norms(
+    const projector * const p,
+    const int squared)
+{
+    float *lengths_dot = calloc(p->nray, sizeof *lengths_dot);
+    if (lengths_dot == NULL) return NULL;
+    const int64_t nblock = block_lines(p);
+    for (int64_t first=0; first < p->nline; first += nblock)
+    {
+        const int64_t last = (first + nblock < p->nline) ? first + nblock
+                                                         : p->nline;
+        int64_t *start;
+        int *pixels;
+        float *lengths;
+        if (block_begin(p, first, last, &start, &pixels, &lengths) != 0)
+        {
+            free(lengths_dot);
+            return NULL;
+        }
+        #pragma omp parallel for schedule(dynamic, 64)
+        for (int64_t l=first; l < last; l++)
+        {
+            float line_norm = 0;
+            for (int64_t n=start[l-first]; n < start[l-first+1]; n++)
+            {
+                line_norm += squared ? lengths[n] * lengths[n] : lengths[n];
+            }
+            const int64_t pl = l / p->nactive;
+            const int col = p->column[l % p->nactive];
+            for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+            {
+                const int64_t m = p->pos_index[r];
+                for (int j=0; j < p->nrow; j++)
+                {
+                    if (ray_slice(p, m, col, j) >= 0)
+                    {
+                        lengths_dot[ray_index(p, m, col, j)] = line_norm;
+                    }
+                }
+            }
+        }
+        block_end(p, start, pixels, lengths);
+    }
+    p->stats->bytes_allocated += sizeof *lengths_dot * p->nray;
+    return lengths_dot;
+}
+
+/* @brief Count the number of intersections with each pixel; the column sums
+          of the nonzero pattern of the system matrix.
+
+@return The counts or NULL if they could not be allocated.
+*/
+static int *
+pixel_counts(
+    const projector * const p)
+{
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    int *num_grid_updates = calloc((size_t)p->nz * nxy,
+                                   sizeof *num_grid_updates);
+    if (num_grid_updates == NULL) return NULL;
+    const int64_t nblock = block_lines(p);
+    for (int64_t first=0; first < p->nline; first += nblock)
+    {
+        const int64_t last = (first + nblock < p->nline) ? first + nblock
+                                                         : p->nline;
+        int64_t *start;
+        int *pixels;
+        float *lengths;
+        if (block_begin(p, first, last, &start, &pixels, &lengths) != 0)
+        {
+            free(num_grid_updates);
+            return NULL;
+        }
+        for (int64_t l=first; l < last; l++)
+        {
+            const int64_t pl = l / p->nactive;
+            const int col = p->column[l % p->nactive];
+            for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+            {
+                const int64_t m = p->pos_index[r];
+                for (int j=0; j < p->nrow; j++)
+                {
+                    const int z = ray_slice(p, m, col, j);
+                    if (z < 0) continue;
+                    int *plane = &num_grid_updates[z * nxy];
+                    for (int64_t n=start[l-first]; n < start[l-first+1]; n++)
+                    {
+                        plane[pixels[n]] += 1;
+                    }
+                }
+            }
+        }
+        block_end(p, start, pixels, lengths);
+    }
+    p->stats->bytes_allocated += sizeof *num_grid_updates * p->nz * nxy;
+    return num_grid_updates;
+}
+
+/* @brief Project one ray through plane and update plane along the ray by
+          scale times the residual of the ray.
+*/
+static void
+art_ray(
+    float * const plane,
+    const int * const pixels, const float * const lengths, const int64_t size,
+    const float * const data,
+    const float scale,
+    float * const line_update,
+    const int nchannel)
+{
+    for (int c=0; c < nchannel; c++)
+    {
+        line_update[c] = 0;
+    }
+    for (int64_t n=0; n < size; n++)
+    {
+        const float *pixel = &plane[(int64_t)pixels[n] * nchannel];
+        for (int c=0; c < nchannel; c++)
+        {
+            line_update[c] += pixel[c] * lengths[n];
+        }
+    }
+    for (int c=0; c < nchannel; c++)
+    {
+        line_update[c] = scale * (data[c] - line_update[c]);
+    }
+    for (int64_t n=0; n < size; n++)
+    {
+        float *pixel = &plane[(int64_t)pixels[n] * nchannel];
+        for (int c=0; c < nchannel; c++)
+        {
+            pixel[c] += line_update[c] * lengths[n];
+        }
+    }
+}
+
+int
+projector_art(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float relax,
+    const int nrange, const int64_t * const range_start,
+    const int * const order)
+{
+    assert(p != NULL && init != NULL && data != NULL && nchannel > 0);
+    assert(range_start != NULL && order != NULL);
+    const double begin = update_time(p);
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    const float *lengths_dot = get_ray_norms(p);
+    float *line_update = malloc(sizeof *line_update * nchannel);
+    if (lengths_dot == NULL || line_update == NULL)
+    {
+        free(line_update);
+        solver_end(p, begin, 0);
+        return -1;
+    }
+
+    for (int i=0; i < niter; i++)
+    {
+        for (int64_t k=0; k < nrange; k++)
+        {
+            const int64_t first = range_start[order[k]];
+            const int64_t last = range_start[order[k]+1];
+            const int64_t nblock = block_lines(p);
+            for (int64_t b0=first; b0 < last; b0 += nblock)
+            {
+                const int64_t b1 = (b0 + nblock < last) ? b0 + nblock : last;
+                int64_t *start;
+                int *pixels;
+                float *lengths;
+                if (block_begin(p, b0, b1, &start, &pixels, &lengths) != 0)
+                {
+                    free(line_update);
+                    solver_end(p, begin, i);
+                    return -1;
+                }
+                // Project one ray and immediately update the model along it
+                for (int64_t l=b0; l < b1; l++)
+                {
+                    const int64_t pl = l / p->nactive;
+                    const int col = p->column[l % p->nactive];
+                    for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1];
+                         r++)
+                    {
+                        const int64_t m = p->pos_index[r];
+                        for (int j=0; j < p->nrow; j++)
+                        {
+                            const int z = ray_slice(p, m, col, j);
+                            const int64_t ray = ray_index(p, m, col, j);
+                            if (z < 0 || lengths_dot[ray] <= 0) continue;
+                            const int64_t n = start[l-b0];
+                            art_ray(&init[z * nxy * nchannel],
+                                    &pixels[n], &lengths[n],
+                                    start[l-b0+1] - n,
+                                    &data[ray * nchannel],
+                                    relax / lengths_dot[ray],
+                                    line_update, nchannel);
+                        }
+                    }
+                }
+                block_end(p, start, pixels, lengths);
+            }
+        }
+    }
+    free(line_update);
+    solver_end(p, begin, niter);
+    return 0;
+}
+
+/* @brief Replace sim with (data - sim) / row_sums for the rays of lines
+          [first, last); if data is NULL, set them to zero.
+*/
+static void
+residual_range(
+    const projector * const p,
+    const int64_t first, const int64_t last,
+    const float * const data,
+    const float * const row_sums,
+    float * const sim,
+    const int nchannel)
+{
+    #pragma omp parallel for schedule(dynamic, 64)
+    for (int64_t l=first; l < last; l++)
+    {
+        const int64_t pl = l / p->nactive;
+        const int col = p->column[l % p->nactive];
+        for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+        {
+            const int64_t m = p->pos_index[r];
+            for (int j=0; j < p->nrow; j++)
+            {
+                const int64_t ray = ray_index(p, m, col, j);
+                for (int c=0; c < nchannel; c++)
+                {
+                    const int64_t k = ray * nchannel + c;
+                    if (data == NULL || row_sums[ray] <= 0)
+                    {
+                        sim[k] = 0;
+                    }
+                    else
+                    {
+                        sim[k] = (data[k] - sim[k]) / row_sums[ray];
+                    }
+                }
+            }
+        }
+    }
+}
+
+int
+projector_sart(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float relax,
+    const int nrange, const int64_t * const range_start,
+    const int * const order,
+    const int nsubset, const int * const subset_start)
+{
+    assert(p != NULL && init != NULL && data != NULL && nchannel > 0);
+    assert(range_start != NULL && order != NULL && subset_start != NULL);
+    assert(subset_start[nsubset] <= nrange);
+    const double begin = update_time(p);
+    const int64_t grid_size = (int64_t)p->nz * p->nx * p->ny;
+    const int64_t ndata = p->nray;
+    const float *row_sums = get_ray_sums(p);
+    reserve_workspace(p, nchannel);
+    float *sim = workspace(p, &p->ray_work[0], ndata * nchannel);
+    // These are zero between subsets; see apply_range
+    float *grid_update = workspace(p, &p->grid_work[0], grid_size * nchannel);
+    float *col_sums = workspace(p, &p->grid_work[1], grid_size);
+    if (row_sums == NULL || sim == NULL || grid_update == NULL
+        || col_sums == NULL)
+    {
+        solver_end(p, begin, 0);
+        return -1;
+    }
+    memset(grid_update, 0, sizeof *grid_update * grid_size * nchannel);
+    memset(col_sums, 0, sizeof *col_sums * grid_size);
+
+    for (int i=0; i < niter; i++)
+    {
+        for (int s=0; s < nsubset; s++)
+        {
+            // simulate data acquisition by projecting the subset
+            for (int64_t k=subset_start[s]; k < subset_start[s+1]; k++)
+            {
+                const int64_t first = range_start[order[k]];
+                const int64_t last = range_start[order[k]+1];
+                residual_range(p, first, last, NULL, NULL, sim, nchannel);
+                if (forward_range(p, first, last, init, sim, nchannel) != 0)
+                {
+                    solver_end(p, begin, i);
+                    return -1;
+                }
+                // Compute an update value for each line
+                residual_range(p, first, last, data, row_sums, sim, nchannel);
+            }
+            // Project the line updates back over the grid update.
+            for (int64_t k=subset_start[s]; k < subset_start[s+1]; k++)
+            {
+                if (back_range(p, range_start[order[k]],
+                               range_start[order[k]+1],
+                               sim, grid_update, col_sums, nchannel) != 0)
+                {
+                    solver_end(p, begin, i);
+                    return -1;
+                }
+            }
+            // Update the model where the subset touched it
+            for (int64_t k=subset_start[s]; k < subset_start[s+1]; k++)
+            {
+                if (apply_range(p, range_start[order[k]],
+                                range_start[order[k]+1],
+                                grid_update, col_sums, relax, init,
+                                nchannel) != 0)
+                {
+                    solver_end(p, begin, i);
+                    return -1;
+                }
+            }
+        }
+    }
+    solver_end(p, begin, niter);
+    return 0;
+}
+
+/* @brief Compute the relative residual |data - A init| / |data| using work
+          as a buffer of the size of data.
+
+@return 0 on success or -1 if the forward projection failed.
+*/
+static int
+relative_residual(
+    const projector * const p,
+    const float * const data,
+    const float * const init,
+    const int nchannel,
+    const double data_norm,
+    float * const work,
+    float * const residual)
+{
+    const int64_t ndata = p->nray * nchannel;
+    memset(work, 0, sizeof *work * ndata);
+    if (projector_forward(p, init, work, nchannel) != 0) return -1;
+    double error = 0;
+    #pragma omp parallel for reduction(+:error)
+    for (int64_t k=0; k < ndata; k++)
+    {
+        const double diff = data[k] - work[k];
+        error += diff * diff;
+    }
+    *residual = (data_norm > 0) ? sqrt(error) / data_norm : sqrt(error);
+    return 0;
+}
+
+int
+projector_sirt(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float tol,
+    float * const residual)
+{
+    assert(p != NULL && init != NULL && data != NULL && nchannel > 0);
+    const double begin = update_time(p);
+    const int64_t grid_size = (int64_t)p->nz * p->nx * p->ny;
+    const int64_t ndata = p->nray;
+    // The normalizations depend only on the geometry
+    const float *lengths_dot = get_ray_norms(p);
+    const int *num_grid_updates = get_pixel_counts(p);
+    reserve_workspace(p, nchannel);
+    float *line_update = workspace(p, &p->ray_work[0], ndata * nchannel);
+    float *grid_update = workspace(p, &p->grid_work[0], grid_size * nchannel);
+    if (lengths_dot == NULL || num_grid_updates == NULL
+        || line_update == NULL || grid_update == NULL)
+    {
+        solver_end(p, begin, 0);
+        return -1;
+    }
+
+    const double data_norm = sqrt(dot(data, data, ndata * nchannel));
+
+    int status = 0;
+    int i;
+    for (i=0; i < niter; i++)
+    {
+        // simulate data acquisition by projecting over current model
+        memset(line_update, 0, sizeof *line_update * ndata * nchannel);
+        status = projector_forward(p, init, line_update, nchannel);
+        if (status != 0) break;
+        // Compute an update value for each line
+        double error = 0;
+        #pragma omp parallel for reduction(+:error)
+        for (int64_t ray=0; ray < ndata; ray++)
+        {
+            const float norm = lengths_dot[ray];
+            for (int64_t k=ray * nchannel; k < (ray + 1) * nchannel; k++)
+            {
+                const float diff = data[k] - line_update[k];
+                error += (double)diff * diff;
+                line_update[k] = (norm > 0) ? diff / norm : 0;
+            }
+        }
+        error = (data_norm > 0) ? sqrt(error) / data_norm : sqrt(error);
+        if (residual != NULL) *residual = error;
+        // Stop once the model explains the data well enough
+        if (error <= tol) break;
+        // Project the line update back over the grid update.
+        memset(grid_update, 0, sizeof *grid_update * grid_size * nchannel);
+        status = projector_back(p, line_update, grid_update, nchannel);
+        if (status != 0) break;
+        // Update the inital guess.
+        #pragma omp parallel for
+        for (int64_t q=0; q < grid_size; q++)
+        {
+            const int count = num_grid_updates[q];
+            if (count <= 0) continue;
+            for (int64_t l=q * nchannel; l < (q + 1) * nchannel; l++)
+            {
+                init[l] += grid_update[l] / count;
+            }
+        }
+    }
+    // Report the residual of the last update instead of the one before it
+    if (status == 0 && residual != NULL && i > 0 && i == niter)
+    {
+        status = relative_residual(p, data, init, nchannel, data_norm,
+                                   line_update, residual);
+    }
+    solver_end(p, begin, i);
+    return (status == 0) ? i : -1;
+}
+
+int
+projector_cgls(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float tol,
+    const int resume,
+    float * const residual)
+{
+    assert(p != NULL && init != NULL && data != NULL && nchannel > 0);
+    const double begin = update_time(p);
+    const int64_t grid_size = (int64_t)p->nz * p->nx * p->ny;
+    const int64_t ndata = p->nray;
+    const int nc = nchannel;
+    reserve_workspace(p, nchannel);
+    // There is nothing to resume from if the work buffers are new
+    const int fresh = (p->ray_work[0] == NULL);
+    float *r = workspace(p, &p->ray_work[0], ndata * nc);
+    float *q = workspace(p, &p->ray_work[1], ndata * nc);
+    float *s = workspace(p, &p->grid_work[0], grid_size * nc);
+    float *d = workspace(p, &p->grid_work[1], grid_size * nc);
+    // The channels are independent problems, so each has its own step sizes
+    double *gamma = malloc(sizeof *gamma * nc);
+    double *gamma1 = malloc(sizeof *gamma1 * nc);
+    double *qq = malloc(sizeof *qq * nc);
+    float *alpha = malloc(sizeof *alpha * nc);
+    float *beta = malloc(sizeof *beta * nc);
+    if (r == NULL || q == NULL || s == NULL || d == NULL || gamma == NULL
+        || gamma1 == NULL || qq == NULL || alpha == NULL || beta == NULL)
+    {
+        free(gamma);
+        free(gamma1);
+        free(qq);
+        free(alpha);
+        free(beta);
+        solver_end(p, begin, 0);
+        return -1;
+    }
+    const double data_norm = sqrt(dot(data, data, ndata * nc));
+
+    int status = 0;
+    if (!resume || fresh)
+    {
+        // r = data - A init; s = d = A^T r
+        memset(r, 0, sizeof *r * ndata * nc);
+        status = projector_forward(p, init, r, nc);
+        #pragma omp parallel for
+        for (int64_t k=0; k < ndata * nc; k++)
+        {
+            r[k] = data[k] - r[k];
+        }
+        memset(s, 0, sizeof *s * grid_size * nc);
+        if (status == 0) status = projector_back(p, r, s, nc);
+        memcpy(d, s, sizeof *d * grid_size * nc);
+    }
+    dot_channels(s, s, grid_size, nc, gamma);
+
+    // r is the residual of init, so it is reported after each update
+    double error = sqrt(dot(r, r, ndata * nc));
+    error = (data_norm > 0) ? error / data_norm : error;
+    if (residual != NULL) *residual = error;
+    int i;
+    for (i=0; i < niter && status == 0; i++)
+    {
+        // Stop once the model explains the data well enough
+        if (error <= tol) break;
+        // q = A d
+        memset(q, 0, sizeof *q * ndata * nc);
+        status = projector_forward(p, d, q, nc);
+        if (status != 0) break;
+        dot_channels(q, q, ndata, nc, qq);
+        int converged = 1;
+        for (int c=0; c < nc; c++)
+        {
+            // A channel which has converged stops moving
+            alpha[c] = (gamma[c] > 0 && qq[c] > 0) ? gamma[c] / qq[c] : 0;
+            converged = converged && (alpha[c] == 0);
+        }
+        if (converged) break;
+        #pragma omp parallel for
+        for (int64_t l=0; l < grid_size * nc; l++)
+        {
+            init[l] += alpha[l % nc] * d[l];
+        }
+        #pragma omp parallel for
+        for (int64_t k=0; k < ndata * nc; k++)
+        {
+            r[k] -= alpha[k % nc] * q[k];
+        }
+        error = sqrt(dot(r, r, ndata * nc));
+        error = (data_norm > 0) ? error / data_norm : error;
+        if (residual != NULL) *residual = error;
+        // s = A^T r
+        memset(s, 0, sizeof *s * grid_size * nc);
+        status = projector_back(p, r, s, nc);
+        if (status != 0) break;
+        dot_channels(s, s, grid_size, nc, gamma1);
+        for (int c=0; c < nc; c++)
+        {
+            beta[c] = (gamma[c] > 0) ? gamma1[c] / gamma[c] : 0;
+            gamma[c] = gamma1[c];
+        }
+        #pragma omp parallel for
+        for (int64_t l=0; l < grid_size * nc; l++)
+        {
+            d[l] = s[l] + beta[l % nc] * d[l];
+        }
+    }
+    free(gamma);
+    free(gamma1);
+    free(qq);
+    free(alpha);
+    free(beta);
+    solver_end(p, begin, i);
+    return (status == 0) ? i : -1;
+}
+
+/* @brief Estimate the squared operator norm, the largest eigenvalue of
+          A^T A, with a few iterations of the power method; computed on
+          first use. Negative if the work buffers could not be allocated.
+*/
+static double
+get_norm(
+    projector * const p)
+{
+    if (p->norm > 0) return p->norm;
+    const int64_t grid_size = (int64_t)p->nz * p->nx * p->ny;
+    reserve_workspace(p, 1);
+    float *Ax = workspace(p, &p->ray_work[0], p->nray);
+    float *x = workspace(p, &p->grid_work[0], grid_size);
+    float *AtAx = workspace(p, &p->grid_work[1], grid_size);
+    if (Ax == NULL || x == NULL || AtAx == NULL) return -1;
+    // A is nonnegative, so start from a positive vector
+    for (int64_t l=0; l < grid_size; l++)
+    {
+        x[l] = 1;
+    }
+    double norm = 0;
+    for (int i=0; i < POWER_ITERATIONS; i++)
+    {
+        memset(Ax, 0, sizeof *Ax * p->nray);
+        if (projector_forward(p, x, Ax, 1) != 0) return -1;
+        memset(AtAx, 0, sizeof *AtAx * grid_size);
+        if (projector_back(p, Ax, AtAx, 1) != 0) return -1;
+        // Rayleigh quotient of the current vector
+        const double xx = dot(x, x, grid_size);
+        norm = dot(x, AtAx, grid_size) / xx;
+        const float scale = 1 / sqrt(dot(AtAx, AtAx, grid_size));
+        if (!isfinite(scale)) break;
+        #pragma omp parallel for
+        for (int64_t l=0; l < grid_size; l++)
+        {
+            x[l] = AtAx[l] * scale;
+        }
+    }
+    p->norm = norm;
+    return p->norm;
+}
+
+int
+projector_grad(
+    projector * const p,
+    const float * const data,
+    float * const init,
+    const int nchannel,
+    const int niter,
+    const float tol,
+    float * const residual)
+{
+    assert(p != NULL && init != NULL && data != NULL && nchannel > 0);
+    const double begin = update_time(p);
+    const int64_t grid_size = (int64_t)p->nz * p->nx * p->ny * nchannel;
+    const int64_t ndata = p->nray * nchannel;
+    const double norm = get_norm(p);
+    if (norm <= 0)
+    {
+        solver_end(p, begin, 0);
+        return (norm < 0) ? -1 : 0;
+    }
+    // The objective has a Lipschitz continuous gradient with constant norm
+    const float step = 1 / norm;
+    reserve_workspace(p, nchannel);
+    float *r = workspace(p, &p->ray_work[0], ndata);
+    float *g = workspace(p, &p->grid_work[0], grid_size);
+    if (r == NULL || g == NULL)
+    {
+        solver_end(p, begin, 0);
+        return -1;
+    }
+    const double data_norm = sqrt(dot(data, data, ndata));
+
+    int status = 0;
+    int i;
+    for (i=0; i < niter; i++)
+    {
+        // r = A init - data
+        memset(r, 0, sizeof *r * ndata);
+        status = projector_forward(p, init, r, nchannel);
+        if (status != 0) break;
+        #pragma omp parallel for
+        for (int64_t k=0; k < ndata; k++)
+        {
+            r[k] -= data[k];
+        }
+        double error = sqrt(dot(r, r, ndata));
+        error = (data_norm > 0) ? error / data_norm : error;
+        if (residual != NULL) *residual = error;
+        // Stop once the model explains the data well enough
+        if (error <= tol) break;
+        // Step along the negative gradient, A^T r
+        memset(g, 0, sizeof *g * grid_size);
+        status = projector_back(p, r, g, nchannel);
+        if (status != 0) break;
+        #pragma omp parallel for
+        for (int64_t l=0; l < grid_size; l++)
+        {
+            init[l] -= step * g[l];
+        }
+    }
+    // Report the residual of the last update instead of the one before it
+    if (status == 0 && residual != NULL && i > 0 && i == niter)
+    {
+        status = relative_residual(p, data, init, nchannel, data_norm, r,
+                                   residual);
+    }
+    solver_end(p, begin, i);
+    return (status == 0) ? i : -1;
+}
+
+int
+projector_coverage(
+    const projector * const p,
+    const float * const weights,
+    const int nbin,
+    float * const coverage_map)
+{
+    assert(p != NULL && weights != NULL && coverage_map != NULL);
+    assert(nbin > 0);
+    const double begin = wall_time();
+    const int64_t nxy = (int64_t)p->nx * p->ny;
+    const int64_t nblock = block_lines(p);
+    // The bin depends only on the angle of the line
+    int *bins = malloc(sizeof *bins * (p->nposline + 1));
+    if (bins == NULL) return -1;
+    for (int64_t pl=0; pl < p->nposline; pl++)
+    {
+        bins[pl] = angle_bin(p->theta[pl], nbin);
+    }
+    for (int64_t b0=0; b0 < p->nline; b0 += nblock)
+    {
+        const int64_t b1 = (b0 + nblock < p->nline) ? b0 + nblock : p->nline;
+        const int64_t nl = b1 - b0;
+        // Rays of a line in the same slice share their intersections, so
+        // sum their weights and then visit the intersections once.
+        float *sums = calloc((size_t)p->nz * nl, sizeof *sums);
+        if (sums == NULL)
+        {
+            free(bins);
+            p->stats->back_seconds += wall_time() - begin;
+            return -1;
+        }
+        #pragma omp parallel for schedule(dynamic, 64)
+        for (int64_t l=b0; l < b1; l++)
+        {
+            const int64_t pl = l / p->nactive;
+            const int col = p->column[l % p->nactive];
+            for (int64_t r=p->pos_start[pl]; r < p->pos_start[pl+1]; r++)
+            {
+                const int64_t m = p->pos_index[r];
+                for (int j=0; j < p->nrow; j++)
+                {
+                    const int z = ray_slice(p, m, col, j);
+                    if (z >= 0) sums[z * nl + l - b0] += weights[m];
+                }
+            }
+        }
+        int64_t *start;
+        int *pixels;
+        float *lengths;
+        if (block_begin(p, b0, b1, &start, &pixels, &lengths) != 0)
+        {
+            free(sums);
+            free(bins);
+            p->stats->back_seconds += wall_time() - begin;
+            return -1;
+        }
+        // Each thread writes one bin of one slice, so no two threads add to
+        // the same element. The bins are the outer loop, so the slices
+        // being written at the same time are far apart in memory.
+        #pragma omp parallel for collapse(2) schedule(dynamic, 1)
+        for (int t=0; t < nbin; t++)
+        {
+            for (int64_t z=0; z < p->nz; z++)
+            {
+                float *plane = &coverage_map[z * nxy * nbin + t];
+                for (int64_t l=0; l < nl; l++)
+                {
+                    const float sum = sums[z * nl + l];
+                    if (sum == 0 || bins[(b0 + l) / p->nactive] != t)
+                    {
+                        continue;
+                    }
+                    for (int64_t n=start[l]; n < start[l+1]; n++)
+                    {
+                        plane[(int64_t)pixels[n] * nbin] += sum * lengths[n];
+                    }
+                }
+            }
+        }
+        block_end(p, start, pixels, lengths);
+        free(sums);
+    }
+    free(bins);
+    p->stats->back_seconds += wall_time() - begin;
+    return 0;
+}
+
+void
+projector_get_stats(
+    const projector * const p,
+    projector_stats * const stats)
+{
+    assert(p != NULL && stats != NULL);
+    *stats = *p->stats;
+}
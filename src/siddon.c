@@ -1,4 +1,5 @@
 #include <stdlib.h>
+#include <stdint.h>
 #include <assert.h>
 #include <limits.h>
 #include <math.h>
@@ -7,140 +8,200 @@
 #include "siddon.h"
 #include "utils.h"
 
+/* @brief Compute the points where one ray crosses the grid lines.
+
+The points are returned unsorted as two lists: (ax, ay) and (bx, by). The
+ray crosses asize + bsize - 1 pixels.
+*/
+static void
+trace_ray(
+    const float oxmin, const float oymin,
+    const int ox, const int oy,
+    const float theta, const float h,
+    const float *gridx, const float *gridy,
+    float * const coordx, float * const coordy,
+    int *asize, float * const ax, float * const ay,
+    int *bsize, float * const bx, float * const by,
+    int *quadrant)
+{
+    // Calculate the sin and cos values of the projection angle and find
+    // at which quadrant on the cartesian grid.
+    const float theta_p = fmod(theta, 2*M_PI);
+    *quadrant = calc_quadrant(theta_p);
+    const float sin_p = sinf(theta_p);
+    const float cos_p = cosf(theta_p);
+    const float ri = abs(oxmin)+abs(oymin)+ox+oy;
+    const float hi = h+1e-6;
+    calc_coords(
+        ox, oy, ri, hi, sin_p, cos_p, gridx, gridy, coordx, coordy);
+    trim_coords(
+        ox, oy, coordx, coordy, gridx, gridy,
+        asize, ax, ay, bsize, bx, by);
+}
+
 /* @brief Use method by Siddon (1984) to compute the intersections of rays with
           the grid lines.
 
 Siddon, R. L. (1984). Fast calculation of the exact radiological path for a
 three‐dimensional CT array. Medical Physics, 12(2), 252–255.
 https://doi.org/10.1118/1.595715
+
+The rays are traced in the (x, y) plane in parallel in two passes. The first
+pass counts the intersections of each ray, so that after a prefix sum, the
+second pass can write the intersections of each ray directly into its block
+of the output.
+
+@return 0 on success or -1 if the output could not be allocated.
 */
-void
-get_pixel_indexes_and_lengths(
-    const float ozmin, const float oxmin, const float oymin,
-    const float zsize, const float xsize, const float ysize,
-    const int oz, const int ox, const int oy,
-    const float * const theta, const float * const h, const float * const v,
-    const int dsize,
+static int
+trace_rays(
+    const float oxmin, const float oymin,
+    const float xsize, const float ysize,
+    const int ox, const int oy,
+    const float * const theta, const float * const h,
+    const int64_t dsize,
     const float *gridx, const float *gridy,
-    int **pixels, int **rays, float **lengths, int *psize)
+    int64_t * const start, int **pixels, float **lengths)
 {
     // Check inputs for valid values
-    assert(oz > 0 && ox > 0 && oy > 0
+    assert(ox > 0 && oy > 0
            && "Array dimensions must be larger than zero in all dimensions.");
-    assert(zsize > 0 && xsize > 0 && ysize > 0
+    assert(xsize > 0 && ysize > 0
            && "Bounding box must be larger than zero in all dimensions.");
     assert(dsize >= 0 && "Data size must be a natural number");
-    assert(theta != NULL && h != NULL && v != NULL
+    assert(theta != NULL && h != NULL && start != NULL
            && "Input data must not be NULL.");
-    // Coordinate pairs of gridx gridy where the line intersects the grid
-    float *coordy = malloc(sizeof *coordy * (ox+oy+2));
-    float *coordx = malloc(sizeof *coordx * (ox+oy+2));
-    // Distances between (gridx, coordy) points
-    float *ax = (float *)malloc((ox+oy+2)*sizeof(float));
-    float *ay = (float *)malloc((ox+oy+2)*sizeof(float));
-    // Distances between (gridy, coordx) points
-    float *bx = (float *)malloc((ox+oy+2)*sizeof(float));
-    float *by = (float *)malloc((ox+oy+2)*sizeof(float));
-    // All intersection points sorted into one array
-    float *coorx = coordx;
-    float *coory = coordy;
-    // Final distances between intersection points
-    // float *dist = bx;
-    // Midpoints between intersection points used to find indices
-    float *midx = ax;
-    float *midy = ay;
-    assert(coordx != NULL && coordy != NULL &&
-        ax != NULL && ay != NULL && by != NULL && bx != NULL &&
-        coorx != NULL && coory != NULL &&
-        midx != NULL && midy != NULL);
+    int status = 0;
 
-    int ray, quadrant, zi, asize, bsize, csize;
-    float ri, hi, theta_p, sin_p, cos_p;
+    #pragma omp parallel
+    {
+        // Each thread has its own buffers for tracing one ray.
+        // Coordinate pairs of gridx gridy where the line intersects the grid
+        float *coordy = malloc(sizeof *coordy * (ox+oy+2));
+        float *coordx = malloc(sizeof *coordx * (ox+oy+2));
+        // Distances between (gridx, coordy) points
+        float *ax = malloc(sizeof *ax * (ox+oy+2));
+        float *ay = malloc(sizeof *ay * (ox+oy+2));
+        // Distances between (gridy, coordx) points
+        float *bx = malloc(sizeof *bx * (ox+oy+2));
+        float *by = malloc(sizeof *by * (ox+oy+2));
+        // All intersection points sorted into one array
+        float *coorx = coordx;
+        float *coory = coordy;
+        // Midpoints between intersection points used to find indices
+        float *midx = ax;
+        float *midy = ay;
+        const int ok = (coordx != NULL && coordy != NULL &&
+            ax != NULL && ay != NULL && by != NULL && bx != NULL);
+        if (!ok)
+        {
+            #pragma omp atomic write
+            status = -1;
+        }
 
-    (*psize) = 0;
-    int num_lists = 0;
-    int *csize_list = malloc(sizeof *csize_list * dsize);
-    int *rays_list = malloc(sizeof *rays_list *dsize);
-    int * *pixels_list = malloc(sizeof *pixels_list * dsize);
-    float * *lengths_list = malloc(sizeof *lengths_list * dsize);
+        // First pass: count the intersections of each ray.
+        #pragma omp for schedule(dynamic, 256)
+        for (int64_t ray = 0; ray < dsize; ray++)
+        {
+            int quadrant, asize, bsize;
+            start[ray+1] = 0;
+            if (ok)
+            {
+                trace_ray(
+                    oxmin, oymin, ox, oy, theta[ray], h[ray], gridx, gridy,
+                    coordx, coordy, &asize, ax, ay, &bsize, bx, by,
+                    &quadrant);
+                if (asize + bsize > 1)
+                {
+                    start[ray+1] = asize + bsize - 1;
+                }
+            }
+        }
 
-    for (ray = 0; ray < dsize; ray++)
-    {
-        zi = floor((v[ray]-ozmin) * oz / zsize);
-        // Skip this ray if it is out of the z range
-        if ((0 <= zi) && (zi < oz))
+        // Allocate the output once the total number of intersections is known
+        #pragma omp single
         {
-            // Index of the grid that the ray passes through.
-            int *indi = malloc(sizeof *indi * (ox+oy+1));
-            float *dist = malloc(sizeof *dist * (ox+oy+1));
-            assert(dist != NULL && indi != NULL);
-            // Calculate the sin and cos values of the projection angle and find
-            // at which quadrant on the cartesian grid.
-            theta_p = fmod(theta[ray], 2*M_PI);
-            quadrant = calc_quadrant(theta_p);
-            sin_p = sinf(theta_p);
-            cos_p = cosf(theta_p);
-            ri = abs(oxmin)+abs(oymin)+ox+oy;
-            hi = h[ray]+1e-6;
-            calc_coords(
-                ox, oy, ri, hi, sin_p, cos_p, gridx, gridy, coordx, coordy);
-            trim_coords(
-                ox, oy, coordx, coordy, gridx, gridy,
-                &asize, ax, ay, &bsize, bx, by);
-            sort_intersections(
-                quadrant, asize, ax, ay, bsize, bx, by, &csize, coorx, coory);
-            calc_dist(
-                csize, coorx, coory, midx, midy, dist);
-            calc_index(
-                ox, oy, oz, oxmin, oymin, ozmin, xsize/ox, ysize/oy, zsize/oz,
-                csize-1, midx, midy, zi, indi);
-            if (csize > 1)
+            start[0] = 0;
+            for (int64_t ray = 0; ray < dsize; ray++)
+            {
+                start[ray+1] += start[ray];
+            }
+            *pixels = malloc(sizeof **pixels * start[dsize]);
+            *lengths = malloc(sizeof **lengths * start[dsize]);
+            if (start[dsize] > 0 && (*pixels == NULL || *lengths == NULL))
             {
-                // indi.size is csize - 1
-                *psize += csize-1;
-                csize_list[num_lists] = csize-1;
-                rays_list[num_lists] = ray;
-                pixels_list[num_lists] = indi;
-                lengths_list[num_lists] = dist;
-                num_lists++;
+                status = -1;
             }
         }
-    }
-    free(coordx);
-    free(coordy);
-    free(ax);
-    free(ay);
-    free(bx);
-    free(by);
-    // free(coorx); -> coorx
-    // free(coory); -> coorx
-    // free(dist); -> bx
-    // free(midx); -> ax
-    // free(midy); -> ay
 
-    // Copy all of the intersections to one array
-    *pixels = malloc(sizeof **pixels * psize[0]);
-    *rays = malloc(sizeof **rays * psize[0]);
-    *lengths = malloc(sizeof **lengths * psize[0]);
-    assert(*pixels != NULL && *rays != NULL && *lengths != NULL);
-    int j = 0;
-    for(int i=0; i < num_lists; i++)
-    {
-        // Copy the data from buffers to final array
-        memcpy(&(*pixels)[j], pixels_list[i], sizeof **pixels * csize_list[i]);
-        free(pixels_list[i]);
-        memcpy(&(*lengths)[j], lengths_list[i], sizeof **lengths * csize_list[i]);
-        free(lengths_list[i]);
-        for(int k=0; k < csize_list[i]; k++)
+        // Second pass: write the intersections of each ray into its block.
+        #pragma omp for schedule(dynamic, 256)
+        for (int64_t ray = 0; ray < dsize; ray++)
         {
-            (*rays)[j + k] = rays_list[i];
+            int quadrant, asize, bsize, csize;
+            const int msize = start[ray+1] - start[ray];
+            if (msize > 0 && status == 0)
+            {
+                trace_ray(
+                    oxmin, oymin, ox, oy, theta[ray], h[ray], gridx, gridy,
+                    coordx, coordy, &asize, ax, ay, &bsize, bx, by,
+                    &quadrant);
+                sort_intersections(
+                    quadrant, asize, ax, ay, bsize, bx, by,
+                    &csize, coorx, coory);
+                assert(csize - 1 == msize);
+                calc_dist(
+                    csize, coorx, coory, midx, midy,
+                    &(*lengths)[start[ray]]);
+                calc_index(
+                    ox, oy, 1, oxmin, oymin, 0,
+                    xsize/ox, ysize/oy, 1,
+                    msize, midx, midy, 0, &(*pixels)[start[ray]]);
+            }
         }
-        j += csize_list[i];
+        free(coordx);
+        free(coordy);
+        free(ax);
+        free(ay);
+        free(bx);
+        free(by);
+    }
+    if (status != 0)
+    {
+        free(*pixels);
+        free(*lengths);
+        *pixels = NULL;
+        *lengths = NULL;
+    }
+    return status;
+}
+
+int
+get_line_pixels_and_lengths(
+    const float oxmin, const float oymin,
+    const float xsize, const float ysize,
+    const int ox, const int oy,
+    const float * const theta, const float * const h,
+    const int64_t nline,
+    const float *gridx, const float *gridy,
+    int64_t **start, int **pixels, float **lengths)
+{
+    *pixels = NULL;
+    *lengths = NULL;
+    // The pixels are indexed with int in the plane
+    if ((int64_t)ox * oy > INT_MAX) return -1;
+    *start = malloc(sizeof **start * (nline+1));
+    if (*start == NULL) return -1;
+    if (trace_rays(
+            oxmin, oymin, xsize, ysize, ox, oy,
+            theta, h, nline, gridx, gridy,
+            *start, pixels, lengths) != 0)
+    {
+        free(*start);
+        *start = NULL;
+        return -1;
     }
-    free(csize_list);
-    free(rays_list);
-    free(pixels_list);
-    free(lengths_list);
+    return 0;
 }
 
 
@@ -313,7 +374,6 @@ calc_index(
     int const msize, const float * const midx, const float * const midy,
     int const indz, int * const indi)
 {
-    assert(UINT_MAX/ox/oy/oz > 0 && "Array is too large to index.");
     // printf("SHAPE: %d, %d, %d : %f, %f, %f : %f, %f, %f\n",
     //         ox, oy, oz, oxmin, oymin, ozmin, xstep, ystep, zstep);
     int n, indx, indy;
@@ -329,6 +389,6 @@ calc_index(
         // indy = fmin(fmax(0, indy), oy-1);
         // Convert from 3D to linear C-order indexing
         indi[n] = indy + oy * (indx + ox * (indz));
-        assert(0 <= indi[n] && indi[n] < (int)ox*oy*oz);
+        assert(0 <= indi[n] && indi[n] < (int64_t)ox*oy*oz);
     }
 }
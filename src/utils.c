@@ -17,17 +17,23 @@ void make_grid(
     assert(gridx[nx] == xmin + xsize);
 }
 
-void bin_angle(
-    float *bins, const float magnitude,
+int angle_bin(
     const float theta, const int nbins)
 {
-    assert(bins != NULL);
     assert(nbins > 0);
     int bin = floor(fmod(theta, M_PI) / (M_PI / nbins));
     // Negative angles yield negative bins
     if (bin < 0) bin += nbins;
     assert(bin >= 0 && bin < nbins);
-    bins[bin] += magnitude;
+    return bin;
+}
+
+void bin_angle(
+    float *bins, const float magnitude,
+    const float theta, const int nbins)
+{
+    assert(bins != NULL);
+    bins[angle_bin(theta, nbins)] += magnitude;
 }
 
 void
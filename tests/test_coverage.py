@@ -323,6 +323,37 @@ def test_theta_coverage():
     np.testing.assert_equal(cov_map, truth)
 
 
+def test_coverage_map_segments():
+    """Adding segments and removing one matches the whole trajectory."""
+    np.random.seed(0)
+    region = np.zeros((4, 8, 8, 3))
+    theta = np.random.rand(30) * np.pi
+    h = np.random.rand(30) * 0.5 - 0.5
+    v = np.random.rand(30) * 0.5 - 0.5
+    dwell = np.random.rand(30)
+    whole = coverage(region, None, None, np.ones((2, 2)), None,
+                     theta, h, v, dwell)
+    cmap = CoverageMap(region, None, None, np.ones((2, 2)), None)
+    cmap.extend((theta[i:i+10], h[i:i+10], v[i:i+10], dwell[i:i+10])
+                for i in range(0, 30, 10))
+    assert cmap.npos == 30
+    np.testing.assert_allclose(cmap.coverage_map, whole, atol=1e-5)
+    # Replace the middle segment with nothing
+    cmap.remove(theta[10:20], h[10:20], v[10:20], dwell[10:20])
+    partial = coverage(region, None, None, np.ones((2, 2)), None,
+                       np.r_[theta[:10], theta[20:]], np.r_[h[:10], h[20:]],
+                       np.r_[v[:10], v[20:]], np.r_[dwell[:10], dwell[20:]])
+    assert cmap.npos == 20
+    np.testing.assert_allclose(cmap.coverage_map, partial, atol=1e-5)
+
+
+def test_coverage_zero_probe():
+    """A probe without any nonzero pixels covers nothing."""
+    cov_map = coverage(np.zeros((2, 4, 4, 2)), None, None, np.zeros((2, 2)),
+                       None, np.zeros(3), None, None)
+    np.testing.assert_equal(cov_map, 0)
+
+
 if __name__ == '__main__':
     test_stationary_coverage()
     test_horizontal_coverage()
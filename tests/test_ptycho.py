@@ -51,13 +51,28 @@ from __future__ import (absolute_import, division, print_function,
 
 import numpy as np
 import matplotlib.pyplot as plt
-from tike.ptycho import pad_grid, unpad_grid
+from tike.ptycho import (pad_grid, unpad_grid, patch_indices, patch_targets,
+                         get_patches, add_patches, get_fft_backend, gaussian,
+                         grad, simulate, reconstruct)
 
 __author__ = "Daniel Ching"
 __copyright__ = "Copyright (c) 2016, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
 
 
+def _simulated_scan(npos):
+    """Return the data, probe, theta, h, v, and psi of a scan of a gaussian
+    probe over npos random positions of a random phase object."""
+    np.random.seed(0)
+    probe = gaussian(8) + 0j
+    psi = np.exp(1j * np.random.rand(1, 32, 32))
+    theta = np.zeros(npos, dtype=int)
+    h = np.random.randint(0, 32 - 8, npos)
+    v = np.random.randint(0, 32 - 8, npos)
+    data = simulate((12, 12), None, probe, theta, h, v, psi)
+    return data, probe, theta, h, v, psi
+
+
 def test_pad_grid():
     A = np.ones([3, 4])
     # Pad one larger and two larger
@@ -92,3 +107,126 @@ def test_unpad_error():
         print(err)
         return
     assert False
+
+
+def test_patches_match_slices():
+    """Gathering and scattering patches matches slicing each position."""
+    np.random.seed(0)
+    psi = np.random.rand(2, 9, 8) + 1j * np.random.rand(2, 9, 8)
+    theta = np.random.randint(0, 2, 20)
+    h = np.random.randint(0, 9 - 3 + 1, 20)
+    v = np.random.randint(0, 8 - 4 + 1, 20)
+    indices = patch_indices(psi.shape, (3, 4), theta, h, v)
+    patches = get_patches(psi, indices)
+    total = np.zeros(psi.shape, dtype=complex)
+    for m in range(h.size):
+        np.testing.assert_equal(patches[m],
+                                psi[theta[m], h[m]:h[m]+3, v[m]:v[m]+4])
+        total[theta[m], h[m]:h[m]+3, v[m]:v[m]+4] += patches[m]
+    upd = add_patches(np.zeros(psi.shape, dtype=complex), patches, indices)
+    np.testing.assert_allclose(upd, total)
+    # The targets can be found once and reused
+    targets = patch_targets(indices, psi.size)
+    upd = add_patches(np.zeros(psi.shape, dtype=complex), patches, indices,
+                      targets)
+    np.testing.assert_allclose(upd, total)
+
+
+def test_fft_backends_match_numpy():
+    np.random.seed(0)
+    a = np.random.rand(3, 8, 6) + 1j * np.random.rand(3, 8, 6)
+    for name in ['numpy', 'scipy', 'pyfftw']:
+        try:
+            fft = get_fft_backend(name)
+        except ImportError:
+            continue
+        np.testing.assert_allclose(fft.fft2(a), np.fft.fft2(a), atol=1e-12)
+        b = a.copy()
+        # In place on a preallocated buffer
+        assert fft.ifft2(b, out=b) is b
+        np.testing.assert_allclose(b, np.fft.ifft2(a), atol=1e-12)
+
+
+def test_grad_single_precision():
+    """The complex64 engine follows the complex128 one."""
+    data, probe, theta, h, v, psi = _simulated_scan(50)
+    init = np.exp(1j * np.random.rand(*psi.shape))
+    double = grad(data=data, probe=probe, theta=theta, h=h, v=v, psi=init,
+                  niter=3)
+    single = grad(data=data, probe=probe, theta=theta, h=h, v=v, psi=init,
+                  niter=3, dtype=np.complex64)
+    assert double.dtype == np.complex128 and single.dtype == np.complex64
+    np.testing.assert_allclose(single, double, atol=1e-4)
+
+
+def test_minibatches_reduce_error():
+    """Shuffled mini-batches fit the data as well as one batch."""
+    data, probe, theta, h, v, psi = _simulated_scan(60)
+    init = np.ones(psi.shape, dtype=complex)
+    kwargs = dict(data=data, probe=probe, theta=theta, h=h, v=v, psi=init,
+                  algorithm='grad', niter=4)
+    whole = reconstruct(**kwargs)
+    # One batch of every position is the same as no batches
+    np.testing.assert_allclose(reconstruct(batch_size=60, **kwargs), whole)
+    batches = reconstruct(batch_size=16, shuffle=True, random_state=0,
+                          **kwargs)
+
+    def error(new_psi):
+        return np.linalg.norm(
+            simulate((12, 12), None, probe, theta, h, v, new_psi) - data)
+
+    # psi is regularized once per pass, so the passes match the full batch
+    assert error(batches) < 1.1 * error(whole) < 0.5 * error(init)
+    assert np.linalg.norm(batches - whole) < 0.15 * np.linalg.norm(whole)
+
+
+def test_pie_refines_probe():
+    """ePIE and rPIE fit the data with a wrong initial probe."""
+    data, probe, theta, h, v, psi = _simulated_scan(60)
+    init = np.ones(psi.shape, dtype=complex)
+    guess = gaussian(8, rin=0.5) + 0j
+
+    def error(new_psi, new_probe):
+        return np.linalg.norm(
+            simulate((12, 12), None, new_probe, theta, h, v, new_psi) - data)
+
+    for algorithm, alpha in [('epie', 1.0), ('rpie', 0.1)]:
+        new_psi, new_probe = reconstruct(
+            data=data, probe=guess, theta=theta, h=h, v=v, psi=init,
+            algorithm=algorithm, niter=10, alpha=alpha, update_probe=True,
+            random_state=0)
+        assert new_probe.shape == probe.shape
+        assert error(new_psi, new_probe) < 0.1 * error(init, guess)
+    try:
+        reconstruct(data=data, probe=guess, theta=theta, h=h, v=v, psi=init,
+                    algorithm='grad', update_probe=True)
+    except ValueError as err:
+        print(err)
+        return
+    assert False
+
+
+def test_nesterov_without_momentum_is_grad():
+    data, probe, theta, h, v, psi = _simulated_scan(20)
+    kwargs = dict(data=data, probe=probe, theta=theta, h=h, v=v,
+                  psi=np.ones(psi.shape, dtype=complex), niter=3, gamma=0.05)
+    np.testing.assert_allclose(
+        reconstruct(algorithm='nesterov', momentum=0, **kwargs),
+        reconstruct(algorithm='grad', **kwargs))
+
+
+def test_nesterov_converges_faster():
+    """Momentum reaches a lower error than plain gradient descent in the
+    same number of iterations."""
+    data, probe, theta, h, v, psi = _simulated_scan(60)
+    init = np.ones(psi.shape, dtype=complex)
+    kwargs = dict(data=data, probe=probe, theta=theta, h=h, v=v, psi=init,
+                  niter=10, gamma=0.05)
+
+    def error(new_psi):
+        return np.linalg.norm(
+            simulate((12, 12), None, probe, theta, h, v, new_psi) - data)
+
+    plain = error(reconstruct(algorithm='grad', **kwargs))
+    accelerated = error(reconstruct(algorithm='nesterov', **kwargs))
+    assert accelerated < 0.6 * plain
@@ -50,6 +50,7 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import numpy as np
+import pytest
 import matplotlib.pyplot as plt
 from tike.tomo import *
 
@@ -95,3 +96,392 @@ def test_forward_project_hv_quadrants4():
                        pgrid, theta, h, v)
     truth = np.array([2]).reshape(1, 1, 1)
     np.testing.assert_equal(truth, integral)
+
+
+def test_projector_reuse():
+    """A Projector gives the same results as the one-off functions."""
+    np.random.seed(0)
+    obj = np.random.rand(4, 8, 8).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 16, endpoint=False)
+    h = np.full(theta.shape, -4.0)
+    v = np.full(theta.shape, -2.0)
+    pgrid = np.ones((8, 4))
+    truth = forward(obj, gmin, pgrid, theta, h, v)
+    with Projector(obj.shape, gmin, pgrid, theta, h, v) as A:
+        for i in range(2):
+            np.testing.assert_allclose(A.forward(obj), truth, rtol=1e-6)
+        recon = np.zeros(obj.shape, dtype='float32')
+        recon = A.reconstruct(recon, truth, 'sirt', niter=1)
+        expected = reconstruct(np.zeros(obj.shape), gmin, pgrid,
+                               theta, h, v, truth, 'sirt', niter=1)
+        np.testing.assert_allclose(recon, expected, rtol=1e-6)
+        backward = A.back(np.ones(truth.shape))
+        assert backward.shape == obj.shape
+        np.testing.assert_allclose(
+            np.sum(A.forward(obj)), np.sum(backward * obj), rtol=1e-4)
+
+
+def test_forward_project_slices_share_lines():
+    """Rays which differ only in v see the same pixels in their own slice."""
+    np.random.seed(0)
+    obj = np.random.rand(5, 7, 6)
+    obj[3] = obj[1]
+    gmin = -np.array(obj.shape) / 2.0
+    theta = [0.3, 2.1]
+    h = [-3.3, -2.9]
+    v = [-2.5, -2.5]
+    pgrid = np.ones((5, 5))
+    integral = forward(obj, gmin, pgrid, theta, h, v)
+    assert integral.shape == (2, 5, 5)
+    np.testing.assert_equal(integral[..., 1], integral[..., 3])
+    assert np.all(integral[..., 0] != integral[..., 1])
+
+
+def test_streaming_projector_matches_cached():
+    """Tracing lines in small blocks gives the same results as caching."""
+    np.random.seed(0)
+    obj = np.random.rand(3, 9, 8).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, 2 * np.pi, 11)
+    h = np.random.rand(theta.size) * 6 - 5
+    v = np.full(theta.shape, -1.5)
+    pgrid = np.ones((4, 2))
+    truth = forward(obj, gmin, pgrid, theta, h, v)
+    streamed = forward(obj, gmin, pgrid, theta, h, v, block_size=3)
+    np.testing.assert_allclose(streamed, truth, rtol=1e-6)
+    for algorithm in ['art', 'sirt']:
+        cached = reconstruct(np.zeros(obj.shape), gmin, pgrid,
+                             theta, h, v, truth, algorithm, niter=2)
+        streamed = reconstruct(np.zeros(obj.shape), gmin, pgrid,
+                               theta, h, v, truth, algorithm, niter=2,
+                               block_size=5)
+        np.testing.assert_allclose(streamed, cached, rtol=1e-5, atol=1e-6)
+
+
+def test_streaming_block_sizes():
+    """Blocks that do not divide the lines evenly or are larger than a 32-bit
+    int give the cached result; other block sizes are rejected."""
+    np.random.seed(0)
+    obj = np.random.rand(2, 8, 8).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    # 5 unique lines of 4 active probe columns are 20 lines to trace
+    theta = np.linspace(0, np.pi, 5, endpoint=False)
+    h = np.full(theta.shape, -3.0)
+    v = np.full(theta.shape, -1.0)
+    pgrid = np.ones((4, 2))
+    truth = forward(obj, gmin, pgrid, theta, h, v)
+    for block_size in [3, 7, 19, 2**31 - 1, 2**32]:
+        streamed = forward(obj, gmin, pgrid, theta, h, v,
+                           block_size=block_size)
+        np.testing.assert_allclose(streamed, truth, rtol=1e-6)
+    for block_size in [0, -1, -2**32]:
+        with pytest.raises(ValueError):
+            Projector(obj.shape, gmin, pgrid, theta, h, v,
+                      block_size=block_size)
+
+
+def test_back_is_adjoint_of_forward():
+    """<A x, y> equals <x, A^T y> for the gathered and the streamed back
+    projections, including rays that repeat a line in the same slice."""
+    np.random.seed(0)
+    shape = (3, 7, 6)
+    gmin = -np.array(shape) / 2.0
+    theta = np.repeat(np.linspace(0, np.pi, 5), 2)
+    h = np.random.rand(theta.size) * 4 - 4
+    v = np.tile([-1.5, -1.5, 0.2, -3], 5)[:theta.size]
+    pgrid = np.ones((3, 2))
+    x = np.random.rand(*shape).astype('float32')
+    for block_size in [None, 2]:
+        with Projector(shape, gmin, pgrid, theta, h, v,
+                       block_size=block_size) as A:
+            y = np.random.rand(*A.data_shape).astype('float32')
+            lhs = np.sum(A.forward(x).astype('float64') * y)
+            rhs = np.sum(A.back(y).astype('float64') * x)
+        np.testing.assert_allclose(lhs, rhs, rtol=1e-5)
+
+
+def test_channels_match_separate_projections():
+    """Projecting P channels at once equals projecting each channel."""
+    np.random.seed(0)
+    obj = np.random.rand(2, 6, 7, 3).astype('float32')
+    gmin = -np.array(obj.shape[0:3]) / 2.0
+    theta = np.linspace(0, np.pi, 5)
+    h = np.random.rand(theta.size) * 3 - 4
+    v = np.full(theta.shape, -1.0)
+    pgrid = np.ones((4, 2))
+    for block_size in [None, 2]:
+        with Projector(obj.shape, gmin, pgrid, theta, h, v,
+                       block_size=block_size) as A:
+            data = A.forward(obj)
+            assert data.shape == A.data_shape + (3, )
+            back = A.back(data)
+            assert back.shape == obj.shape
+            for c in range(obj.shape[3]):
+                np.testing.assert_allclose(data[..., c],
+                                           A.forward(obj[..., c]), rtol=1e-6)
+                np.testing.assert_allclose(back[..., c], A.back(data[..., c]),
+                                           rtol=1e-5)
+            for algorithm in ['art', 'sart', 'sirt', 'cgls', 'grad']:
+                together = A.reconstruct(np.zeros(obj.shape), data, algorithm,
+                                         niter=3)
+                for c in range(obj.shape[3]):
+                    alone = A.reconstruct(np.zeros(obj.shape[0:3]),
+                                          data[..., c], algorithm, niter=3)
+                    np.testing.assert_allclose(together[..., c], alone,
+                                               rtol=1e-4, atol=1e-5)
+
+
+def test_probe_matches_expanded_rays():
+    """A probe gives the same integrals as one single pixel probe per ray, and
+    the rays of zero probe pixels are skipped."""
+    np.random.seed(0)
+    obj = np.random.rand(4, 7, 6).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 5)
+    h = np.random.rand(theta.size) * 3 - 4
+    v = np.random.rand(theta.size) * 2 - 2
+    probe = np.ones((3, 2))
+    probe[1, 0] = 0
+    probe[2, :] = 0
+    integral = forward(obj, gmin, probe, theta, h, v)
+    assert integral.shape == (theta.size, ) + probe.shape
+    np.testing.assert_equal(integral[:, probe == 0], 0)
+    dh, dv = np.meshgrid(np.arange(3), np.arange(2), indexing='ij')
+    expanded = forward(obj, gmin, np.ones((1, 1)),
+                       np.repeat(theta, 6),
+                       (h[:, None] + dh.ravel()).ravel(),
+                       (v[:, None] + dv.ravel()).ravel())
+    expanded = expanded.reshape(integral.shape)
+    np.testing.assert_allclose(integral[:, probe != 0],
+                               expanded[:, probe != 0], rtol=1e-6)
+
+
+def test_projector_too_large_raises():
+    """A plane with more pixels than an int can index is an error, even when
+    assertions are compiled out."""
+    theta = np.zeros(1)
+    with pytest.raises(MemoryError):
+        Projector((1, 50000, 50000), None, np.ones((1, 1)), theta)
+
+
+def _residual(A, obj, data):
+    return np.linalg.norm(A.forward(obj) - data)
+
+
+def test_row_action_converges_faster():
+    """ART, OS-SART, and CGLS reach a lower residual than SIRT quickly."""
+    np.random.seed(0)
+    obj = np.zeros((1, 16, 16), dtype='float32')
+    obj[0, 4:12, 5:10] = 1
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 24, endpoint=False)
+    h = np.full(theta.shape, -8.0)
+    v = np.full(theta.shape, -0.5)
+    pgrid = np.ones((16, 1))
+    with Projector(obj.shape, gmin, pgrid, theta, h, v) as A:
+        data = A.forward(obj)
+        residuals = dict()
+        for algorithm, kwargs in [('sirt', {}),
+                                  ('cgls', {}),
+                                  ('art', {'order': 'golden'}),
+                                  ('sart', {'subsets': 6, 'order': 'random'})]:
+            recon = A.reconstruct(np.zeros(obj.shape, dtype='float32'),
+                                  data, algorithm, niter=3, **kwargs)
+            residuals[algorithm] = _residual(A, recon, data)
+    assert residuals['art'] < 0.5 * residuals['sirt'], residuals
+    assert residuals['sart'] < 0.5 * residuals['sirt'], residuals
+    assert residuals['cgls'] < 0.5 * residuals['sirt'], residuals
+
+
+def test_subset_order():
+    from tike.tomo import _subset_order
+    for order in ['sequential', 'random', 'golden']:
+        angles, start = _subset_order(10, 3, order)
+        assert start.tolist()[0] == 0 and start[-1] == 10
+        np.testing.assert_equal(np.sort(angles), np.arange(10))
+        for s in range(3):
+            subset = angles[start[s]:start[s+1]]
+            assert np.all(subset % 3 == subset[0] % 3)
+    angles, start = _subset_order(8, None, 'golden')
+    np.testing.assert_equal(angles, [0, 5, 2, 7, 4, 1, 6, 3])
+
+
+def test_solvers_stop_at_tolerance():
+    np.random.seed(0)
+    obj = np.random.rand(2, 8, 8).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 16, endpoint=False)
+    h = np.full(theta.shape, -4.0)
+    v = np.full(theta.shape, -1.0)
+    pgrid = np.ones((8, 2))
+    for algorithm in ['sirt', 'cgls', 'grad']:
+        with Projector(obj.shape, gmin, pgrid, theta, h, v) as A:
+            data = A.forward(obj)
+            full, stopped = dict(), dict()
+            A.reconstruct(np.zeros(obj.shape), data, algorithm, niter=50,
+                          stats=full)
+            recon = A.reconstruct(np.zeros(obj.shape), data, algorithm,
+                                  niter=50, tol=0.1, stats=stopped)
+            error = _residual(A, recon, data) / np.linalg.norm(data)
+        assert full['niter'] == 50
+        assert 0 < stopped['niter'] < 50
+        assert stopped['residual'] <= 0.1
+        assert full['residual'] < stopped['residual']
+        assert error < 0.1
+
+
+def test_slabs_match_whole_volume():
+    """Reconstructing z slabs in parallel processes equals reconstructing the
+    whole volume for methods whose updates are local to each ray."""
+    np.random.seed(0)
+    obj = np.random.rand(6, 8, 7).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 8, endpoint=False)
+    h = np.full(theta.shape, -4.0)
+    v = np.array([-3, -1.5, -1, 0.2, -3, -2.5, 0, 1], dtype='float32')
+    probe = np.ones((8, 3))
+    data = forward(obj, gmin, probe, theta, h, v)
+    for algorithm in ['art', 'sirt']:
+        whole = reconstruct(np.zeros(obj.shape), gmin, probe, theta, h, v,
+                            data, algorithm, niter=2)
+        stats = dict()
+        slabs = reconstruct(np.zeros(obj.shape), gmin, probe, theta, h, v,
+                            data, algorithm, niter=2, nslab=3, processes=2,
+                            stats=stats)
+        np.testing.assert_allclose(slabs, whole, rtol=1e-5, atol=1e-6)
+        assert stats['niter'] == 2
+    # A callback could not stop the other processes
+    with pytest.raises(ValueError):
+        reconstruct(np.zeros(obj.shape), gmin, probe, theta, h, v, data,
+                    'sirt', niter=2, nslab=3, callback=lambda *args: True)
+
+
+def test_many_jobs_in_threads():
+    """Jobs run in a thread pool give the same results as run one by one."""
+    np.random.seed(0)
+    pgrid = np.ones((6, 2))
+    jobs = list()
+    for i in range(6):
+        obj = np.random.rand(2, 6, 6).astype('float32')
+        theta = np.linspace(0, np.pi, 4 + i, endpoint=False)
+        jobs.append(dict(obj=obj, obj_min=(-1, -3, -3), probe=pgrid,
+                         theta=theta, h=np.full(theta.shape, -3.0),
+                         v=np.full(theta.shape, -1.0)))
+    futures = forward_many(jobs, max_workers=3)
+    for job, future in zip(jobs, futures):
+        job['line_integrals'] = future.result()
+        np.testing.assert_allclose(job['line_integrals'], forward(**job),
+                                   rtol=1e-6)
+        job.update(obj=np.zeros(job['obj'].shape), algorithm='sirt', niter=2)
+    futures = reconstruct_many(jobs, max_workers=3)
+    for job, future in zip(jobs, futures):
+        np.testing.assert_allclose(future.result(), reconstruct(**job),
+                                   rtol=1e-6)
+
+
+def test_compressed_projector_matches_cached():
+    """Compressed intersections give the same projections, including pixel
+    steps too large for a 16-bit difference."""
+    np.random.seed(0)
+    for shape in [(3, 9, 8), (1, 3, 40000)]:
+        obj = np.random.rand(*shape).astype('float32')
+        gmin = -np.array(obj.shape) / 2.0
+        theta = np.linspace(0, 2 * np.pi, 11)
+        h = np.random.rand(theta.size) * 2 - 1.5
+        v = np.full(theta.shape, -0.5)
+        pgrid = np.ones((2, 1))
+        data = np.random.rand(theta.size, 2, 1).astype('float32')
+        with Projector(shape, gmin, pgrid, theta, h, v) as A:
+            truth = A.forward(obj)
+            back = A.back(data)
+            recon = A.reconstruct(np.zeros(shape), truth, 'art', niter=2)
+        for half, rtol in [(False, 1e-6), (True, 1e-3)]:
+            with Projector(shape, gmin, pgrid, theta, h, v, compress=True,
+                           half_lengths=half) as A:
+                np.testing.assert_allclose(A.forward(obj), truth, rtol=rtol)
+                np.testing.assert_allclose(A.back(data), back, rtol=rtol,
+                                           atol=1e-6)
+                np.testing.assert_allclose(
+                    A.reconstruct(np.zeros(shape), truth, 'art', niter=2),
+                    recon, rtol=10 * rtol, atol=1e-5)
+
+
+def test_stats_count_the_work():
+    np.random.seed(0)
+    obj = np.random.rand(2, 8, 8).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 8, endpoint=False)
+    h = np.full(theta.shape, -4.0)
+    v = np.full(theta.shape, -1.0)
+    pgrid = np.ones((8, 2))
+    stats = dict()
+    data = forward(obj, gmin, pgrid, theta, h, v, stats=stats)
+    assert stats['lines_traced'] == theta.size * 8
+    assert stats['intersections'] > 0 and stats['bytes_allocated'] > 0
+    assert stats['forward_seconds'] >= 0 and stats['iterations'] == 0
+    for block_size in [None, 4]:
+        with Projector(obj.shape, gmin, pgrid, theta, h, v,
+                       block_size=block_size) as A:
+            stats = dict()
+            A.reconstruct(np.zeros(obj.shape), data, 'sirt', niter=3,
+                          stats=stats)
+            assert stats['iterations'] == 3
+            # Only a streaming projector traces during a reconstruction
+            assert (stats['lines_traced'] > 0) == (block_size is not None)
+            # A cached projector traced every line once when it was created
+            total = A.profile()
+            assert total['lines_traced'] % (theta.size * 8) == 0
+            assert total['iterations'] == 3
+            # The next reconstruction reuses the work buffers
+            if block_size is None:
+                stats = dict()
+                A.reconstruct(np.zeros(obj.shape), data, 'sirt', niter=3,
+                              stats=stats)
+                assert stats['bytes_allocated'] == 0
+
+
+def test_callback_stops_early():
+    np.random.seed(0)
+    obj = np.random.rand(2, 8, 8).astype('float32')
+    gmin = -np.array(obj.shape) / 2.0
+    theta = np.linspace(0, np.pi, 16, endpoint=False)
+    h = np.full(theta.shape, -4.0)
+    v = np.full(theta.shape, -1.0)
+    pgrid = np.ones((8, 2))
+    with Projector(obj.shape, gmin, pgrid, theta, h, v) as A:
+        data = A.forward(obj)
+        calls = list()
+
+        def callback(niter, residual, x):
+            calls.append(niter)
+            return niter >= 4
+
+        stats = dict()
+        A.reconstruct(np.zeros(obj.shape), data, 'art', niter=10,
+                      callback=callback, stats=stats)
+        assert calls == [1, 2, 3, 4] and stats['niter'] == 4
+        assert len(stats['history']) == 4
+        assert stats['history'][-1] < stats['history'][0]
+        # The residual is of the obj passed with it
+        for algorithm in ['sirt', 'cgls', 'grad']:
+            def check(niter, residual, x):
+                error = _residual(A, x, data) / np.linalg.norm(data)
+                np.testing.assert_allclose(residual, error, rtol=1e-3)
+            A.reconstruct(np.zeros(obj.shape), data, algorithm, niter=3,
+                          callback=check)
+        # Chunks of cgls continue where the last chunk stopped
+        whole = A.reconstruct(np.zeros(obj.shape), data, 'cgls', niter=6)
+        stats = dict()
+        chunks = A.reconstruct(np.zeros(obj.shape), data, 'cgls', niter=6,
+                               chunk=2, stats=stats)
+        assert len(stats['history']) == 3
+        np.testing.assert_allclose(chunks, whole, rtol=1e-4, atol=1e-5)
+        # No iterations leave the obj and an empty history
+        stats = dict()
+        init = np.ones(obj.shape, dtype='float32')
+        recon = A.reconstruct(init.copy(), data, 'sirt', niter=0, chunk=2,
+                              stats=stats)
+        np.testing.assert_array_equal(recon, init)
+        assert stats['niter'] == 0 and stats['history'] == []
+        assert np.isnan(stats['residual'])
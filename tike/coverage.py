@@ -62,7 +62,7 @@ import ctypes
 __author__ = "Doga Gursoy, Daniel Ching"
 __copyright__ = "Copyright (c) 2018, UChicago Argonne, LLC."
 __docformat__ = "restructuredtext en"
-__all__ = ["coverage"]
+__all__ = ["coverage", "CoverageMap"]
 
 
 logging.basicConfig(level=logging.INFO)
@@ -112,7 +112,7 @@ def _coverage_interface(object_grid, object_min, object_size,
 
 def coverage(object_grid, object_min, object_size,
              probe_grid, probe_size, theta, h, v,
-             dwell=None, **kwargs):
+             dwell=None, stats=None, **kwargs):
     """Return a coverage map using this probe.
 
     The intersection between each line and each pixel is approximated by
@@ -126,6 +126,10 @@ def coverage(object_grid, object_min, object_size,
     dwell : (M, ) :py:class:`numpy.array` [s]
         Multiply the intersections lengths of the pixels and each line by these
         weights.
+    stats : dict, optional
+        If given, this dictionary is filled with the wall times of each phase
+        in the C library and its counters of work; see
+        :py:meth:`tike.tomo.Projector.profile`.
 
     Returns
     -------
@@ -137,30 +141,39 @@ def coverage(object_grid, object_min, object_size,
     object_grid, object_min, object_size, probe_grid, probe_size, theta, h, v \
         = _coverage_interface(object_grid, object_min, object_size,
                               probe_grid, probe_size, theta, h, v)
-    ngrid = object_grid.shape
-    assert len(ngrid) == 4, "Coverage map must have 4 dimensions."
-    # Multiply the trajectory by size of probe_grid
-    dh, dv = line_offsets(probe_grid, probe_size)
-    th1 = np.repeat(theta, dh.size)
-    h1 = np.repeat(h, dh.size).reshape(h.size, dh.size) + dh
-    v1 = np.repeat(v, dv.size).reshape(v.size, dv.size) + dv
+    assert len(object_grid.shape) == 4, \
+        "Coverage map must have 4 dimensions."
+    logger.info(" coverage {:,d} element grid".format(object_grid.size))
+    _add_coverage(object_grid, object_min, object_size,
+                  probe_grid, probe_size, theta, h, v, dwell, stats)
+    return object_grid
+
+
+def _add_coverage(coverage_map, object_min, object_size,
+                  probe_grid, probe_size, theta, h, v,
+                  dwell=None, stats=None):
+    """Add the coverage of the positions to the float32 coverage_map.
+
+    The arguments must already be checked by :py:func:`_coverage_interface`.
+    """
+    ngrid = coverage_map.shape
+    # The C library expands each position into the lines of the probe_grid
+    dh, dv = _probe_offsets(probe_grid, probe_size)
+    mask = np.ascontiguousarray(utils.as_uint8(probe_grid != 0))
+    logger.info(" probe uses {:,d} lines".format(np.count_nonzero(mask)))
     if dwell is None:
-        dw1 = np.ones(th1.shape)
-    else:
-        dw1 = np.repeat(dwell, dv.size)
+        dwell = np.ones(theta.shape)
     # Computer other parameters for c funcion
     line_area = np.prod(probe_size / probe_grid.shape)
-    pixel_volume = np.prod(object_size / object_grid.shape[0:3])
-    weights = dw1 * line_area / pixel_volume  # [s m^2 / m^3]
-    logger.info(" coverage {:,d} element grid".format(object_grid.size))
+    pixel_volume = np.prod(object_size / ngrid[0:3])
+    weights = dwell * line_area / pixel_volume  # [s m^2 / m^3]
     # Send data to c function
-    th1 = utils.as_float32(th1)
-    h1 = utils.as_float32(h1)
-    v1 = utils.as_float32(v1)
     weights = utils.as_float32(weights)
-    object_grid = utils.as_float32(object_grid)
-    LIBTIKE.coverage.restype = utils.as_c_void_p()
-    LIBTIKE.coverage(
+    assert weights.shape == theta.shape, \
+        "The size of dwell must be the same as the number of probes."
+    c_stats = utils.ProjectorStats()
+    LIBTIKE.coverage.restype = ctypes.c_int
+    status = LIBTIKE.coverage(
         utils.as_c_float(object_min[0]),
         utils.as_c_float(object_min[1]),
         utils.as_c_float(object_min[2]),
@@ -171,13 +184,142 @@ def coverage(object_grid, object_min, object_size,
         utils.as_c_int(ngrid[1]),
         utils.as_c_int(ngrid[2]),
         utils.as_c_int(ngrid[3]),
-        utils.as_c_float_p(th1),
-        utils.as_c_float_p(h1),
-        utils.as_c_float_p(v1),
+        utils.as_c_float_p(theta),
+        utils.as_c_float_p(h),
+        utils.as_c_float_p(v),
         utils.as_c_float_p(weights),
-        utils.as_c_int(th1.size),
-        utils.as_c_float_p(object_grid))
-    return object_grid
+        utils.as_c_int64(theta.size),
+        utils.as_c_float_p(dh),
+        utils.as_c_int(dh.size),
+        utils.as_c_float_p(dv),
+        utils.as_c_int(dv.size),
+        utils.as_c_uint8_p(mask),
+        utils.as_c_float_p(coverage_map),
+        ctypes.byref(c_stats))
+    if status != 0:
+        raise MemoryError("Could not compute the coverage of a {} grid. "
+                          "Each (x, y) plane may have at most {:,d} pixels, "
+                          "and the blocks of intersections must fit in "
+                          "memory.".format(ngrid[0:3],
+                                           np.iinfo(np.int32).max))
+    if stats is not None:
+        stats.update(c_stats.as_dict())
+
+
+class CoverageMap(object):
+    """A coverage map which is updated one trajectory segment at a time.
+
+    The work of each update is proportional to the number of positions in
+    the segment instead of the whole trajectory, so a trajectory can be
+    streamed from a generator or edited one segment at a time.
+
+    Parameters
+    ----------
+    object_grid : (Z, X, Y, T) :py:class:`numpy.array` [s]
+        The initial coverage map; usually zeros. It is copied to float32.
+    object_min, object_size, probe_grid, probe_size
+        See :py:func:`coverage`.
+
+    Attributes
+    ----------
+    coverage_map : (Z, X, Y, T) float32 :py:class:`numpy.array` [s]
+        The sum of the coverage of all of the segments added and not removed.
+    npos : int
+        The number of positions added minus the number removed.
+
+    Examples
+    --------
+    Replace one segment of a trajectory:
+
+    >>> cmap = CoverageMap(np.zeros((8, 8, 8, 4)), None, None,
+    ...                    np.ones((2, 2)), None)
+    >>> cmap.extend(segments)
+    >>> cmap.remove(*old_segment)
+    >>> cmap.add(*new_segment)
+    """
+
+    def __init__(self, object_grid, object_min, object_size,
+                 probe_grid, probe_size, **kwargs):
+        object_grid, object_min, object_size, probe_grid, probe_size, _, _, _ \
+            = _coverage_interface(object_grid, object_min, object_size,
+                                  probe_grid, probe_size, np.zeros(0),
+                                  None, None)
+        assert len(object_grid.shape) == 4, \
+            "Coverage map must have 4 dimensions."
+        self.coverage_map = np.array(object_grid, dtype=np.float32,
+                                     order='C')
+        self.object_min = object_min
+        self.object_size = object_size
+        self.probe_grid = probe_grid
+        self.probe_size = probe_size
+        self.npos = 0
+
+    def _update(self, theta, h, v, dwell, sign, stats):
+        theta = utils.as_float32(theta)
+        if h is None:
+            h = np.full(theta.shape, -0.5)
+        if v is None:
+            v = np.full(theta.shape, -0.5)
+        h, v = utils.as_float32(h), utils.as_float32(v)
+        assert theta.size == h.size == v.size, \
+            "The size of theta, h, v must be the same as the number of probes."
+        if dwell is None:
+            dwell = np.ones(theta.shape)
+        _add_coverage(self.coverage_map, self.object_min, self.object_size,
+                      self.probe_grid, self.probe_size, theta, h, v,
+                      sign * np.asarray(dwell), stats)
+        self.npos += sign * theta.size
+
+    def add(self, theta, h, v, dwell=None, stats=None):
+        """Add the coverage of a segment of the trajectory.
+
+        Parameters
+        ----------
+        theta, h, v, dwell, stats
+            See :py:func:`coverage`.
+        """
+        self._update(theta, h, v, dwell, 1, stats)
+        return self
+
+    def remove(self, theta, h, v, dwell=None, stats=None):
+        """Subtract the coverage of a segment which was added before.
+
+        The contribution is subtracted in float32, so pixels only covered by
+        the removed segment may be left with rounding errors instead of
+        exact zeros.
+
+        Parameters
+        ----------
+        theta, h, v, dwell, stats
+            See :py:func:`coverage`.
+        """
+        self._update(theta, h, v, dwell, -1, stats)
+        return self
+
+    def extend(self, segments):
+        """Add each segment from an iterable of (theta, h, v) or
+        (theta, h, v, dwell) tuples; for example, a generator of chunks of
+        a trajectory.
+        """
+        for segment in segments:
+            self.add(*segment)
+        return self
+
+
+def _probe_offsets(probe_grid, probe_size):
+    """Return the offsets of the columns and rows of the probe_grid from the
+    min corner of the probe.
+
+    Returns
+    -------
+    dh, dv : (H, ), (V, ) float32 [cm]
+        The offsets in the horizontal and vertical directions
+    """
+    gh = (np.linspace(0, probe_size[0], probe_grid.shape[0], endpoint=False)
+          + probe_size[0] / probe_grid.shape[0] / 2)
+    gv = (np.linspace(0, probe_size[1], probe_grid.shape[1], endpoint=False)
+          + probe_size[1] / probe_grid.shape[1] / 2)
+    return utils.as_float32(gh), utils.as_float32(gv)
 
 
 def line_offsets(probe_grid, probe_size):
@@ -190,10 +332,7 @@ def line_offsets(probe_grid, probe_size):
         The offsets in the horizontal and vertical directions
     """
     # Generate a grid of offset vectors
-    gh = (np.linspace(0, probe_size[0], probe_grid.shape[0], endpoint=False)
-          + probe_size[0] / probe_grid.shape[0] / 2)
-    gv = (np.linspace(0, probe_size[1], probe_grid.shape[1], endpoint=False)
-          + probe_size[1] / probe_grid.shape[1] / 2)
+    gh, gv = _probe_offsets(probe_grid, probe_size)
     dh, dv = np.meshgrid(gh, gv, indexing='ij')
     # Remove zero values
     nonzeros = probe_grid != 0
@@ -79,6 +79,7 @@ kwargs
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import copy
 import numpy as np
 import logging
 
@@ -87,6 +88,7 @@ __copyright__ = "Copyright (c) 2018, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
 __all__ = ["reconstruct",
            "simulate",
+           "set_fft_backend",
            ]
 
 
@@ -94,6 +96,175 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class FFTBackend(object):
+    """Computes the 2D FFTs over the last two axes of a stack of arrays.
+
+    The transforms are normalized like :py:func:`numpy.fft.fft2` and
+    :py:func:`numpy.fft.ifft2`. If `out` is given, the result is written into
+    it and returned; `out` may be the input for an in-place transform.
+    """
+
+    def fft2(self, a, out=None):
+        return self._copy(np.fft.fft2(a), out)
+
+    def ifft2(self, a, out=None):
+        return self._copy(np.fft.ifft2(a), out)
+
+    @staticmethod
+    def _copy(result, out):
+        if out is None or result is out:
+            return result
+        out[...] = result
+        return out
+
+
+class SciPyFFT(FFTBackend):
+    """Use :py:mod:`scipy.fft`, which keeps complex64 as complex64 and splits
+    a stack of transforms across `workers` threads.
+
+    Parameters
+    ----------
+    workers : int
+        The number of threads; negative values count back from the number
+        of CPUs, so -1 uses all of them.
+    """
+
+    def __init__(self, workers=-1):
+        import scipy.fft
+        self._fft = scipy.fft
+        self.workers = workers
+
+    def fft2(self, a, out=None):
+        return self._copy(self._fft.fft2(a, workers=self.workers,
+                                         overwrite_x=out is a), out)
+
+    def ifft2(self, a, out=None):
+        return self._copy(self._fft.ifft2(a, workers=self.workers,
+                                          overwrite_x=out is a), out)
+
+
+class FFTWBackend(FFTBackend):
+    """Use pyFFTW with a plan cached for each shape, dtype, and direction.
+
+    Plans are made on scratch arrays, so planning never overwrites the data.
+    Use :py:meth:`export_wisdom` and :py:meth:`import_wisdom` to keep the
+    planning work between sessions.
+
+    Parameters
+    ----------
+    threads : int
+        The number of threads; all of the CPUs by default.
+    planner_effort : string
+        The pyFFTW planner flag; FFTW_MEASURE plans slowly and runs fast.
+    """
+
+    def __init__(self, threads=None, planner_effort='FFTW_MEASURE'):
+        import pyfftw
+        import multiprocessing
+        self._fftw = pyfftw
+        self.threads = (multiprocessing.cpu_count() if threads is None
+                        else threads)
+        self.planner_effort = planner_effort
+        self._plans = dict()
+
+    def _plan(self, a, inverse, inplace):
+        key = (a.shape, a.dtype.str, inverse, inplace)
+        if key not in self._plans:
+            src = self._fftw.empty_aligned(a.shape, dtype=a.dtype)
+            dst = (src if inplace
+                   else self._fftw.empty_aligned(a.shape, dtype=a.dtype))
+            self._plans[key] = self._fftw.FFTW(
+                src, dst, axes=(-2, -1),
+                direction='FFTW_BACKWARD' if inverse else 'FFTW_FORWARD',
+                flags=(self.planner_effort, ),
+                threads=self.threads)
+        return self._plans[key]
+
+    def _aligned(self, x):
+        return x.flags.c_contiguous and self._fftw.is_byte_aligned(x)
+
+    def _transform(self, a, out, inverse):
+        a = np.asarray(a)
+        if not np.iscomplexobj(a):
+            a = a.astype(np.complex128)
+        # Only give aligned arrays to the plans; pyFFTW would otherwise copy
+        # a misaligned input into whichever array the plan last used.
+        src = (a if self._aligned(a)
+               else self._fftw.byte_align(np.ascontiguousarray(a)))
+        if out is a:
+            dst = src
+        elif (out is not None and out.dtype == a.dtype
+              and self._aligned(out)):
+            dst = out
+        else:
+            dst = self._fftw.empty_aligned(a.shape, dtype=a.dtype)
+        plan = self._plan(src, inverse, dst is src)
+        plan(input_array=src, output_array=dst)
+        return self._copy(dst, out)
+
+    def fft2(self, a, out=None):
+        return self._transform(a, out, False)
+
+    def ifft2(self, a, out=None):
+        return self._transform(a, out, True)
+
+    def export_wisdom(self):
+        """Return the accumulated FFTW wisdom."""
+        return self._fftw.export_wisdom()
+
+    def import_wisdom(self, wisdom):
+        """Load wisdom from :py:meth:`export_wisdom`."""
+        return self._fftw.import_wisdom(wisdom)
+
+
+_FFT_BACKENDS = {
+    'numpy': FFTBackend,
+    'scipy': SciPyFFT,
+    'pyfftw': FFTWBackend,
+}
+_fft_backend = FFTBackend()
+
+
+def set_fft_backend(backend='numpy', **kwargs):
+    """Choose the FFT backend of all functions in this module.
+
+    Parameters
+    ----------
+    backend : string or :py:class:`FFTBackend`
+        One of 'numpy' (the default), 'scipy', or 'pyfftw', or a backend
+        instance. scipy and pyfftw are optional dependencies.
+    kwargs
+        The parameters of the backend; e.g. `workers` for scipy or `threads`
+        for pyfftw.
+
+    Returns
+    -------
+    backend : :py:class:`FFTBackend`
+        The previous backend.
+    """
+    global _fft_backend
+    previous = _fft_backend
+    _fft_backend = get_fft_backend(backend, **kwargs)
+    return previous
+
+
+def get_fft_backend(backend=None, **kwargs):
+    """Return the backend instance for `backend`.
+
+    None returns the backend chosen with :py:func:`set_fft_backend`. Functions
+    in this module take an `fft` keyword argument which is passed here, so a
+    backend can also be chosen for one call.
+    """
+    if backend is None:
+        return _fft_backend
+    if isinstance(backend, FFTBackend):
+        return backend
+    if backend not in _FFT_BACKENDS:
+        raise ValueError("The {} FFT backend is not available; choose one of "
+                         "{}.".format(backend, sorted(_FFT_BACKENDS)))
+    return _FFT_BACKENDS[backend](**kwargs)
+
+
 def _ptycho_interface(data, data_min,
                       probe, theta, h, v,
                       psi, psi_min, **kwargs):
@@ -117,11 +288,13 @@ def _ptycho_interface(data, data_min,
         raise ValueError()
     if psi_min is None:
         psi_min = (-0.5, -0.5)
-    assert theta.size == h.size == v.size == data.shape[0] == \
+    theta, h, v = np.asarray(theta), np.asarray(h), np.asarray(v)
+    assert theta.size == h.size == v.size == data.shape[0], \
         "The size of theta, h, v must be the same as the number of data."
     # logger.info(" _ptycho_interface says {}".format("Hello, World!"))
     return (data, data_min,
-            probe, theta, h, v)
+            probe, theta, h, v,
+            psi, psi_min)
 
 
 def locate_pad(pshape, ushape):
@@ -335,14 +508,225 @@ def uncombine_grids(grid_shape, T, h, v,
     return grids
 
 
+def patch_indices(psi_shape, patch_shape, theta, h, v):
+    """Return the flat indices into psi of the pixels of each patch.
+
+    Computing the indices once lets every iteration gather and scatter all of
+    the patches with single vectorized operations instead of a loop over the
+    positions.
+
+    Parameters
+    ----------
+    psi_shape : (3, ) int
+        The shape (T, H, V) of psi.
+    patch_shape : (2, ) int
+        The shape (H, V) of each patch; usually the probe shape.
+    theta, h, v : (M, ) int
+        The view and min corner of each patch in psi.
+
+    Returns
+    -------
+    indices : (M, H, V) :py:class:`numpy.array` int
+        The index of each pixel of each patch into the raveled psi.
+    """
+    theta = np.asarray(theta, dtype=np.intp).reshape(-1, 1, 1)
+    h = np.asarray(h, dtype=np.intp).reshape(-1, 1, 1)
+    v = np.asarray(v, dtype=np.intp).reshape(-1, 1, 1)
+    assert theta.size == h.size == v.size, \
+        "The size of theta, h, v must be the same."
+    if theta.size > 0:
+        assert (h.min() >= 0 and h.max() + patch_shape[0] <= psi_shape[-2]
+                and v.min() >= 0 and v.max() + patch_shape[1] <= psi_shape[-1]
+                and theta.min() >= 0 and theta.max() < psi_shape[0]), \
+            "A patch is outside of psi."
+    dh = np.arange(patch_shape[0], dtype=np.intp).reshape(1, -1, 1)
+    dv = np.arange(patch_shape[1], dtype=np.intp).reshape(1, 1, -1)
+    return ((theta * psi_shape[-2] + h + dh) * psi_shape[-1]) + v + dv
+
+
+def patch_targets(indices, psi_size):
+    """Return the pixels of psi touched by the patches at `indices` for
+    :py:func:`add_patches`.
+
+    Finding the touched pixels sorts the indices, so compute them once for
+    each set of indices instead of in every scatter.
+
+    Returns
+    -------
+    touched : (N, ) :py:class:`numpy.array` int or None
+        The sorted unique indices or None if the patches have at least as
+        many pixels as psi, which is then summed into whole.
+    inverse : (M * H * V, ) :py:class:`numpy.array` int
+        The position of each index in `touched` or the raveled indices.
+    """
+    indices = indices.reshape(-1)
+    if indices.size < psi_size:
+        return np.unique(indices, return_inverse=True)
+    return None, indices
+
+
+def get_patches(psi, indices, out=None):
+    """Return the (M, H, V) patches of psi at the `indices` from
+    :py:func:`patch_indices`; in `out` if it is given."""
+    return np.take(psi, indices, out=out)
+
+
+def add_patches(psi, patches, indices, targets=None):
+    """Add the (M, H, V) patches to psi in place at the `indices` from
+    :py:func:`patch_indices`.
+
+    Overlapping patches are summed with :py:func:`numpy.bincount`, which is
+    much faster than :py:func:`numpy.add.at` or a loop over the positions.
+    When the patches have fewer pixels than psi, the sums are over only the
+    touched pixels, so the cost depends on the size of the patches instead
+    of the size of psi. Pass the `targets` from :py:func:`patch_targets` to
+    reuse them. psi must be C contiguous.
+    """
+    assert psi.flags.c_contiguous, "psi must be C contiguous."
+    flat = psi.reshape(-1)
+    patches = patches.reshape(-1)
+    if targets is None:
+        targets = patch_targets(indices, flat.size)
+    touched, indices = targets
+    target = flat if touched is None else np.take(flat, touched)
+    if np.iscomplexobj(patches):
+        target.real += np.bincount(indices, patches.real,
+                                   minlength=target.size)
+        target.imag += np.bincount(indices, patches.imag,
+                                   minlength=target.size)
+    else:
+        target += np.bincount(indices, patches, minlength=target.size)
+    if touched is not None:
+        flat[touched] = target
+    return psi
+
+
+class _Workspace(object):
+    """The buffers of the iterations of :py:func:`grad` and :py:func:`pie`.
+
+    They are allocated once, and each iteration writes over them in place.
+    The padding of `padded` stays zero; only its `center` is rewritten. The
+    `patches` buffers are only allocated for the solvers which update the
+    probe.
+    """
+
+    _names = ['nearplane', 'padded', 'farplane', 'magnitude', 'zero',
+              'amplitude', 'patches', 'patch_norm']
+
+    def __init__(self, npos, probe_shape, data_shape, dtype, patches=False):
+        real = np.finfo(dtype).dtype
+        pad_shape = (npos, ) + tuple(data_shape[-2:])
+        patch_shape = (npos, ) + tuple(probe_shape)
+        self.nearplane = np.empty(patch_shape, dtype=dtype)
+        self.padded = np.zeros(pad_shape, dtype=dtype)
+        hmin, hmax = locate_pad(pad_shape[-2], probe_shape[0])
+        vmin, vmax = locate_pad(pad_shape[-1], probe_shape[1])
+        self.center = (slice(None), slice(hmin, hmax), slice(vmin, vmax))
+        self.farplane = np.empty(pad_shape, dtype=dtype)
+        self.magnitude = np.empty(pad_shape, dtype=real)
+        self.zero = np.empty(pad_shape, dtype=bool)
+        self.amplitude = np.empty(pad_shape, dtype=real)
+        self.patches = np.empty(patch_shape, dtype=dtype) if patches else None
+        self.patch_norm = (np.empty(patch_shape, dtype=real) if patches
+                           else None)
+        # The patch indices and targets of all positions when they are one
+        # batch
+        self.indices = None
+        self.targets = None
+
+    def batch(self, npos):
+        """Return a workspace of the first npos positions of these buffers."""
+        ws = copy.copy(self)
+        for name in self._names:
+            if getattr(self, name) is not None:
+                setattr(ws, name, getattr(self, name)[:npos])
+        return ws
+
+
+def _batches(npos, batch_size, shuffle, random_state,
+             psi_shape, probe_shape, theta, h, v, data, ws):
+    """Yield the workspace, patch indices, and patch targets of each batch of
+    one iteration.
+
+    When one batch holds every position, its patch indices, targets, and
+    amplitudes are computed on the first call and then reused.
+    """
+    real = ws.magnitude.dtype
+    psi_size = int(np.prod(psi_shape))
+    if batch_size == npos:
+        if ws.indices is None:
+            ws.indices = patch_indices(psi_shape, probe_shape, theta, h, v)
+            ws.targets = patch_targets(ws.indices, psi_size)
+            np.sqrt(data, out=ws.amplitude, dtype=real)
+        yield ws, ws.indices, ws.targets
+        return
+    order = random_state.permutation(npos) if shuffle else None
+    for start in range(0, npos, batch_size):
+        batch = (slice(start, start + batch_size) if order is None
+                 else np.sort(order[start:start + batch_size]))
+        indices = patch_indices(psi_shape, probe_shape,
+                                theta[batch], h[batch], v[batch])
+        batch_ws = ws.batch(indices.shape[0])
+        np.sqrt(data[batch], out=batch_ws.amplitude, dtype=real)
+        yield batch_ws, indices, patch_targets(indices, psi_size)
+
+
+def _replace_amplitude(farplane, amplitude, ws):
+    """Set the amplitude of farplane to amplitude in place and keep the
+    phase; a zero farplane gets a phase of zero like np.angle."""
+    np.abs(farplane, out=ws.magnitude)
+    np.equal(ws.magnitude, 0, out=ws.zero)
+    np.copyto(ws.magnitude, 1, where=ws.zero)
+    np.copyto(farplane, 1, where=ws.zero)
+    np.divide(amplitude, ws.magnitude, out=ws.magnitude)
+    farplane *= ws.magnitude
+    return farplane
+
+
+def _exitwave_update(psi, probe, amplitude, indices, ws, fft):
+    """Return the change of the exit wave of each patch of psi at `indices`
+    when its far-plane amplitude is replaced by the measured `amplitude`.
+
+    The changes are in ws.nearplane. If ws has patches, the patches of psi
+    are also copied there.
+    """
+    if ws.patches is None:
+        nearplane = get_patches(psi, indices, out=ws.nearplane)
+        nearplane *= probe
+    else:
+        get_patches(psi, indices, out=ws.patches)
+        nearplane = np.multiply(ws.patches, probe, out=ws.nearplane)
+    # Pad and go to the far-plane
+    ws.padded[ws.center] = nearplane
+    farplane = fft.fft2(ws.padded, out=ws.farplane)
+    # Replace the amplitude with the measured amplitude
+    _replace_amplitude(farplane, amplitude, ws)
+    # Back to the near-plane
+    fft.ifft2(farplane, out=farplane)
+    np.subtract(farplane[ws.center], nearplane, out=nearplane)
+    return nearplane
+
+
+def _random_state(shuffle, random_state):
+    if shuffle and not isinstance(random_state, np.random.RandomState):
+        return np.random.RandomState(random_state)
+    return random_state
+
+
 def grad(data=None, data_min=None,
          probe=None, theta=None, h=None, v=None,
          psi=None, psi_min=None,
          reg=(1+0j), niter=1, rho=0.5, gamma=0.25, lamda=0j, epsilon=1e-8,
-         **kwargs):
+         fft=None, dtype=np.complex128,
+         batch_size=None, shuffle=False, random_state=None,
+         momentum=0, **kwargs):
     """Use gradient descent to update estimates for `psi`, the object
     transmission function.
 
+    The buffers of the iterations are allocated once; see
+    :py:class:`_Workspace`. Without a `batch_size`, the measured amplitudes
+    are also computed once.
+
     Parameters
     ----------
     reg : (T, H, V, P) :py:class:`numpy.array` complex
@@ -356,52 +740,170 @@ def grad(data=None, data_min=None,
     epsilon : float
         Primal residual absolute termination criterion.
         TODO:@Selin Create better description
+    fft : string or :py:class:`FFTBackend`, optional
+        The FFT backend of this call; see :py:func:`get_fft_backend`.
+    dtype : complex64 or complex128
+        The precision of the computation and of the returned psi. complex64
+        halves the memory and its traffic.
+    batch_size : int, optional
+        Update psi after each mini-batch of this many positions instead of
+        after all of them. Each of the `niter` iterations is then one pass
+        over the data, and the buffers hold one batch, so the memory used
+        besides data and psi depends only on the batch size. data may be a
+        :py:class:`numpy.memmap`; one batch of it is read at a time. The
+        regularization by `reg` and the `momentum` are applied once per
+        iteration, with the first batch.
+    shuffle : bool
+        Visit the batches in a new random order each iteration.
+    random_state : int or :py:class:`numpy.random.RandomState`, optional
+        The seed of the shuffling.
+    momentum : float [0, 1)
+        If not zero, use Nesterov's accelerated gradient: each step is taken
+        from psi extrapolated by momentum times the last change of psi. This
+        needs two more arrays the size of psi.
     """
     if not (np.iscomplexobj(psi) and np.iscomplexobj(probe)
             and np.iscomplexobj(reg)):
         raise TypeError("psi, probe, and reg must be complex.")
-    # Compute padding between probe and detector size
-    npadx = (data.shape[1] - probe.shape[0]) // 2
-    npady = (data.shape[2] - probe.shape[1]) // 2
-    # Compute probe inverse
-    # TODO: Update the probe too
-    probe_inverse = np.conj(probe)
-    wavefronts = np.empty([h.size, probe.shape[0], probe.shape[1]],
-                          dtype='complex')
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'c':
+        raise TypeError("dtype must be complex.")
+    assert 0 <= momentum < 1, "The momentum must be in [0, 1)."
+    fft = get_fft_backend(fft)
+    probe = np.asarray(probe, dtype=dtype)
+    # psi is updated in place, so it must be a copy
+    psi = np.array(psi, dtype=dtype, order='C')
+    theta, h, v = np.asarray(theta), np.asarray(h), np.asarray(v)
+    npos = theta.size
+    if batch_size is None or batch_size >= npos:
+        batch_size = npos
+    assert batch_size > 0, "The batch_size must be a positive integer."
+    ws = _Workspace(batch_size, probe.shape, data.shape, dtype)
+    random_state = _random_state(shuffle, random_state)
+    bias = np.asarray(gamma * rho * (reg - lamda / rho), dtype=dtype)
+    if momentum > 0:
+        # psi is the extrapolated point; these are the last step and change
+        previous = psi.copy()
+        change = np.empty_like(psi)
     for i in range(niter):
-        upd_psi = np.zeros(psi.shape, dtype='complex')
-        # combine all wavefronts into one array
-        for m in range(h.size):
-            wavefronts[m] = psi[theta[m],
-                                h[m]:h[m] + probe.shape[0],
-                                v[m]:v[m] + probe.shape[1]]
-        # Compute near-plane wavefront
-        nearplane = probe * wavefronts
-        # Pad before FFT
-        nearplane_pad = np.pad(nearplane,
-                               ((0, 0), (npadx, npadx), (npady, npady)),
-                               mode='constant')
-        # Go far-plane
-        farplane = np.fft.fft2(nearplane_pad)
-        # Replace the amplitude with the measured amplitude.
-        farplane = np.sqrt(data) * np.exp(1j * np.angle(farplane))
-        # Back to near-plane.
-        new_nearplane = np.fft.ifft2(farplane)[...,
-                                               npadx:npadx+probe.shape[0],
-                                               npady:npady+probe.shape[1]]
-        # Update measurement patch.
-        upd_m = probe_inverse * (new_nearplane - nearplane)
-        # Combine measurement with other updates
-        for m in range(h.size):
-            upd_psi[theta[m],
-                    h[m]:h[m]+probe.shape[0],
-                    v[m]:v[m]+probe.shape[1]] += upd_m[m]
-        # Update psi
-        psi = ((1 - gamma * rho) * psi
-               + gamma * rho * (reg - lamda / rho)
-               + (gamma / 2) * upd_psi)
+        for b, (batch_ws, indices, targets) in enumerate(_batches(
+                npos, batch_size, shuffle, random_state, psi.shape,
+                probe.shape, theta, h, v, data, ws)):
+            upd = _exitwave_update(psi, probe, batch_ws.amplitude, indices,
+                                   batch_ws, fft)
+            upd *= np.conj(probe) * (gamma / 2)
+            # The work on all of psi is done once per iteration, so a batch
+            # costs only as much as its patches.
+            if b == 0:
+                psi *= 1 - gamma * rho
+                psi += bias
+            add_patches(psi, upd, indices, targets)
+        if momentum > 0:
+            np.subtract(psi, previous, out=change)
+            previous[...] = psi
+            change *= momentum
+            psi += change
+    return previous if momentum > 0 else psi
+
+
+def pie(data=None, data_min=None,
+        probe=None, theta=None, h=None, v=None,
+        psi=None, psi_min=None,
+        niter=1, alpha=1.0, beta=1.0, regularized=False, update_probe=True,
+        fft=None, dtype=np.complex128,
+        batch_size=1, shuffle=True, random_state=None, **kwargs):
+    """Use the (regularized) extended ptychographical iterative engine to
+    update `psi` and the `probe`.
+
+    The positions are visited one batch at a time in a random order; after
+    each batch, psi and the probe are updated from the change of the exit
+    waves. ePIE scales the updates by the max intensity of the probe or the
+    patch:
+
+        psi += alpha * conj(probe) * dwave / max(|probe|^2)
+
+    rPIE (regularized=True) mixes the local and the max intensity:
+
+        psi += conj(probe) * dwave
+               / ((1 - alpha) * |probe|^2 + alpha * max(|probe|^2))
+
+    The probe updates are the same with the roles of the probe and the
+    patch of psi swapped and `beta` instead of `alpha`, averaged over the
+    batch. rPIE with alpha near 0.1 usually converges faster than ePIE.
 
-    return psi
+    Parameters
+    ----------
+    alpha, beta : float (0, 1]
+        The step sizes of the psi and probe updates.
+    regularized : bool
+        Use rPIE instead of ePIE.
+    update_probe : bool
+        Refine the probe too.
+    fft, dtype, random_state
+        See :py:func:`grad`.
+    batch_size : int
+        The number of positions of each update. Positions in a batch are
+        updated together, so batches should be small relative to the number
+        of positions which overlap.
+    shuffle : bool
+        Visit the positions in a new random order each iteration.
+
+    Returns
+    -------
+    psi : (T, H, V) :py:class:`numpy.array` complex
+        The updated object transmission function.
+    probe : (H, V) :py:class:`numpy.array` complex
+        The updated probe or a copy of the probe.
+    """
+    if not (np.iscomplexobj(psi) and np.iscomplexobj(probe)):
+        raise TypeError("psi and probe must be complex.")
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'c':
+        raise TypeError("dtype must be complex.")
+    fft = get_fft_backend(fft)
+    # Both are updated in place, so they must be copies
+    probe = np.array(probe, dtype=dtype, order='C')
+    psi = np.array(psi, dtype=dtype, order='C')
+    theta, h, v = np.asarray(theta), np.asarray(h), np.asarray(v)
+    npos = theta.size
+    if batch_size is None or batch_size >= npos:
+        batch_size = npos
+    assert batch_size > 0, "The batch_size must be a positive integer."
+    ws = _Workspace(batch_size, probe.shape, data.shape, dtype,
+                    patches=update_probe)
+    random_state = _random_state(shuffle, random_state)
+    for i in range(niter):
+        for batch_ws, indices, targets in _batches(
+                npos, batch_size, shuffle, random_state, psi.shape,
+                probe.shape, theta, h, v, data, ws):
+            dwave = _exitwave_update(psi, probe, batch_ws.amplitude, indices,
+                                     batch_ws, fft)
+            # The psi step depends on the probe before its update
+            intensity = np.square(np.abs(probe))
+            if regularized:
+                psi_step = np.conj(probe) / ((1 - alpha) * intensity
+                                             + alpha * intensity.max())
+            else:
+                psi_step = np.conj(probe) * (alpha / intensity.max())
+            if update_probe:
+                patches = batch_ws.patches
+                norm = np.square(np.abs(patches, out=batch_ws.patch_norm),
+                                 out=batch_ws.patch_norm)
+                largest = norm.max(axis=(-2, -1), keepdims=True)
+                if regularized:
+                    norm *= 1 - beta
+                    norm += beta * largest
+                else:
+                    norm[...] = largest / beta
+                np.conjugate(patches, out=patches)
+                patches *= dwave
+                patches /= norm
+                probe_step = patches.mean(axis=0)
+            dwave *= psi_step
+            add_patches(psi, dwave, indices, targets)
+            if update_probe:
+                probe += probe_step
+    return psi, probe
 
 
 def pad(phi, padded_shape):
@@ -414,67 +916,90 @@ def pad(phi, padded_shape):
 
 def exitwave(prb, psi, theta, h, v):
     """Compute the wavefront from probe function and track of psi"""
-    wave = np.zeros([h.size] + list(prb.shape), dtype=complex)
-    for m in range(h.size):
-        wave[m] = prb * psi[theta[m],
-                            h[m]:h[m] + prb.shape[0],
-                            v[m]:v[m] + prb.shape[1]]
-    return wave
+    indices = patch_indices(psi.shape, prb.shape, theta, h, v)
+    dtype = np.result_type(prb, psi, np.complex64)
+    return np.multiply(prb, get_patches(psi, indices), dtype=dtype)
 
 
 def simulate(data_shape=None, data_min=None,
              probe=None, theta=None, h=None, v=None,
-             psi=None, psi_min=None,
+             psi=None, psi_min=None, fft=None,
              **kwargs):
-    """Propagate the wavefront to the detector."""
+    """Propagate the wavefront to the detector.
+
+    Parameters
+    ----------
+    fft : string or :py:class:`FFTBackend`, optional
+        The FFT backend of this call; see :py:func:`get_fft_backend`.
+    """
     phi = pad(exitwave(probe, psi, theta, h, v), data_shape)
-    intensity = np.square(np.abs(np.fft.fft2(phi)))
+    fft = get_fft_backend(fft)
+    intensity = np.square(np.abs(fft.fft2(phi, out=phi)))
     return intensity.astype('float')
 
 
 def reconstruct(data=None, data_min=None,
                 probe=None, theta=None, h=None, v=None,
                 psi=None, psi_min=None,
-                algorithm=None, niter=1, **kwargs):
+                algorithm=None, niter=1, update_probe=False, **kwargs):
     """Reconstruct the `psi` and `probe` using the given `algorithm`.
 
     Parameters
     ----------
-    probe : (H, V, P) :py:class:`numpy.array` float
+    probe : (H, V) :py:class:`numpy.array` complex
         The initial guess for the illumnination function of each measurement.
-    psi : (T, H, V, P) :py:class:`numpy.array` float
+    psi : (T, H, V) :py:class:`numpy.array` complex
         The inital guess of the object transmission function at each angle.
     algorithm : string
         The name of one of the following algorithms to use for reconstructing:
 
             * grad : gradient descent
+            * nesterov : gradient descent with Nesterov momentum; see the
+              `momentum` of :py:func:`grad`, 0.9 by default.
+            * epie : extended ptychographical iterative engine; see
+              :py:func:`pie`.
+            * rpie : regularized ePIE; see :py:func:`pie`.
+
+    update_probe : bool
+        Also refine the probe and return it; only for epie and rpie.
+    batch_size : int, optional
+        Stream the positions in mini-batches of this size; see
+        :py:func:`grad`. Use `shuffle=True` to visit them in a random order.
 
     Returns
     -------
-    new_probe : (M, H, V, P) :py:class:`numpy.array` float
-        The updated illumination function of each measurement.
-    new_psi : (T, H, V, P) :py:class:`numpy.array` float
+    new_psi : (T, H, V) :py:class:`numpy.array` complex
         The updated obect transmission function at each angle.
+    new_probe : (H, V) :py:class:`numpy.array` complex
+        The updated illumination function; only if `update_probe`.
     """
     data, data_min, probe, theta, h, v, psi, psi_min = \
         _ptycho_interface(data, data_min,
                           probe, theta, h, v,
                           psi, psi_min, **kwargs)
-    # Send data to c function
     logger.info("{} on {:,d} element grid for {:,d} iterations".format(
                 algorithm, data.size, niter))
     # Add new algorithms here
-    # TODO: The size of this function may be reduced further if all recon clibs
-    #   have a standard interface. Perhaps pass unique params to a generic
-    #   struct or array.
-    if algorithm is "grad":
-        new_psi = grad(data=data,
-                       probe=probe.view(complex).squeeze(),
+    new_probe = probe
+    if algorithm == "grad" or algorithm == "nesterov":
+        if update_probe:
+            raise ValueError("The {} algorithm cannot update the "
+                             "probe.".format(algorithm))
+        if algorithm == "nesterov":
+            kwargs.setdefault('momentum', 0.9)
+        new_psi = grad(data=data, data_min=data_min,
+                       probe=probe, theta=theta, h=h, v=v,
+                       psi=psi, psi_min=psi_min,
                        niter=niter, **kwargs)
-        assert np.iscomplexobj(new_psi)
-        new_psi = new_psi.view(float).reshape(
-            line_integrals.shape)
+    elif algorithm == "epie" or algorithm == "rpie":
+        new_psi, new_probe = pie(data=data, data_min=data_min,
+                                 probe=probe, theta=theta, h=h, v=v,
+                                 psi=psi, psi_min=psi_min,
+                                 niter=niter, update_probe=update_probe,
+                                 regularized=algorithm == "rpie", **kwargs)
     else:
         raise ValueError("The {} algorithm is not an available.".format(
             algorithm))
+    if update_probe:
+        return new_psi, new_probe
     return new_psi
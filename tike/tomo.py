@@ -98,18 +98,29 @@ import numpy as np
 from . import utils
 from tike.externs import LIBTIKE
 import logging
+import ctypes
+import functools
+import multiprocessing
+import threading
 
 __author__ = "Doga Gursoy, Daniel Ching"
 __copyright__ = "Copyright (c) 2018, UChicago Argonne, LLC."
 __docformat__ = 'restructuredtext en'
 __all__ = ["reconstruct",
            "forward",
+           "reconstruct_many",
+           "forward_many",
+           "Projector",
            ]
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The compress flags of projector_new in projector.h
+_COMPRESS = 1
+_HALF_LENGTHS = 2
+
 
 def _tomo_interface(obj, obj_min,
                     probe, theta, h, v,
@@ -121,6 +132,25 @@ def _tomo_interface(obj, obj_min,
     if obj is None:
         raise ValueError()
     obj = utils.as_float32(obj)
+    obj_min, probe, theta, h, v = _probe_interface(obj_min, probe,
+                                                   theta, h, v)
+    return (obj, obj_min, probe, theta, h, v)
+
+
+def _probe_interface(obj_min, probe, theta, h, v):
+    """Set default values for the probe and its positions.
+
+    The probe is not expanded into one ray per probe pixel. The ray through
+    probe pixel `(i, j)` at position `m` is at
+    `(theta[m], h[m] + i + 0.5, v[m] + j + 0.5)`.
+
+    Returns
+    -------
+    obj_min : (3, ) float32
+    probe : (H, V) float32
+    theta, h, v : (M, ) float32
+        The coordinates of each probe position.
+    """
     if obj_min is None:
         obj_min = (-0.5, -0.5, -0.5)  # (z, x, y)
     obj_min = utils.as_float32(obj_min)
@@ -129,142 +159,787 @@ def _tomo_interface(obj, obj_min,
     probe = utils.as_float32(probe)
     if theta is None:
         raise ValueError()
-    theta = utils.as_float32(theta)
+    theta = utils.as_float32(theta).ravel()
     if h is None:
         h = np.full(theta.shape, obj_min[2])
-    h = utils.as_float32(h)
+    h = utils.as_float32(h).ravel()
     if v is None:
         v = np.full(theta.shape, obj_min[0])
-    v = utils.as_float32(v)
+    v = utils.as_float32(v).ravel()
     assert theta.size == h.size == v.size, \
         "The size of theta, h, v must be the same as the number of probes."
-    # Generate a grid of offset vectors
-    H, V = probe.shape
-    gh = (np.arange(H) + 0.5)
-    gv = (np.arange(V) + 0.5)
-    dh, dv = np.meshgrid(gh, gv, indexing='ij')
-    # Duplicate the trajectory by size of probe
-    M = theta.size
-    th1 = np.repeat(theta, H*V).reshape(M, H, V)
-    h1 = (np.repeat(h, H*V).reshape(M, H, V) + dh)
-    v1 = (np.repeat(v, H*V).reshape(M, H, V) + dv)
-    assert th1.shape == h1.shape == v1.shape
-    # logger.info(" _tomo_interface says {}".format("Hello, World!"))
-    return (obj, obj_min, probe, th1, h1, v1)
+    return (obj_min, probe, theta, h, v)
+
+
+def _unique_lines(theta, h):
+    """Return the unique (theta, h) lines and the line of each position.
+
+    All of the rays are perpendicular to `z`, so rays which differ only in
+    `v` cross the same pixels in their own `z` slice.
+
+    Returns
+    -------
+    lines : (L, 2) float32
+        The (theta, h) of each unique line in C-contiguous columns.
+    line : (M, ) int64
+        The index of the line of each position.
+    """
+    lines, line = np.unique(np.stack([theta.ravel(), h.ravel()], axis=1),
+                            axis=0, return_inverse=True)
+    lines = np.asfortranarray(lines, dtype=np.float32)
+    line = utils.as_int64(line.reshape(theta.shape))
+    return lines, line
+
+
+def _subset_order(nangle, nsubset=None, order='sequential'):
+    """Group the angles into subsets and return them in processing order.
+
+    The angles are assigned to subsets by interleaving, so that every subset
+    spans the whole angular range: subset `s` holds angles `s`, `s + nsubset`,
+    `s + 2 * nsubset`, etc.
+
+    Parameters
+    ----------
+    nangle : int
+        The number of angles.
+    nsubset : int, optional
+        The number of subsets. One subset per angle by default.
+    order : string
+        The order in which the subsets are processed:
+
+            * sequential : in order of increasing angle.
+            * random : a random permutation.
+            * golden : step through the subsets by the golden ratio, so that
+                consecutive subsets are far apart.
+
+    Returns
+    -------
+    angles : (nangle, ) int32
+        The indices of the angles in processing order.
+    subset_start : (nsubset + 1, ) int32
+        Subset `s` is `angles[subset_start[s]:subset_start[s+1]]`.
+    """
+    if nsubset is None:
+        nsubset = nangle
+    nsubset = max(1, min(int(nsubset), nangle))
+    subsets = [np.arange(s, nangle, nsubset) for s in range(nsubset)]
+    if order == 'sequential':
+        sequence = np.arange(nsubset)
+    elif order == 'random':
+        sequence = np.random.permutation(nsubset)
+    elif order == 'golden':
+        golden = (np.sqrt(5) - 1) / 2
+        sequence = np.argsort(np.argsort(np.arange(nsubset) * golden % 1))
+    else:
+        raise ValueError("The {} subset order is not available.".format(
+            order))
+    angles = np.concatenate([subsets[s] for s in sequence] + [[]])
+    subset_start = np.cumsum([0] + [subsets[s].size for s in sequence])
+    return utils.as_int32(angles), utils.as_int32(subset_start)
+
+
+def _synchronized(method):
+    """Hold the lock of the Projector while the method runs."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Projector(object):
+    """A cached system matrix for one scan geometry.
+
+    Tracing the rays through the grid is the most expensive part of a
+    projection. A Projector traces the rays of the `probe` at each position
+    once and keeps the intersections in the C library, so the same geometry
+    can be reused by many calls to :py:meth:`forward`, :py:meth:`back`, and
+    :py:meth:`reconstruct`. Rays which share `theta` and `h` cross the same
+    pixels in each `z` slice, so each unique line is traced and stored only
+    once no matter how many rows the probe has. The intersections are
+    released by :py:meth:`free` or when the Projector is used as a context
+    manager and the context exits.
+
+    The C library has no global state, and the GIL is released while it
+    runs, so different Projectors may be used from different threads at the
+    same time. Each Projector keeps work buffers, so calls to one Projector
+    from several threads are run one at a time.
+
+    Parameters
+    ----------
+    obj_shape : (3, ) int
+        The shape (Z, X, Y) of the `obj` grid.
+    obj_min, probe, theta, h, v
+        See the description of this module.
+    block_size : int, optional
+        If given, do not cache the intersections. Instead, each projection
+        traces `block_size` unique lines at a time, applies them, and discards
+        them. Memory for the intersections is then bounded by about
+        `block_size * (X + Y)` instead of growing with the number of rays.
+    compress : bool, optional
+        Cache the intersections compressed. The pixels of each line are
+        stored as 16-bit differences, so an intersection takes about 6 bytes
+        instead of the 20 bytes of the uncompressed intersections and their
+        copy sorted by pixel. The lines are decompressed a block at a time
+        when used. Back projections scatter instead of gather.
+    half_lengths : bool, optional
+        Also store the intersection lengths as half precision floats, about
+        4 bytes per intersection. The lengths keep about 3 significant
+        digits. Implies `compress`.
+
+    Example
+    -------
+    >>> with Projector(obj.shape, obj_min, probe, theta, h, v) as A:
+    ...     for i in range(100):
+    ...         obj = A.reconstruct(obj, line_integrals, 'sirt', niter=1)
+    """
+
+    def __init__(self, obj_shape, obj_min=None,
+                 probe=None, theta=None, h=None, v=None,
+                 block_size=None, compress=False, half_lengths=False,
+                 **kwargs):
+        # Reentrant so reconstruct callbacks can use the Projector
+        self._lock = threading.RLock()
+        self.obj_shape = tuple(int(n) for n in obj_shape[0:3])
+        assert len(self.obj_shape) == 3, "The obj must have 3 dimensions."
+        if block_size is not None and block_size <= 0:
+            raise ValueError("The block_size must be a positive integer.")
+        self.obj_min, probe, theta, h, v \
+            = _probe_interface(obj_min, probe, theta, h, v)
+        assert probe.ndim == 2, "The probe must have 2 dimensions."
+        self.data_shape = theta.shape + probe.shape
+        lines, line = _unique_lines(theta, h)
+        # Rays through zero probe pixels are skipped by the C library
+        mask = np.ascontiguousarray(utils.as_uint8(probe != 0))
+        nactive = np.count_nonzero(np.any(mask, axis=1))
+        dh = utils.as_float32(np.arange(probe.shape[0]) + 0.5)
+        dv = utils.as_float32(np.arange(probe.shape[1]) + 0.5)
+        # The lines are sorted by theta, so each angle is a range of lines
+        self._angle_start = utils.as_int64(nactive * np.concatenate([
+            [0],
+            np.flatnonzero(np.diff(lines[:, 0])) + 1,
+            [lines.shape[0]],
+        ]))
+        logger.info("trace {:,d} lines through {:,d} element grid "
+                    "for {:,d} rays".format(lines.shape[0] * nactive,
+                                            int(np.prod(self.obj_shape)),
+                                            int(np.prod(self.data_shape))))
+        LIBTIKE.projector_new.restype = ctypes.c_void_p
+        handle = LIBTIKE.projector_new(
+            utils.as_c_float(self.obj_min[0]),
+            utils.as_c_float(self.obj_min[1]),
+            utils.as_c_float(self.obj_min[2]),
+            utils.as_c_float(self.obj_shape[0]),
+            utils.as_c_float(self.obj_shape[1]),
+            utils.as_c_float(self.obj_shape[2]),
+            utils.as_c_int(self.obj_shape[0]),
+            utils.as_c_int(self.obj_shape[1]),
+            utils.as_c_int(self.obj_shape[2]),
+            utils.as_c_float_p(lines[:, 0]),
+            utils.as_c_float_p(lines[:, 1]),
+            utils.as_c_int64(lines.shape[0]),
+            utils.as_c_int64_p(line),
+            utils.as_c_float_p(v),
+            utils.as_c_int64(v.size),
+            utils.as_c_float_p(dh),
+            utils.as_c_int(dh.size),
+            utils.as_c_float_p(dv),
+            utils.as_c_int(dv.size),
+            utils.as_c_uint8_p(mask),
+            utils.as_c_int((_COMPRESS if compress or half_lengths else 0)
+                           | (_HALF_LENGTHS if half_lengths else 0)),
+            utils.as_c_int64(0 if block_size is None else block_size))
+        if handle is None:
+            self._handle = None
+            raise MemoryError(
+                "Could not trace {:,d} lines through a {} grid. Each (x, y) "
+                "plane may have at most {:,d} pixels; try a smaller grid or "
+                "a block_size.".format(lines.shape[0] * nactive,
+                                       self.obj_shape,
+                                       np.iinfo(np.int32).max))
+        self._handle = ctypes.c_void_p(handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.free()
+
+    def __del__(self):
+        self.free()
+
+    @_synchronized
+    def free(self):
+        """Release the intersections held by the C library."""
+        if getattr(self, '_handle', None) is not None:
+            LIBTIKE.projector_free.restype = utils.as_c_void_p()
+            LIBTIKE.projector_free(self._handle)
+            self._handle = None
+
+    def _get_stats(self):
+        stats = utils.ProjectorStats()
+        LIBTIKE.projector_get_stats.restype = utils.as_c_void_p()
+        LIBTIKE.projector_get_stats(self._handle, ctypes.byref(stats))
+        return stats.as_dict()
+
+    @_synchronized
+    def profile(self):
+        """Return the wall times and counters of the work done by the C
+        library since this Projector was created.
+
+        Returns
+        -------
+        stats : dict
+            The times in seconds of each phase; trace, sort, forward, back,
+            and update; and the numbers of lines traced, intersections,
+            bytes allocated, and solver iterations. See `projector_stats` in
+            projector.h.
+        """
+        if self._handle is None:
+            raise ValueError("This Projector has been freed.")
+        return self._get_stats()
+
+    def _check_obj(self, obj):
+        """Return the obj as float32 and its number of channels."""
+        if self._handle is None:
+            raise ValueError("This Projector has been freed.")
+        obj = np.ascontiguousarray(utils.as_float32(obj))
+        assert obj.shape[0:3] == self.obj_shape and obj.ndim in (3, 4), \
+            "The obj must have shape {} or {} + (P, ).".format(
+                self.obj_shape, self.obj_shape)
+        nchannel = obj.shape[3] if obj.ndim == 4 else 1
+        return obj, nchannel
+
+    def _check_data(self, line_integrals, nchannel=1):
+        line_integrals = np.ascontiguousarray(
+            utils.as_float32(line_integrals))
+        assert line_integrals.size == np.prod(self.data_shape) * nchannel, \
+            "The line_integrals must have shape {} with {} channels.".format(
+                self.data_shape, nchannel)
+        return line_integrals
+
+    @_synchronized
+    def forward(self, obj):
+        """Compute line integrals over an obj; i.e. simulate data acquisition.
+
+        All of the channels of the obj are projected in one pass over the
+        intersections.
+
+        Returns
+        -------
+        line_integrals : (M, H, V) or (M, H, V, P) :py:class:`numpy.array`
+            float
+        """
+        obj, nchannel = self._check_obj(obj)
+        return self._forward(obj, nchannel)
+
+    def _forward(self, obj, nchannel):
+        line_integrals = np.zeros(self.data_shape + obj.shape[3:],
+                                  dtype=np.float32)
+        LIBTIKE.projector_forward.restype = ctypes.c_int
+        status = LIBTIKE.projector_forward(
+            self._handle,
+            utils.as_c_float_p(obj),
+            utils.as_c_float_p(line_integrals),
+            utils.as_c_int(nchannel))
+        if status != 0:
+            raise MemoryError("Could not allocate the memory to project.")
+        return line_integrals
+
+    @_synchronized
+    def back(self, line_integrals, obj=None):
+        """Back project `line_integrals` over the `obj` grid.
+
+        The back projection is added to `obj` when it is given. The
+        `line_integrals` may have a trailing channel dimension.
+
+        Returns
+        -------
+        obj : (Z, X, Y) or (Z, X, Y, P) :py:class:`numpy.array` float
+        """
+        if obj is None:
+            channels = tuple(np.shape(line_integrals)[len(self.data_shape):])
+            obj = np.zeros(self.obj_shape + channels, dtype=np.float32)
+        obj, nchannel = self._check_obj(obj)
+        line_integrals = self._check_data(line_integrals, nchannel)
+        LIBTIKE.projector_back.restype = ctypes.c_int
+        status = LIBTIKE.projector_back(
+            self._handle,
+            utils.as_c_float_p(line_integrals),
+            utils.as_c_float_p(obj),
+            utils.as_c_int(nchannel))
+        if status != 0:
+            raise MemoryError("Could not allocate the memory to project.")
+        return obj
+
+    @_synchronized
+    def reconstruct(self, obj, line_integrals,
+                    algorithm=None, niter=0,
+                    subsets=None, order='sequential', relax=1.0,
+                    tol=0, stats=None, callback=None, chunk=None, **kwargs):
+        """Reconstruct the `obj` using the given `algorithm`.
+
+        See :py:func:`reconstruct` for a description of the parameters. The
+        times and counters in `stats` are those of this call only.
+        """
+        assert niter >= 0, "Number of iterations should be >= 0"
+        obj, nchannel = self._check_obj(obj)
+        line_integrals = self._check_data(line_integrals, nchannel)
+        before = self._get_stats()
+        logger.info("{} on {:,d} element grid for {:,d} iterations".format(
+                    algorithm, obj.size, niter))
+        args = (obj, line_integrals, nchannel, algorithm, subsets, order,
+                relax, tol)
+        # The residual of the returned obj costs a forward projection
+        want_residual = stats is not None or callback is not None
+        history = None
+        if callback is None and chunk is None:
+            niter, residual = self._solve(niter, False, want_residual, *args)
+        else:
+            # Return to Python every chunk iterations
+            chunk = 1 if chunk is None else chunk
+            assert chunk > 0, "The chunk must be a positive integer."
+            history = list()
+            residual = np.nan
+            done = 0
+            while done < niter:
+                todo = min(chunk, niter - done)
+                count, residual = self._solve(todo, done > 0, want_residual,
+                                              *args)
+                done += count
+                if want_residual and np.isnan(residual):
+                    residual = self._residual(obj, line_integrals, nchannel)
+                history.append(residual)
+                # The solver stopped itself at tol
+                if count < todo:
+                    break
+                if callback is not None and callback(done, residual, obj):
+                    logger.info("{} stopped by the callback".format(
+                                algorithm))
+                    break
+            niter = done
+        if not np.isnan(residual):
+            logger.info("{} stopped after {:,d} iterations with relative "
+                        "residual {:.3g}".format(algorithm, niter, residual))
+        if stats is not None:
+            stats['niter'] = niter
+            stats['residual'] = residual
+            if history is not None:
+                stats['history'] = history
+            after = self._get_stats()
+            for key in after:
+                stats[key] = after[key] - before[key]
+        return obj
+
+    def _residual(self, obj, line_integrals, nchannel):
+        """Return the relative residual of the obj."""
+        data_norm = np.linalg.norm(line_integrals)
+        error = np.linalg.norm(self._forward(obj, nchannel) - line_integrals)
+        return error / data_norm if data_norm > 0 else error
+
+    def _solve(self, niter, resume, want_residual, obj, line_integrals,
+               nchannel, algorithm, subsets, order, relax, tol):
+        """Run niter iterations of the algorithm in the C library.
+
+        The residual is only reported when `want_residual`, because it may
+        cost the C library another forward projection.
+
+        Returns
+        -------
+        niter : int
+            The number of iterations completed.
+        residual : float
+            The relative residual of the returned obj or nan.
+        """
+        residual = ctypes.c_float(np.nan)
+        residual_p = ctypes.byref(residual) if want_residual else None
+        # Add new tomography algorithms here
+        if algorithm == "art":
+            angles, _ = _subset_order(self._angle_start.size - 1,
+                                      None, order)
+            LIBTIKE.projector_art.restype = ctypes.c_int
+            status = LIBTIKE.projector_art(
+                self._handle,
+                utils.as_c_float_p(line_integrals),
+                utils.as_c_float_p(obj),
+                utils.as_c_int(nchannel),
+                utils.as_c_int(niter),
+                utils.as_c_float(relax),
+                utils.as_c_int(angles.size),
+                utils.as_c_int64_p(self._angle_start),
+                utils.as_c_int_p(angles))
+            niter = niter if status == 0 else -1
+        elif algorithm == "sart":
+            angles, subset_start = _subset_order(self._angle_start.size - 1,
+                                                 subsets, order)
+            LIBTIKE.projector_sart.restype = ctypes.c_int
+            status = LIBTIKE.projector_sart(
+                self._handle,
+                utils.as_c_float_p(line_integrals),
+                utils.as_c_float_p(obj),
+                utils.as_c_int(nchannel),
+                utils.as_c_int(niter),
+                utils.as_c_float(relax),
+                utils.as_c_int(angles.size),
+                utils.as_c_int64_p(self._angle_start),
+                utils.as_c_int_p(angles),
+                utils.as_c_int(subset_start.size - 1),
+                utils.as_c_int_p(subset_start))
+            niter = niter if status == 0 else -1
+        elif algorithm == "sirt":
+            LIBTIKE.projector_sirt.restype = ctypes.c_int
+            niter = LIBTIKE.projector_sirt(
+                self._handle,
+                utils.as_c_float_p(line_integrals),
+                utils.as_c_float_p(obj),
+                utils.as_c_int(nchannel),
+                utils.as_c_int(niter),
+                utils.as_c_float(tol),
+                residual_p)
+        elif algorithm == "cgls":
+            # Continue the conjugate directions of the last chunk
+            LIBTIKE.projector_cgls.restype = ctypes.c_int
+            niter = LIBTIKE.projector_cgls(
+                self._handle,
+                utils.as_c_float_p(line_integrals),
+                utils.as_c_float_p(obj),
+                utils.as_c_int(nchannel),
+                utils.as_c_int(niter),
+                utils.as_c_float(tol),
+                utils.as_c_int(resume),
+                residual_p)
+        elif algorithm == "grad":
+            LIBTIKE.projector_grad.restype = ctypes.c_int
+            niter = LIBTIKE.projector_grad(
+                self._handle,
+                utils.as_c_float_p(line_integrals),
+                utils.as_c_float_p(obj),
+                utils.as_c_int(nchannel),
+                utils.as_c_int(niter),
+                utils.as_c_float(tol),
+                residual_p)
+        else:
+            raise ValueError("The {} algorithm is not an available.".format(
+                algorithm))
+        if niter < 0:
+            raise MemoryError("Could not allocate the memory to run {}."
+                              .format(algorithm))
+        return niter, residual.value
 
 
 def reconstruct(obj=None, obj_min=None,
                 probe=None, theta=None, h=None, v=None,
                 line_integrals=None,
-                algorithm=None, niter=0, **kwargs):
+                algorithm=None, niter=0,
+                nslab=None, processes=None, **kwargs):
     """Reconstruct the `obj` using the given `algorithm`.
 
     Parameters
     ----------
-    obj : (Z, X, Y, P) :py:class:`numpy.array` float
-        The initial guess for the reconstruction.
+    obj : (Z, X, Y) or (Z, X, Y, P) :py:class:`numpy.array` float
+        The initial guess for the reconstruction. Each of the `P` channels
+        is reconstructed independently from the matching channel of the
+        `line_integrals`, but all channels share each pass over the
+        intersections.
+    line_integrals : (M, H, V) or (M, H, V, P) :py:class:`numpy.array` float
     algorithm : string
         The name of one of the following algorithms to use for reconstructing:
 
             * art : Algebraic Reconstruction Technique
-                :cite:`gordon1970algebraic`.
+                :cite:`gordon1970algebraic`. A row-action method which
+                corrects the `obj` after projecting each ray.
+            * sart : Ordered-Subsets Simultaneous Algebraic Reconstruction
+                Technique :cite:`andersen1984simultaneous`. Corrects the `obj`
+                after projecting each subset of angles.
             * sirt : Simultaneous Iterative Reconstruction Technique.
+            * cgls : Conjugate Gradient Least Squares
+                :cite:`hestenes1952methods`. Usually reaches the quality of
+                many sirt iterations in a few iterations.
+            * grad : Gradient descent with a step size from the operator
+                norm, which is estimated once per :py:class:`Projector`.
 
     niter : int
-        The number of iterations to perform
+        The number of iterations to perform; for art and sart, the number of
+        passes over all of the angles.
+    subsets : int, optional
+        The number of subsets of angles for sart. Each angle is its own
+        subset by default.
+    order : string
+        The order of the angles for art or the subsets for sart: sequential,
+        random, or golden. See :py:func:`_subset_order`.
+    relax : float
+        The relaxation parameter of art and sart.
+    tol : float
+        Stop sirt, cgls, or grad early once the relative residual of the line
+        integrals, ``||line_integrals - forward(obj)|| / ||line_integrals||``,
+        is not more than `tol`.
+    stats : dict, optional
+        If given, this dictionary is filled with information about the run:
+
+            * niter : The number of iterations completed.
+            * residual : The relative residual of the returned obj or nan if
+                the algorithm does not compute it.
+            * history : The relative residual after each chunk of iterations
+                when the iterations are run in chunks.
+            * The wall times of each phase in the C library and its counters
+                of work; see :py:meth:`Projector.profile`. These include
+                tracing the rays.
+    callback : callable, optional
+        Run the iterations in chunks and call ``callback(niter, residual,
+        obj)`` after each chunk with the number of iterations completed so
+        far, the relative residual, and the current estimate. Return True to
+        stop early. The `obj` must not be modified. For art and sart, the
+        residual is computed with an extra forward projection. The callback
+        of :py:meth:`Projector.reconstruct` may call back into the same
+        Projector, e.g. its `forward`, but must not run another
+        reconstruction on it.
+    chunk : int, optional
+        The number of iterations in each chunk; 1 by default when there is a
+        callback. Give a chunk without a callback to only record the
+        history. Chunks of cgls continue the same conjugate directions.
+    block_size : int, optional
+        Trace this many lines at a time instead of caching every
+        intersection. See :py:class:`Projector`.
+    compress, half_lengths : bool, optional
+        Cache the intersections compressed. See :py:class:`Projector`.
+    nslab : int, optional
+        Split the `obj` into this many slabs along `z` and reconstruct the
+        slabs in parallel in a pool of processes. The rays never cross `z`
+        slices, so art, sart, and sirt give the same result as without
+        slabs; cgls and grad choose their step sizes and stop separately for
+        each slab. The `obj` and `line_integrals` are shared with the
+        processes through :py:mod:`multiprocessing.shared_memory` instead of
+        being pickled. The processes are spawned, so scripts must guard their
+        entry point with ``if __name__ == '__main__':``. A `callback` or
+        `chunk` cannot be used with slabs.
+    processes : int, optional
+        The number of processes in the pool; one for each slab by default.
+        Each process also uses OpenMP, so consider `OMP_NUM_THREADS`.
 
     Returns
     -------
-    obj : (Z, X, Y, P) :py:class:`numpy.array` float
+    obj : (Z, X, Y) or (Z, X, Y, P) :py:class:`numpy.array` float
         The updated obj grid.
     """
-    obj, obj_min, probe, theta, h, v \
-        = _tomo_interface(obj, obj_min, probe, theta, h, v)
-    assert niter >= 0, "Number of iterations should be >= 0"
-    # Send data to c function
-    logger.info("{} on {:,d} element grid for {:,d} iterations".format(
-                algorithm, obj.size, niter))
-    ngrid = obj.shape
-    line_integrals = utils.as_float32(line_integrals)
-    theta = utils.as_float32(theta)
-    h = utils.as_float32(h)
-    v = utils.as_float32(v)
+    if obj is None:
+        raise ValueError()
     obj = utils.as_float32(obj)
-    # Add new tomography algorithms here
-    # TODO: The size of this function may be reduced further if all recon clibs
-    #   have a standard interface. Perhaps pass unique params to a generic
-    #   struct or array.
-    if algorithm is "art":
-        LIBTIKE.art.restype = utils.as_c_void_p()
-        LIBTIKE.art(
-            utils.as_c_float(obj_min[0]),
-            utils.as_c_float(obj_min[1]),
-            utils.as_c_float(obj_min[2]),
-            utils.as_c_int(ngrid[0]),
-            utils.as_c_int(ngrid[1]),
-            utils.as_c_int(ngrid[2]),
-            utils.as_c_float_p(line_integrals),
-            utils.as_c_float_p(theta),
-            utils.as_c_float_p(h),
-            utils.as_c_float_p(v),
-            utils.as_c_int(line_integrals.size),
-            utils.as_c_float_p(obj),
-            utils.as_c_int(niter))
-    elif algorithm is "sirt":
-        LIBTIKE.sirt.restype = utils.as_c_void_p()
-        LIBTIKE.sirt(
-            utils.as_c_float(obj_min[0]),
-            utils.as_c_float(obj_min[1]),
-            utils.as_c_float(obj_min[2]),
-            utils.as_c_int(ngrid[0]),
-            utils.as_c_int(ngrid[1]),
-            utils.as_c_int(ngrid[2]),
-            utils.as_c_float_p(line_integrals),
-            utils.as_c_float_p(theta),
-            utils.as_c_float_p(h),
-            utils.as_c_float_p(v),
-            utils.as_c_int(line_integrals.size),
-            utils.as_c_float_p(obj),
-            utils.as_c_int(niter))
-    else:
-        raise ValueError("The {} algorithm is not an available.".format(
-            algorithm))
+    if nslab is not None:
+        if (kwargs.get('callback') is not None
+                or kwargs.get('chunk') is not None):
+            raise ValueError("A callback or chunk cannot be used with nslab; "
+                             "the slabs are reconstructed in other "
+                             "processes.")
+        return _reconstruct_slabs(obj, obj_min, probe, theta, h, v,
+                                  line_integrals, algorithm, niter,
+                                  nslab, processes, **kwargs)
+    with Projector(obj.shape, obj_min, probe, theta, h, v, **kwargs) as A:
+        obj = A.reconstruct(obj, line_integrals, algorithm, niter, **kwargs)
+        if kwargs.get('stats') is not None:
+            kwargs['stats'].update(A.profile())
+        return obj
+
+
+def _slab_positions(obj_min, probe, v, z0, z1):
+    """Return the positions with a ray in the `z` slices [z0, z1).
+
+    The slices are computed in float32 like the C library, so each ray
+    belongs to exactly one slab.
+    """
+    dv = utils.as_float32(np.arange(probe.shape[1]) + 0.5)
+    rows = np.floor((v[:, None] + dv) - obj_min[0])
+    inside = (rows >= z0) & (rows < z1) & np.any(probe != 0, axis=0)
+    return np.flatnonzero(np.any(inside, axis=1))
+
+
+def _reconstruct_slab(job):
+    """Reconstruct one slab of the shared obj in a worker process.
+
+    The obj slab is a contiguous view of the shared memory, so it is updated
+    in place. Only the positions with rays in the slab are traced.
+    """
+    from multiprocessing import shared_memory
+    (obj_name, obj_shape, data_name, data_shape, z0, z1,
+     obj_min, probe, theta, h, v, positions, algorithm, niter, kwargs) = job
+    obj_memory = shared_memory.SharedMemory(name=obj_name)
+    data_memory = shared_memory.SharedMemory(name=data_name)
+    stats = dict()
+    try:
+        obj = np.ndarray(obj_shape, dtype=np.float32, buffer=obj_memory.buf)
+        data = np.ndarray(data_shape, dtype=np.float32,
+                          buffer=data_memory.buf)
+        slab_min = np.array(obj_min, dtype=np.float32)
+        slab_min[0] += z0
+        with Projector(obj[z0:z1].shape, slab_min, probe, theta[positions],
+                       h[positions], v[positions], **kwargs) as A:
+            A.reconstruct(obj[z0:z1], data[positions], algorithm, niter,
+                          stats=stats, **kwargs)
+            stats.update(A.profile())
+        # The views must be released before the memory is closed
+        del obj, data
+    finally:
+        obj_memory.close()
+        data_memory.close()
+    return stats
+
+
+def _reconstruct_slabs(obj, obj_min, probe, theta, h, v, line_integrals,
+                       algorithm, niter, nslab, processes=None, stats=None,
+                       **kwargs):
+    """Reconstruct `nslab` slabs of the obj in parallel processes.
+
+    See :py:func:`reconstruct`.
+    """
+    from multiprocessing import shared_memory
+    obj_min, probe, theta, h, v = _probe_interface(obj_min, probe,
+                                                   theta, h, v)
+    line_integrals = utils.as_float32(line_integrals)
+    bounds = np.unique(np.linspace(0, obj.shape[0], int(nslab) + 1,
+                                   dtype=int))
+    obj_memory = shared_memory.SharedMemory(create=True,
+                                            size=max(obj.nbytes, 1))
+    data_memory = shared_memory.SharedMemory(
+        create=True, size=max(line_integrals.nbytes, 1))
+    try:
+        shared_obj = np.ndarray(obj.shape, dtype=np.float32,
+                                buffer=obj_memory.buf)
+        shared_obj[...] = obj
+        shared_data = np.ndarray(line_integrals.shape, dtype=np.float32,
+                                 buffer=data_memory.buf)
+        shared_data[...] = line_integrals
+        jobs = list()
+        for z0, z1 in zip(bounds[:-1], bounds[1:]):
+            positions = _slab_positions(obj_min, probe, v, z0, z1)
+            if positions.size > 0:
+                jobs.append((obj_memory.name, obj.shape,
+                             data_memory.name, line_integrals.shape,
+                             z0, z1, obj_min, probe, theta, h, v, positions,
+                             algorithm, niter, kwargs))
+        logger.info("{} on {:,d} slabs in {:,d} processes".format(
+                    algorithm, len(jobs), processes or len(jobs)))
+        results = list()
+        if jobs:
+            # Spawn instead of fork because OpenMP is not fork safe
+            pool = multiprocessing.get_context('spawn').Pool(
+                processes or len(jobs))
+            try:
+                results = pool.map(_reconstruct_slab, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        obj = np.array(shared_obj)
+        del shared_obj, shared_data
+    finally:
+        obj_memory.close()
+        obj_memory.unlink()
+        data_memory.close()
+        data_memory.unlink()
+    if stats is not None:
+        stats['niter'] = max([r['niter'] for r in results] + [0])
+        residuals = [r['residual'] for r in results
+                     if not np.isnan(r['residual'])]
+        stats['residual'] = max(residuals) if residuals else np.nan
+        # The work of the slabs adds up
+        for key, _ in utils.ProjectorStats._fields_:
+            stats[key] = sum(r[key] for r in results)
     return obj
 
 
 def forward(obj=None, obj_min=None,
             probe=None, theta=None, h=None, v=None,
-            **kwargs):
+            stats=None, **kwargs):
     """Compute line integrals over an obj; i.e. simulate data acquisition.
+
+    Parameters
+    ----------
+    obj : (Z, X, Y) or (Z, X, Y, P) :py:class:`numpy.array` float
+        The channels of the `obj` are projected together in one pass.
+    block_size : int, optional
+        Trace this many lines at a time instead of caching every
+        intersection. See :py:class:`Projector`.
+    compress, half_lengths : bool, optional
+        Cache the intersections compressed. See :py:class:`Projector`.
+    stats : dict, optional
+        If given, this dictionary is filled with the wall times of each phase
+        in the C library and its counters of work; see
+        :py:meth:`Projector.profile`.
+
+    Returns
+    -------
+    line_integrals : (M, H, V) or (M, H, V, P) :py:class:`numpy.array` float
     """
-    obj, obj_min, probe, theta, h, v \
-        = _tomo_interface(obj, obj_min, probe, theta, h, v)
-    # TODO: Remove zero valued probe rays
-    th1 = theta
-    h1 = h
-    v1 = v
-    line_integrals = np.zeros(th1.shape, dtype=np.float32)
-    # Send data to c function
-    logger.info("forward {:,d} element grid".format(obj.size))
-    logger.info("forward {:,d} rays".format(line_integrals.size))
+    if obj is None:
+        raise ValueError()
     obj = utils.as_float32(obj)
-    ngrid = obj.shape
-    th1 = utils.as_float32(th1)
-    h1 = utils.as_float32(h1)
-    v1 = utils.as_float32(v1)
-    line_integrals = utils.as_float32(line_integrals)
-    LIBTIKE.forward_project.restype = utils.as_c_void_p()
-    LIBTIKE.forward_project(
-        utils.as_c_float_p(obj),
-        utils.as_c_float(obj_min[0]),
-        utils.as_c_float(obj_min[1]),
-        utils.as_c_float(obj_min[2]),
-        utils.as_c_int(ngrid[0]),
-        utils.as_c_int(ngrid[1]),
-        utils.as_c_int(ngrid[2]),
-        utils.as_c_float_p(th1),
-        utils.as_c_float_p(h1),
-        utils.as_c_float_p(v1),
-        utils.as_c_int(th1.size),
-        utils.as_c_float_p(line_integrals))
-    return line_integrals
+    with Projector(obj.shape, obj_min, probe, theta, h, v, **kwargs) as A:
+        line_integrals = A.forward(obj)
+        if stats is not None:
+            stats.update(A.profile())
+        return line_integrals
+
+
+def _submit(function, jobs, executor=None, max_workers=None):
+    """Submit function(**job) for each job to a thread pool.
+
+    If no executor is given, a new ThreadPoolExecutor is shut down once the
+    jobs are submitted; the jobs still run to completion.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        return [executor.submit(function, **job) for job in jobs]
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+def reconstruct_many(jobs, executor=None, max_workers=None):
+    """Run many independent reconstructions at the same time in threads.
+
+    The C library releases the GIL, so the preparation of one job in Python
+    overlaps the computation of the others in C. Each job gets its own
+    :py:class:`Projector`. Each call into the C library also uses OpenMP, so
+    consider `OMP_NUM_THREADS` when `max_workers` is large.
+
+    Parameters
+    ----------
+    jobs : iterable of dict
+        The keyword arguments of :py:func:`reconstruct` for each job.
+    executor : :py:class:`concurrent.futures.Executor`, optional
+        Submit the jobs to this executor instead of a new thread pool.
+    max_workers : int, optional
+        The number of threads of the new thread pool.
+
+    Returns
+    -------
+    futures : list of :py:class:`concurrent.futures.Future`
+        The future `obj` of each job in the order of the `jobs`.
+
+    Example
+    -------
+    >>> futures = reconstruct_many(
+    ...     dict(obj=obj, probe=probe, theta=theta, line_integrals=data,
+    ...          algorithm='sirt', niter=niter) for niter in range(1, 100))
+    >>> recons = [future.result() for future in futures]
+    """
+    return _submit(reconstruct, jobs, executor, max_workers)
+
+
+def forward_many(jobs, executor=None, max_workers=None):
+    """Compute the line integrals of many independent jobs in threads.
+
+    See :py:func:`reconstruct_many`.
+
+    Parameters
+    ----------
+    jobs : iterable of dict
+        The keyword arguments of :py:func:`forward` for each job.
+
+    Returns
+    -------
+    futures : list of :py:class:`concurrent.futures.Future`
+        The future `line_integrals` of each job in the order of the `jobs`.
+    """
+    return _submit(forward, jobs, executor, max_workers)
@@ -64,15 +64,20 @@ __all__ = ['as_ndarray',
            'as_dtype',
            'as_float32',
            'as_int32',
+           'as_int64',
            'as_uint8',
            'as_uint16',
            'as_c_float_p',
            'as_c_int',
            'as_c_int_p',
+           'as_c_int64',
+           'as_c_int64_p',
+           'as_c_uint8_p',
            'as_c_float',
            'as_c_char_p',
            'as_c_void_p',
-           'as_c_bool']
+           'as_c_bool',
+           'ProjectorStats']
 
 
 logger = logging.getLogger(__name__)
@@ -100,6 +105,11 @@ def as_int32(arr):
     return as_dtype(arr, np.int32)
 
 
+def as_int64(arr):
+    arr = as_ndarray(arr, np.int64)
+    return as_dtype(arr, np.int64)
+
+
 def as_uint16(arr):
     arr = as_ndarray(arr, np.uint16)
     return as_dtype(arr, np.uint16)
@@ -124,6 +134,20 @@ def as_c_int_p(arr):
     return arr.ctypes.data_as(c_int_p)
 
 
+def as_c_int64(arr):
+    return ctypes.c_int64(arr)
+
+
+def as_c_int64_p(arr):
+    c_int64_p = ctypes.POINTER(ctypes.c_int64)
+    return arr.ctypes.data_as(c_int64_p)
+
+
+def as_c_uint8_p(arr):
+    c_uint8_p = ctypes.POINTER(ctypes.c_uint8)
+    return arr.ctypes.data_as(c_uint8_p)
+
+
 def as_c_float(arr):
     return ctypes.c_float(arr)
 
@@ -138,3 +162,22 @@ def as_c_void_p():
 
 def as_c_bool(arr):
     return ctypes.c_bool(arr)
+
+
+class ProjectorStats(ctypes.Structure):
+    """The wall times and counters of the work done by a projector.
+
+    This matches the projector_stats struct of projector.h.
+    """
+    _fields_ = [('trace_seconds', ctypes.c_double),
+                ('sort_seconds', ctypes.c_double),
+                ('forward_seconds', ctypes.c_double),
+                ('back_seconds', ctypes.c_double),
+                ('update_seconds', ctypes.c_double),
+                ('lines_traced', ctypes.c_int64),
+                ('intersections', ctypes.c_int64),
+                ('bytes_allocated', ctypes.c_int64),
+                ('iterations', ctypes.c_int64)]
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name, _ in self._fields_)